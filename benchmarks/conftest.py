@@ -0,0 +1,49 @@
+"""Benchmark suite of the hot paths, run with pytest-benchmark
+
+    pytest benchmarks                                  # small sizes
+    pytest benchmarks --full                           # also the largest sizes (1e6 rows, a year at 1 second, ...)
+    pytest benchmarks --benchmark-autosave             # save a JSON baseline in .benchmarks/
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:10%
+                                                       # compare with the last baseline, fail on a 10% regression
+
+The timings only compare on the same machine, so the baselines are not committed (.benchmarks/ is ignored).
+To check a branch, save a baseline of the main branch and compare the branch with it on the same machine:
+
+    git switch main && pytest benchmarks --benchmark-save=main
+    git switch my-branch && pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:10%
+
+--benchmark-compare alone compares with the latest saved run, --benchmark-compare=0001 with the run saved as 0001_*.json.
+
+On a busy or single core machine the small sizes vary by more than 10% from run to run, use
+--benchmark-min-rounds or a larger threshold there.
+
+All the inputs are generated with the fixed SEED so that two runs benchmark the same data.
+"""
+import pytest
+
+SEED = 42
+
+
+def pytest_addoption(parser):
+    parser.addoption("--full", action="store_true", help="run the benchmarks at the largest sizes")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "full: benchmark size only run with --full")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--full"):
+        return
+    skip = pytest.mark.skip(reason="largest size, run with --full")
+    for item in items:
+        if "full" in item.keywords:
+            item.add_marker(skip)
+
+
+def full(*values):
+    """Parameter values (or tuples of values) only benchmarked with --full."""
+    return [
+        pytest.param(*(value if isinstance(value, tuple) else (value,)), marks=pytest.mark.full)
+        for value in values
+    ]
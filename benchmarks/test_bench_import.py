@@ -0,0 +1,42 @@
+import re
+import subprocess
+import sys
+
+import pytest
+
+# cold start budget of `import mktmakingccy`, in microseconds (python -X importtime, cumulative)
+PACKAGE_IMPORT_BUDGET_US = 25_000
+
+_IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def import_times(statement: str) -> dict[str, tuple[int, int]]:
+    """Self and cumulative import time (us) of each module imported by the statement, in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True, check=True,
+    )
+    return {
+        match.group(4): (int(match.group(1)), int(match.group(2)))
+        for match in map(_IMPORT_TIME.match, result.stderr.splitlines())
+        if match
+    }
+
+
+def test_package_import_is_lazy():
+    statement = "import sys, mktmakingccy; print(sorted({'polars', 'numpy'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", statement], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_package_import_budget():
+    _, cumulative = import_times("import mktmakingccy")["mktmakingccy"]
+    assert cumulative < PACKAGE_IMPORT_BUDGET_US
+
+
+@pytest.mark.parametrize("module", ["mktmakingccy", "mktmakingccy.order_book", "mktmakingccy.backtest"])
+def test_cold_start(benchmark, module):
+    # a fresh interpreter per round, like a spawned sweep worker
+    benchmark.pedantic(
+        subprocess.run, args=([sys.executable, "-c", f"import {module}"],), kwargs={"check": True}, rounds=5
+    )
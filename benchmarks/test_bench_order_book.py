@@ -0,0 +1,137 @@
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+import pytest
+
+from mktmakingccy.order_book import ArrayOrderBook, OrderBook
+from mktmakingccy.trade import MarketOrder, match_market_orders
+from conftest import SEED, full
+
+ENGINES = [OrderBook, ArrayOrderBook]
+DEPTHS = [6, 15, 50]  # the default size ladder of get_base_pricing needs 6 levels
+
+
+def filled_book(engine, n_levels: int):
+    return engine(n_levels).get_base_pricing(datetime(2025, 1, 1), fair_price=100, spread=0.001)
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda engine: engine.__name__)
+@pytest.mark.parametrize("n_levels", DEPTHS)
+def test_update_order(benchmark, engine, n_levels):
+    book = filled_book(engine, n_levels)
+    rng = np.random.default_rng(SEED)
+    prices = (100 - rng.integers(1, 2 * n_levels, 1000) * 0.01).tolist()
+
+    def update_orders():
+        for price in prices:
+            book.update_order(price=price, size=100_000, side="bid")
+
+    benchmark(update_orders)
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda engine: engine.__name__)
+@pytest.mark.parametrize("n_levels", DEPTHS)
+def test_get_order_book(benchmark, engine, n_levels):
+    benchmark(filled_book(engine, n_levels).get_order_book)
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda engine: engine.__name__)
+@pytest.mark.parametrize("n_levels", DEPTHS)
+def test_get_depth(benchmark, engine, n_levels):
+    benchmark(filled_book(engine, n_levels).get_depth, 5)
+
+
+def update_stream(n_updates: int) -> tuple[list, list, list]:
+    """Random (price, size, side) stream around a fair price of 100, with some deletions (size 0)."""
+    rng = np.random.default_rng(SEED)
+    sides = np.where(rng.random(n_updates) < 0.5, "bid", "ask")
+    offsets = rng.integers(1, 40, n_updates) * 0.01
+    prices = np.where(sides == "bid", 100 - offsets, 100 + offsets)
+    sizes = rng.choice([0, 100_000, 500_000, 1_000_000], n_updates, p=[0.2, 0.5, 0.2, 0.1])
+    return prices.tolist(), sizes.tolist(), sides.tolist()
+
+
+# the Polars engine is much slower, it is only benchmarked on the shorter streams
+@pytest.mark.parametrize(
+    "engine, n_updates",
+    [(OrderBook, 1_000), (ArrayOrderBook, 1_000), (ArrayOrderBook, 100_000)]
+    + full((OrderBook, 20_000), (ArrayOrderBook, 1_000_000)),
+    ids=lambda value: value.__name__ if isinstance(value, type) else str(value),
+)
+def test_update_stream(benchmark, engine, n_updates):
+    prices, sizes, sides = update_stream(n_updates)
+
+    def replay():
+        book = engine(15)
+        for price, size, side in zip(prices, sizes, sides):
+            book.update_order(price=price, size=size, side=side)
+        book.get_order_book()
+
+    benchmark.pedantic(replay, rounds=3)
+
+
+def sweep_book(n_levels: int) -> OrderBook:
+    book = OrderBook(n_levels)
+    for i in range(n_levels):
+        # distinct sizes, as delete_order used to filter on the price or the size
+        book.update_order(price=100 + i * 0.01, size=1 + i * 1e-3, side="ask")
+    return book
+
+
+@pytest.mark.parametrize("n_swept", [1, 5, 20])
+def test_post_market_order_sweep(benchmark, n_swept):
+    size = sum(1 + i * 1e-3 for i in range(n_swept)) - 0.5  # ends inside the last swept level
+    benchmark.pedantic(
+        lambda book: MarketOrder(size, "bid").post_market_order(book),
+        setup=lambda: ((sweep_book(n_swept + 5),), {}),
+        rounds=20,
+    )
+
+
+@pytest.mark.parametrize("n_orders", [1_000, 10_000])
+def test_match_market_orders(benchmark, n_orders):
+    rng = np.random.default_rng(SEED)
+    orders = pl.DataFrame(
+        {
+            "timestamp": np.full(n_orders, np.datetime64("2025-01-01", "us")),
+            "side": rng.choice(["buy", "sell"], n_orders),
+            "size": rng.integers(1, 20, n_orders) * 100_000.0,
+        }
+    )
+    benchmark.pedantic(
+        lambda book: match_market_orders(book, orders, fair_price=100),
+        setup=lambda: ((filled_book(ArrayOrderBook, 15),), {}),
+        rounds=5,
+    )
+
+
+@pytest.mark.parametrize("queue_length", [10, 1_000])
+def test_order_queue_cancel_and_fill(benchmark, queue_length):
+    # cancels and partial fills in a long queue at the best level cost the same as in a short one
+    def setup():
+        book = filled_book(ArrayOrderBook, 15)
+        best_ask = book.get_best_ask()[0]
+        order_ids = [book.add_order(best_ask, 100_000, "ask", client=True) for _ in range(queue_length)]
+        return (book, order_ids), {}
+
+    def cancel_and_fill(book, order_ids):
+        for order_id in order_ids[-10:]:
+            book.cancel_order(order_id)
+        for _ in range(10):
+            book._asks.fill_best(1_000, np.datetime64("2025-01-01", "us"))
+
+    benchmark.pedantic(cancel_and_fill, setup=setup, rounds=20)
+
+
+@pytest.mark.parametrize("n_swept", [1, 5, 20])
+def test_sweep_kernel(benchmark, n_swept):
+    # one sweep and requote of n_swept levels, compiled with numba when it is installed
+    from mktmakingccy.order_book import FillBuffer
+
+    timestamp = np.datetime64("2025-01-01", "us")
+    benchmark.pedantic(
+        lambda book: book.get_side("ask").sweep(n_swept * 100_000 - 50_000, timestamp, 100.0, True, 13_500_000, FillBuffer()),
+        setup=lambda: ((filled_book(ArrayOrderBook, 50),), {}),
+        rounds=50,
+    )
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import polars as pl
+import pytest
+
+from mktmakingccy import utils
+from conftest import SEED, full
+
+
+def fair_prices(n_steps: int) -> pl.DataFrame:
+    return utils.simulate_fair_price(
+        end_timestamp=datetime(2025, 1, 1) + timedelta(minutes=n_steps - 1),
+        step_size_in_seconds=60,
+        seed=SEED,
+    )
+
+
+@pytest.mark.parametrize(
+    "step_size_in_seconds, end_timestamp",
+    [
+        (3600, datetime(2026, 1, 1)),  # a year at 1 hour
+        (60, datetime(2026, 1, 1)),  # a year at 1 minute
+        (1, datetime(2025, 1, 2)),  # a day at 1 second
+    ]
+    + full((1, datetime(2026, 1, 1))),  # a year at 1 second
+)
+def test_simulate_fair_price(benchmark, step_size_in_seconds, end_timestamp):
+    benchmark(
+        utils.simulate_fair_price,
+        end_timestamp=end_timestamp,
+        step_size_in_seconds=step_size_in_seconds,
+        seed=SEED,
+    )
+
+
+@pytest.mark.parametrize("n_rows", [10_000, 100_000] + full(1_000_000))
+def test_expanding_std(benchmark, n_rows):
+    series = np.random.default_rng(SEED).normal(0, 1e-3, n_rows)
+    benchmark(utils.expanding_std, series)
+
+
+@pytest.mark.parametrize("n_rows", [10_000, 100_000] + full(1_000_000))
+def test_compute_all_bid_ask(benchmark, n_rows):
+    benchmark(utils.compute_all_bid_ask, fair_prices(n_rows), 500_000_000)
+
+
+@pytest.mark.parametrize("n_rows", [10_000, 100_000] + full(1_000_000))
+def test_generate_market_order(benchmark, n_rows):
+    bid_ask = utils.compute_all_bid_ask(fair_prices(n_rows), 500_000_000)
+    benchmark(utils.generate_market_order, bid_ask)
+
+
+@pytest.mark.parametrize("sampler", ["thinning", "inverse_cdf"])
+@pytest.mark.parametrize("n_rows", [10_000, 100_000] + full(1_000_000))
+def test_sample_market_orders(benchmark, n_rows, sampler):
+    probabilities = utils.generate_market_order(utils.compute_all_bid_ask(fair_prices(n_rows), 500_000_000))
+    benchmark(utils.sample_market_orders, probabilities, seed=SEED, sampler=sampler)
+
+
+@pytest.mark.parametrize("n_trades", [1_000, 10_000, 100_000] + full(1_000_000))
+def test_track_pnl(benchmark, n_trades):
+    rng = np.random.default_rng(SEED)
+    prices = utils.simulate_fair_price(step_size_in_seconds=60, seed=SEED)
+    offsets = np.sort(rng.integers(0, 364 * 24 * 3600, n_trades))
+    trades = pl.DataFrame(
+        {
+            "timestamp": np.datetime64(datetime(2025, 1, 1), "us") + offsets.astype("timedelta64[s]"),
+            "side": rng.choice(["buy", "sell"], n_trades),
+            "price": 100 + rng.normal(0, 1, n_trades),
+            "size": rng.integers(1, 100, n_trades) * 100_000.0,
+            "client": np.zeros(n_trades, dtype=bool),
+        }
+    )
+    benchmark(utils.track_pnl, prices, trades, 0)
+
+
+@pytest.mark.parametrize("weights", ["computed", "table"])
+@pytest.mark.parametrize("n_rows", [100_000] + full(1_000_000))
+def test_adjust_probability(benchmark, n_rows, weights):
+    # probabilities of candidate sizes drawn from the 0-10M ladder, as in sample_market_orders
+    rng = np.random.default_rng(SEED)
+    probabilities = rng.random(n_rows)
+    table = utils.size_weight_table(method="logistic")
+    candidates = rng.integers(0, len(table.sizes), n_rows)
+    if weights == "table":
+        benchmark(lambda: probabilities * table.weights[candidates])
+    else:
+        benchmark(utils.adjust_probability, probabilities, table.sizes[candidates], method="logistic")
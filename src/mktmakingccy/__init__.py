@@ -1,3 +1,56 @@
-# read version from installed package
-from importlib.metadata import version
-__version__ = version("mktmakingccy")
\ No newline at end of file
+"""Market making simulation for emerging market currencies.
+
+The submodules (and the main classes and functions below) are only imported on first access (PEP 562),
+so `import mktmakingccy` does not load Polars or NumPy, which keeps the start of the sweep workers short.
+"""
+import importlib
+
+_SUBMODULES = (
+    "backtest", "books", "cache", "config", "metrics", "mktmakingccy", "order_book", "scheduler",
+    "service", "storage", "sweep", "ticks", "trade", "utils", "values",
+)
+
+# name -> submodule defining it
+_EXPORTS = {
+    "OrderBook": "order_book",
+    "ArrayOrderBook": "order_book",
+    "compute_quote_ladders": "order_book",
+    "Trade": "trade",
+    "MarketOrder": "trade",
+    "TradeHistory": "trade",
+    "match_market_orders": "trade",
+    "simulate_fair_price": "utils",
+    "simulate_correlated_fair_prices": "utils",
+    "compute_all_bid_ask": "utils",
+    "generate_market_order": "utils",
+    "sample_market_orders": "utils",
+    "track_pnl": "utils",
+    "Backtest": "backtest",
+    "run_sweep": "sweep",
+    "BookManager": "books",
+    "SessionScheduler": "scheduler",
+    "QuotingService": "service",
+    "MarketConfig": "config",
+}
+
+__all__ = ["__version__", *_SUBMODULES, *_EXPORTS]
+
+
+def __getattr__(name: str):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f"{__name__}.{_EXPORTS[name]}"), name)
+        globals()[name] = value  # later accesses do not go through __getattr__
+        return value
+    if name == "__version__":
+        # read version from installed package
+        from importlib.metadata import version
+
+        globals()["__version__"] = version("mktmakingccy")
+        return globals()["__version__"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
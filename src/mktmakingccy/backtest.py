@@ -0,0 +1,265 @@
+import inspect
+import json
+import numpy as np
+import polars as pl
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass, field, asdict
+from typing import Literal
+
+from . import utils
+from . import storage
+from .config import MarketConfig, DEFAULT_CONFIG
+from .order_book import ArrayOrderBook, compute_quote_ladders
+from .trade import _match_orders, _fills_frame
+
+@dataclass
+class BacktestState:
+    """State of a Backtest between two chunks of ticks, this is what the checkpoints save."""
+    step: int = 0  # number of ticks already simulated
+    price: float = None
+    X_t: float = 0.0
+    volatility: dict = field(default_factory=dict)
+    pnl: dict = field(default_factory=dict)
+    rng_state: dict = None
+    n_orders: int = 0
+    n_fills: int = 0
+    ordered_volume: float = 0.0
+    traded_volume: float = 0.0
+    min_inventory: float = None
+    max_inventory: float = None
+
+
+class Backtest:
+    def __init__(
+        self,
+        start_timestamp: datetime = datetime(2025, 1, 1),
+        end_timestamp: datetime = datetime(2026, 1, 1),
+        step_size_in_seconds: int = 3600,
+        initial_price: float = 100.0,
+        fair_price_params: dict = None,
+        fair_prices: np.ndarray = None,
+        n_levels: int = None,
+        volume: float = 0,
+        lambda_val: float = None,
+        bid_asymetry: float = None,
+        pricing_params: dict = None,
+        spread_sensibility: float = 5,
+        base_intensity: float = 1,
+        size_params: dict = None,
+        requote: bool = True,
+        inventory: float = 0,
+        fx_revaluation: bool = False,
+        seed: int | np.random.SeedSequence = None,
+        chunk_size: int = 100_000,
+        output_dir: str | Path = None,
+        sink: Literal["parquet", "ipc"] = "parquet",
+        checkpoint_every: int = None,
+        config: MarketConfig = None,
+    ) -> None:
+        """
+        Event-driven backtest: the clock advances chunk by chunk of fair price ticks, the quotes are computed
+        with a running volatility, the market orders are sampled, and at each tick with orders the book is
+        rebuilt with get_base_pricing and the orders are matched against it. Only one chunk is in memory
+        at a time: the fills and PnL records of each chunk are written to output_dir (if given) and dropped.
+
+        Parameters:
+            start_timestamp, end_timestamp, step_size_in_seconds, initial_price: the clock and first fair price, see utils.simulate_fair_price.
+            fair_price_params (dict): Overrides of the fair price model parameters (mu, sigma, ...), on top of config.fair_price_params.
+            fair_prices (np.ndarray): A fair price path to replay (one value per tick from start_timestamp) instead of simulating it. Defaults to None.
+            n_levels (int): Levels of the order book. Defaults to config.n_levels.
+            volume, lambda_val, bid_asymetry: see utils.compute_all_bid_ask. lambda_val and bid_asymetry default to the ones of the config.
+            pricing_params (dict): alpha, bid_sizes and ask_sizes passed to get_base_pricing. The sizes default to config.level_sizes.
+            spread_sensibility, base_intensity: see utils.generate_market_order.
+            size_params (dict): size_ladder, method, scale, ... passed to utils.sample_market_orders. The size_ladder defaults to config.size_ladder.
+            requote (bool): Requote the consumed non client levels, see trade.match_market_orders.
+            inventory (float): The inventory at the start.
+            fx_revaluation (bool): Revalue the carried inventory, see utils.PnlTracker.
+            seed (int | np.random.SeedSequence): Seed of the random generator.
+            chunk_size (int): Number of ticks simulated at once, bounds the memory.
+            output_dir (str | Path): Where the fills/ and pnl/ parts (partitioned by date, see scan) and the checkpoint are written. Defaults to None (nothing written).
+            sink (str): "parquet" or "ipc" files.
+            checkpoint_every (int): Save the state every checkpoint_every chunks. Defaults to None (no checkpoints).
+            config (MarketConfig): Market parameters (size ladder, volume normaliser, book depth, ...). Defaults to config.DEFAULT_CONFIG.
+        """
+        if sink not in ("parquet", "ipc"):
+            raise ValueError(f"unknown sink {sink!r}")
+        self.config = DEFAULT_CONFIG if config is None else config
+        defaults = inspect.signature(utils.simulate_fair_price).parameters
+        self.fair_price_params = {name: defaults[name].default for name in utils._MODEL_PARAMS}
+        self.fair_price_params.update(self.config.fair_price_params)
+        self.fair_price_params.update(fair_price_params or {})
+
+        self.start_timestamp = start_timestamp
+        self.step_size_in_seconds = step_size_in_seconds
+        self.n_steps = int((end_timestamp - start_timestamp).total_seconds() // step_size_in_seconds) + 1
+        self.fair_prices = None if fair_prices is None else np.asarray(fair_prices, dtype=np.float64)
+        if self.fair_prices is not None:
+            self.n_steps = len(self.fair_prices)
+        self.initial_price = initial_price
+        self.n_levels = self.config.n_levels if n_levels is None else n_levels
+        self.volume = volume
+        self.lambda_val = self.config.lambda_val if lambda_val is None else lambda_val
+        self.bid_asymetry = self.config.bid_asymetry if bid_asymetry is None else bid_asymetry
+        level_sizes = self.config.pricing_params if self.n_levels == self.config.n_levels else {}
+        self.pricing_params = level_sizes | (pricing_params or {})
+        self.spread_sensibility = spread_sensibility
+        self.base_intensity = base_intensity
+        self.size_params = {"size_ladder": self.config.size_ladder} | (size_params or {})
+        self.requote = requote
+        self.inventory = inventory
+        self.fx_revaluation = fx_revaluation
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.output_dir = None if output_dir is None else Path(output_dir)
+        self.sink = sink
+        self.checkpoint_every = checkpoint_every
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self.output_dir / "checkpoint.json"
+
+    def _write(self, df: pl.DataFrame, name: str, chunk_id: int):
+        # a resumed chunk overwrites the same files
+        storage.write_partitioned(df, self.output_dir / name, "date", self.sink, f"part-{chunk_id:06d}")
+
+    def scan(self, name: Literal["fills", "pnl"]) -> pl.LazyFrame:
+        """Lazily scans the fills or pnl records written by run, partitioned by date (empty if the run had no fills)."""
+        return storage.scan_partitioned(self.output_dir / name, self.sink, schema=self._schema(name))
+
+    def _schema(self, name: Literal["fills", "pnl"]) -> dict:
+        # schema of the records written by run, built from empty frames
+        fills = _fills_frame(pl.DataFrame(schema={"timestamp": pl.Datetime("us"), "side": pl.String}), [], [], [], [])
+        if name == "pnl":
+            tracker = utils.PnlTracker(fx_revaluation=self.fx_revaluation)
+            fills = tracker.update(pl.DataFrame(schema={"timestamp": pl.Datetime("us"), "Fair Price": pl.Float64}), fills)
+        return dict(fills.schema) | {"date": pl.Date}
+
+    def _save_checkpoint(self, state: BacktestState):
+        tmp = self.checkpoint_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(asdict(state)))
+        tmp.replace(self.checkpoint_path)  # atomic, a crash never leaves half a checkpoint
+
+    def _load_checkpoint(self) -> BacktestState:
+        if self.output_dir is None or not self.checkpoint_path.exists():
+            return BacktestState()
+        return BacktestState(**json.loads(self.checkpoint_path.read_text()))
+
+    def _simulate_chunk(self, rng: np.random.Generator, state: BacktestState, size: int) -> np.ndarray:
+        if self.fair_prices is not None:
+            return self.fair_prices[state.step : state.step + size]
+        dt = self.step_size_in_seconds / (24 * 3600)  # Convert to fraction of a day
+        if state.price is None:  # first tick of the run
+            prices, state.X_t = utils._simulate_fair_price_chunk(
+                rng, size - 1, dt, self.initial_price, state.X_t, **self.fair_price_params
+            )
+            return np.concatenate([[self.initial_price], prices])
+        prices, state.X_t = utils._simulate_fair_price_chunk(
+            rng, size, dt, state.price, state.X_t, **self.fair_price_params
+        )
+        return prices
+
+    def run(self, resume: bool = True) -> pl.DataFrame:
+        """Runs the backtest until the end timestamp, from the last checkpoint if resume is True.
+
+        The book is kept in self.book, with the levels left by the last tick with orders.
+
+        Returns:
+            pl.DataFrame: One row summary with the number of ticks, orders and fills, the traded volume and fill rate, the inventory (final, min and max) and the PnL
+        """
+        state = self._load_checkpoint() if resume else BacktestState()
+        rng = np.random.default_rng(self.seed)
+        if state.rng_state is not None:
+            rng.bit_generator.state = state.rng_state
+        volatility = utils.RunningVolatility.from_dict(state.volatility) if state.volatility else utils.RunningVolatility()
+        tracker = (
+            utils.PnlTracker(**state.pnl)
+            if state.pnl
+            else utils.PnlTracker(inventory=self.inventory, fx_revaluation=self.fx_revaluation)
+        )
+        self.book = book = ArrayOrderBook(self.n_levels)
+        step = np.timedelta64(self.step_size_in_seconds, "s")
+
+        while state.step < self.n_steps:
+            chunk_id = state.step // self.chunk_size
+            size = min(self.chunk_size, self.n_steps - state.step)
+            timestamps = np.datetime64(self.start_timestamp, "us") + (state.step + np.arange(size)) * step
+            prices = self._simulate_chunk(rng, state, size)
+
+            # quotes, with the volatility carried over from the previous chunks
+            previous = np.nan if state.price is None else state.price
+            log_returns = np.diff(np.log(np.concatenate([[previous], prices])))
+            quotes = utils.compute_bid_ask(
+                pl.DataFrame(
+                    {"timestamp": timestamps, "fair_price": prices, "volatility": volatility.update_many(log_returns)}
+                ).with_columns(pl.col("volatility").fill_nan(None)),
+                self.volume,
+                self.lambda_val,
+                self.bid_asymetry,
+                normaliser=self.config.volume_normaliser,
+            )
+
+            # order flow, matched tick by tick against a book rebuilt at the tick fair price
+            orders = utils.generate_market_order(
+                quotes, self.spread_sensibility, self.base_intensity, sample=True, rng=rng, **self.size_params
+            ).join(quotes.select("timestamp", "spread"), on="timestamp", how="left", maintain_order="left")
+            order_timestamps = orders["timestamp"].to_numpy()
+            is_buy = (orders["side"] == "buy").to_list()
+            sizes = orders["size"].to_list()
+            fair_prices = orders["fair_price"].to_list()
+            fill_order, fill_price, fill_size, fill_client = [], [], [], []
+            bounds = np.flatnonzero(np.diff(order_timestamps)) + 1
+            firsts, lasts = np.r_[0, bounds], np.r_[bounds, len(orders)]
+            firsts = firsts[firsts < lasts]
+            # base pricing of every tick with orders at once, one row per tick
+            ladders = compute_quote_ladders(
+                orders["fair_price"].to_numpy()[firsts],
+                orders["spread"].to_numpy()[firsts],
+                self.n_levels,
+                **self.pricing_params,
+            )
+            for row, (first, last) in enumerate(zip(firsts, lasts[lasts > firsts])):
+                book.clear()
+                book.load_ladder(order_timestamps[first], *(ladder[row] for ladder in ladders))
+                _match_orders(
+                    book, range(first, last), order_timestamps, is_buy, sizes, fair_prices, self.requote,
+                    fill_order, fill_price, fill_size, fill_client, requote_volume=self.config.volume_normaliser,
+                )
+            fills = _fills_frame(orders, fill_order, fill_price, fill_size, fill_client)
+
+            records = tracker.update(quotes.select("timestamp", pl.col("fair_price").alias("Fair Price")), fills)
+            if self.output_dir is not None:
+                self._write(fills, "fills", chunk_id)
+                self._write(records, "pnl", chunk_id)
+
+            state.step += size
+            state.price = float(prices[-1])
+            state.X_t = float(state.X_t)
+            state.n_orders += orders.height
+            state.n_fills += fills.height
+            state.ordered_volume += float(sum(sizes))
+            state.traded_volume += float(sum(fill_size))
+            if records.height:
+                low, high = records["inventory"].min(), records["inventory"].max()
+                state.min_inventory = low if state.min_inventory is None else min(state.min_inventory, low)
+                state.max_inventory = high if state.max_inventory is None else max(state.max_inventory, high)
+            if self.checkpoint_every and self.output_dir is not None and (chunk_id + 1) % self.checkpoint_every == 0:
+                state.volatility = volatility.to_dict()
+                state.pnl = asdict(tracker)
+                state.rng_state = rng.bit_generator.state
+                self._save_checkpoint(state)
+
+        summary = {
+            "ticks": state.step,
+            "orders": state.n_orders,
+            "fills": state.n_fills,
+            "traded_volume": state.traded_volume,
+            "fill_rate": state.traded_volume / state.ordered_volume if state.ordered_volume else None,
+            "inventory": float(tracker.inventory),
+            "min_inventory": state.min_inventory,
+            "max_inventory": state.max_inventory,
+            "pnl": float(tracker.pnl),
+        }
+        if self.fx_revaluation:
+            summary["total_pnl"] = tracker.mark(state.price)
+        return pl.DataFrame([summary])
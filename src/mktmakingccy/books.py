@@ -0,0 +1,165 @@
+import os
+import numpy as np
+import polars as pl
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
+
+from . import utils
+from .backtest import Backtest
+from .sweep import _process_pool
+from .config import MarketConfig, DEFAULT_CONFIG
+from .order_book import ArrayOrderBook, compute_quote_ladders
+from .trade import TradeHistory, match_market_orders
+
+
+def _run_shard(
+    shard: list[tuple[str, np.ndarray, np.random.SeedSequence]], backtest_params: dict
+) -> list[tuple[dict, pl.DataFrame, pl.DataFrame]]:
+    """Backtests the pairs of one shard one after the other, in a worker, returns the summary row and the last bids and asks of each pair."""
+    results = []
+    for pair, fair_prices, seed in shard:
+        backtest = Backtest(**backtest_params, fair_prices=fair_prices, seed=seed)
+        summary = backtest.run(resume=False)
+        row = {"pair": pair, "last_fair_price": float(fair_prices[-1])} | summary.row(0, named=True)
+        results.append((row, backtest.book.bids, backtest.book.asks))
+    return results
+
+
+class BookManager:
+    def __init__(
+        self,
+        initial_prices: dict[str, float],
+        n_levels: int = None,
+        correlation: np.ndarray = None,
+        pair_params: dict[str, dict] = None,
+        backtest_params: dict = None,
+        config: MarketConfig = None,
+    ) -> None:
+        """
+        Market making on several currency pairs at once: one order book per pair, fair prices simulated
+        with correlated shocks (utils.simulate_correlated_fair_prices), and the pairs backtested in
+        parallel shards, with the inventory and PnL aggregated in $.
+
+        Parameters:
+            initial_prices (dict[str, float]): Initial fair price of each pair (units of the currency per $), e.g. {"USDBRL": 5.0}.
+            n_levels (int): Levels of each order book. Defaults to config.n_levels.
+            correlation (np.ndarray): Correlation matrix of the pairs, in the order of initial_prices. Defaults to None (independent pairs).
+            pair_params (dict[str, dict]): Fair price model arguments of each pair (sigma, mu_jump, ...). Defaults to None.
+            backtest_params (dict): Backtest arguments shared by the pairs (clock, lambda_val, size_params, ...). Defaults to None.
+            config (MarketConfig): Market parameters shared by the pairs, passed to their backtests. Defaults to config.DEFAULT_CONFIG.
+        """
+        self.pairs = list(initial_prices)
+        self.initial_prices = initial_prices
+        self.config = DEFAULT_CONFIG if config is None else config
+        self.n_levels = self.config.n_levels if n_levels is None else n_levels
+        self.correlation = correlation
+        self.pair_params = pair_params or {}
+        self.backtest_params = {"config": self.config} | dict(backtest_params or {})
+        self.books = {pair: ArrayOrderBook(self.n_levels) for pair in self.pairs}
+
+    def get_book(self, pair: str) -> ArrayOrderBook:
+        if pair not in self.books:
+            raise Exception(f"Unknown pair {pair!r}, the pairs are {self.pairs}.")
+        return self.books[pair]
+
+    def quote(self, timestamp: datetime, fair_prices: dict[str, float], spreads: dict[str, float], **pricing_params):
+        """Rebuilds the base pricing of the books of these pairs, the ladders of all the pairs are computed at once."""
+        pairs = list(fair_prices)
+        if self.n_levels == self.config.n_levels:
+            pricing_params = self.config.pricing_params | pricing_params
+        ladders = compute_quote_ladders(
+            [fair_prices[pair] for pair in pairs], [spreads[pair] for pair in pairs], self.n_levels, **pricing_params
+        )
+        for row, pair in enumerate(pairs):
+            book = self.get_book(pair)
+            book.clear()
+            book.load_ladder(timestamp, *(ladder[row] for ladder in ladders))
+        return self
+
+    def match(self, pair: str, market_orders: pl.DataFrame, trade_history: TradeHistory = None, **kwargs) -> pl.DataFrame:
+        """Matches market orders against the book of a pair, see trade.match_market_orders."""
+        fills, _ = match_market_orders(self.get_book(pair), market_orders, trade_history=trade_history, **kwargs)
+        return fills.with_columns(pl.lit(pair).alias("pair"))
+
+    def simulate(self, seed: int = None, layout: Literal["long", "wide"] = "long") -> pl.DataFrame:
+        """Correlated fair prices of all the pairs on the clock of the backtest parameters."""
+        clock = {
+            name: self.backtest_params[name]
+            for name in ("start_timestamp", "end_timestamp", "step_size_in_seconds")
+            if name in self.backtest_params
+        }
+        return utils.simulate_correlated_fair_prices(
+            self.initial_prices,
+            self.correlation,
+            pair_params=self.pair_params,
+            layout=layout,
+            seed=seed,
+            **clock,
+            **(self.config.fair_price_params | self.backtest_params.get("fair_price_params", {})),
+        )
+
+    def run(
+        self,
+        seed: int = None,
+        n_workers: int = None,
+        executor: Literal["process", "thread"] = "process",
+    ) -> pl.DataFrame:
+        """Simulates the correlated fair prices and backtests every pair, sharded over workers
+
+        The pairs are split in n_workers shards, each shard runs in a worker process (one Polars thread each)
+        or thread, and each pair gets its own random stream for the order flow. The total row sums the PnL
+        and the inventory in $ (inventory / last fair price) over the pairs. After the run, the book of each
+        pair (get_book) holds the levels left by the last tick with orders of its backtest.
+
+        Args:
+            seed (int, optional): Root seed of the run. Defaults to None.
+            n_workers (int, optional): Number of workers, 1 runs everything in this process. Defaults to min(os.cpu_count(), number of pairs).
+            executor (str, optional): "process" or "thread" workers. Defaults to "process".
+
+        Returns:
+            pl.DataFrame: One row per pair with the Backtest summary and the inventory in $, and a "TOTAL" row
+        """
+        if executor not in ("process", "thread"):
+            raise ValueError(f"unknown executor {executor!r}")
+        root = np.random.SeedSequence(seed)
+        prices_seed, *pair_seeds = root.spawn(len(self.pairs) + 1)
+        paths = self.simulate(seed=prices_seed, layout="wide")
+        backtest_params = {
+            name: value for name, value in self.backtest_params.items() if name not in ("fair_price_params", "output_dir")
+        } | {"n_levels": self.n_levels}
+
+        tasks = [
+            (pair, paths[f"Fair Price_{pair}"].to_numpy(), pair_seed)
+            for pair, pair_seed in zip(self.pairs, pair_seeds)
+        ]
+        n_workers = min(n_workers or os.cpu_count(), len(tasks))
+        shards = [tasks[k::n_workers] for k in range(n_workers)]
+
+        if n_workers == 1:
+            results = _run_shard(shards[0], backtest_params)
+        elif executor == "thread":
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                results = [result for shard in pool.map(_run_shard, shards, [backtest_params] * n_workers) for result in shard]
+        else:
+            with _process_pool(n_workers) as pool:
+                results = [result for shard in pool.map(_run_shard, shards, [backtest_params] * n_workers) for result in shard]
+
+        rows = []
+        for row, bids, asks in results:
+            book = self.get_book(row["pair"])
+            book.clear()
+            book.load_frames(bids, asks)
+            rows.append(row)
+
+        order = {pair: k for k, pair in enumerate(self.pairs)}
+        summary = (
+            pl.DataFrame(sorted(rows, key=lambda row: order[row["pair"]]))
+            .with_columns((pl.col("inventory") / pl.col("last_fair_price")).alias("inventory_usd"))
+        )
+        total = summary.select(
+            pl.lit("TOTAL").alias("pair"),
+            *(pl.col(name).sum() for name in ("ticks", "orders", "fills", "traded_volume", "pnl", "inventory_usd")),
+            *((pl.col("total_pnl").sum(),) if "total_pnl" in summary.columns else ()),
+        )
+        return pl.concat([summary, total], how="diagonal_relaxed")
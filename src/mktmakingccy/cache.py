@@ -0,0 +1,202 @@
+import os
+import shutil
+import inspect
+import hashlib
+import functools
+import numpy as np
+import polars as pl
+from pathlib import Path
+from datetime import date, datetime
+from importlib.metadata import version, PackageNotFoundError
+
+
+# file marking the version folders created by DiskCache, the only ones it ever deletes
+_SENTINEL = ".mktmakingccy-cache"
+_PACKAGE_FOLDER = Path(__file__).resolve().parent
+
+
+def _package_version() -> str:
+    try:
+        return version("mktmakingccy")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+@functools.lru_cache(maxsize=256)
+def _file_digest(path: Path, modified_ns: int) -> bytes:
+    # keyed by the modification time, so an edited file is read again
+    return hashlib.sha256(path.read_bytes()).digest()
+
+
+def _source_files(func) -> list[Path]:
+    """The .py files of the package, and the file of the module defining func if it is outside the package."""
+    files = sorted(_PACKAGE_FOLDER.glob("*.py"))
+    try:
+        module_file = Path(inspect.getfile(func)).resolve()
+    except (OSError, TypeError):
+        return files
+    if module_file.suffix == ".py" and module_file.parent != _PACKAGE_FOLDER:
+        files.append(module_file)
+    return files
+
+
+def _default_root() -> Path:
+    return Path(os.environ.get("MKTMAKINGCCY_CACHE", Path.home() / ".cache" / "mktmakingccy"))
+
+
+def _hash_value(digest, value):
+    """Feeds a parameter value to the hash, the frames are hashed by content."""
+    if isinstance(value, pl.LazyFrame):
+        value = value.collect()
+    if isinstance(value, pl.DataFrame):
+        digest.update(str(value.schema).encode())
+        digest.update(value.hash_rows(seed=0, seed_1=1, seed_2=2, seed_3=3).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(f"{value.dtype}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, np.random.SeedSequence):
+        digest.update(repr((value.entropy, value.spawn_key, value.pool_size)).encode())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _hash_value(digest, item)
+    elif isinstance(value, dict):
+        digest.update(f"dict{len(value)}".encode())
+        for key in sorted(value):
+            digest.update(repr(key).encode())
+            _hash_value(digest, value[key])
+    elif value is None or isinstance(value, (bool, int, float, str, date, datetime, np.generic)):
+        digest.update(repr(value).encode())
+    else:
+        raise Exception(f"Cannot hash a parameter of type {type(value).__name__} for the cache.")
+
+
+class DiskCache:
+    def __init__(self, root: str | Path = None, max_bytes: int = 2 * 1024**3) -> None:
+        """
+        Content-addressed cache of the deterministic simulation outputs on the local disk.
+
+        A result is keyed by the hash of the function (name and source), its parameters (the frames by
+        content), the package version and the source files of the package and of the module defining the function,
+        so a change of a helper (e.g. utils._simulate_fair_price_chunk) also invalidates the results, even in a
+        development checkout where the version does not change. It is stored as a Parquet file and returned as a lazy scan of
+        that file, and the least recently used files are evicted once the cache is larger than max_bytes.
+        The entries of the other package versions are deleted when the cache is opened: only the version folders
+        created by DiskCache (marked with a sentinel file) are deleted, the other contents of root are never touched.
+
+        Parameters:
+            root (str | Path): Folder of the cache. Defaults to $MKTMAKINGCCY_CACHE or ~/.cache/mktmakingccy.
+            max_bytes (int): Size bound of the cache. Defaults to 2GB.
+        """
+        self.root = Path(root) if root is not None else _default_root()
+        self.max_bytes = max_bytes
+        self.version = _package_version()
+        self.folder = self.root / self.version
+        self.folder.mkdir(parents=True, exist_ok=True)
+        (self.folder / _SENTINEL).touch()
+        for other in self.root.iterdir():
+            if other.is_dir() and other != self.folder and (other / _SENTINEL).is_file():
+                shutil.rmtree(other, ignore_errors=True)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, func, arguments: dict) -> str:
+        """Hash of the function, the source files it may depend on and its bound arguments."""
+        digest = hashlib.sha256()
+        digest.update(f"{func.__module__}.{func.__qualname__}".encode())
+        try:
+            digest.update(inspect.getsource(func).encode())
+        except (OSError, TypeError):
+            pass
+        for path in _source_files(func):
+            digest.update(_file_digest(path, path.stat().st_mtime_ns))
+        _hash_value(digest, arguments)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        """File of the result of this key."""
+        return self.folder / f"{key}.parquet"
+
+    def get(self, key: str) -> pl.LazyFrame:
+        """Lazy scan of the cached result, or None if it is not in the cache."""
+        path = self.path(key)
+        if not path.exists():
+            return None
+        os.utime(path)  # the modification time is the last use for the LRU eviction
+        return pl.scan_parquet(path)
+
+    def put(self, key: str, df: pl.DataFrame) -> pl.LazyFrame:
+        """Stores a result, evicts the least recently used ones if needed, and returns its lazy scan."""
+        path = self.path(key)
+        tmp = path.with_suffix(".tmp")
+        df.write_parquet(tmp)
+        tmp.replace(path)  # atomic, a concurrent reader never sees half a file
+        self.evict(keep=path)
+        return pl.scan_parquet(path)
+
+    def size(self) -> int:
+        """Size in bytes of the cached results."""
+        return sum(path.stat().st_size for path in self.folder.glob("*.parquet"))
+
+    def evict(self, keep: Path = None):
+        """Deletes the least recently used results until the cache fits in max_bytes."""
+        entries = sorted(
+            (path.stat().st_mtime, path.stat().st_size, path) for path in self.folder.glob("*.parquet")
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        """Deletes every cached result of this version."""
+        for path in self.folder.glob("*.parquet"):
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        """Hits and misses of this cache object, and the number and size of the stored results."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(list(self.folder.glob("*.parquet"))), "bytes": self.size()}
+
+    def wrap(self, func):
+        """Memoizes a function that returns a pl.DataFrame, the wrapped function returns a pl.LazyFrame
+
+        The calls are only cached when they are deterministic: a function with a seed argument needs a seed
+        that is not None, and a random generator (rng argument) is never cached. The other calls are run
+        and their result is returned lazily, without being stored.
+        """
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            if arguments.get("rng") is not None or ("seed" in arguments and arguments["seed"] is None):
+                return func(*args, **kwargs).lazy()
+
+            key = self.key(func, arguments)
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            result = func(*args, **kwargs)
+            if isinstance(result, pl.LazyFrame):
+                result = result.collect()
+            if not isinstance(result, pl.DataFrame):
+                raise Exception(f"Only the functions returning a pl.DataFrame can be cached, {func.__qualname__} returned {type(result).__name__}.")
+            return self.put(key, result)
+
+        wrapper.cache = self
+        return wrapper
+
+
+def cached(func=None, *, cache: DiskCache = None):
+    """Decorator version of DiskCache.wrap, with the default cache if none is given (@cached or @cached(cache=...))."""
+    if func is None:
+        return functools.partial(cached, cache=cache)
+    return (cache or DiskCache()).wrap(func)
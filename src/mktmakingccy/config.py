@@ -0,0 +1,110 @@
+import types
+import tomllib
+from pathlib import Path
+from typing import Mapping
+from dataclasses import dataclass, field, fields
+
+from . import values as vl
+
+try:  # optional, only needed for the YAML configs
+    import yaml
+except ImportError:
+    yaml = None
+
+
+@dataclass(frozen=True)
+class MarketConfig:
+    """Parameters of a market: size ladders, volume normaliser, book depth, quoting and fair price model
+
+    The derived constants (volume_normaliser) are computed once, when the config is built, and the config is
+    passed explicitly to the books, quotes and order flows (Backtest, QuotingService, match_market_orders, ...),
+    so several configs can run side by side in one process. The defaults are the ones of values.py.
+    """
+    volume_list: tuple[float, ...] = tuple(vl.VOLUME_LIST)  # traded volumes used to normalise the spread widening
+    size_ladder: tuple[float, ...] = tuple(vl.TRADE_SIZE_LADDER)  # possible sizes of a market order
+    n_levels: int = 15
+    level_sizes: tuple[float, ...] = None  # size of each level of the base pricing, defaults to order_book.default_sizes
+    lambda_val: float = 2
+    bid_asymetry: float = 0.5
+    fair_price_params: Mapping[str, float] = field(default_factory=dict, hash=False)  # overrides of the utils.simulate_fair_price parameters, read-only
+    volume_normaliser: float = field(init=False, compare=False)
+
+    def __post_init__(self):
+        # the sequences are stored as tuples and the fair price parameters as a read-only copy,
+        # so the config cannot be changed after its constants are derived
+        for name in ("volume_list", "size_ladder", "level_sizes"):
+            value = getattr(self, name)
+            if value is not None:
+                object.__setattr__(self, name, tuple(float(x) for x in value))
+        object.__setattr__(self, "fair_price_params", types.MappingProxyType(dict(self.fair_price_params)))
+
+        if not self.size_ladder:
+            raise Exception("The size ladder of the config cannot be empty.")
+        if self.level_sizes is not None and len(self.level_sizes) != self.n_levels:
+            raise Exception(f"level_sizes should have n_levels = {self.n_levels} values, not {len(self.level_sizes)}.")
+        unknown = set(self.fair_price_params) - set(vl.FAIR_PRICE_MODEL_PARAMS)
+        if unknown:
+            raise Exception(f"Unknown fair price parameters {sorted(unknown)}, the parameters are {list(vl.FAIR_PRICE_MODEL_PARAMS)}.")
+        volume_normaliser = float(sum(self.volume_list))
+        if volume_normaliser <= 0:
+            raise Exception("The volumes of volume_list should sum to a positive number.")
+        object.__setattr__(self, "volume_normaliser", volume_normaliser)
+
+    @property
+    def pricing_params(self) -> dict:
+        """bid_sizes and ask_sizes of order_book.compute_quote_ladders (empty with the default sizes)."""
+        if self.level_sizes is None:
+            return {}
+        return {"bid_sizes": list(self.level_sizes), "ask_sizes": list(self.level_sizes)}
+
+    @classmethod
+    def from_dict(cls, params: dict) -> "MarketConfig":
+        """Builds a config from a dict, e.g. a parsed TOML or YAML file."""
+        names = {f.name for f in fields(cls) if f.init}
+        unknown = set(params) - names
+        if unknown:
+            raise Exception(f"Unknown config parameters {sorted(unknown)}, the parameters are {sorted(names)}.")
+        return cls(**params)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "MarketConfig":
+        """Reads a config from a .toml, .yaml or .yml file
+
+        The keys are the fields of MarketConfig, with the fair price parameters in a fair_price_params table, e.g.
+
+            n_levels = 10
+            size_ladder = [100_000, 500_000, 1_000_000]
+
+            [fair_price_params]
+            sigma = 0.01
+
+        Args:
+            path (str | Path): The config file
+
+        Returns:
+            MarketConfig: The config
+        """
+        path = Path(path)
+        if path.suffix == ".toml":
+            with path.open("rb") as file:
+                params = tomllib.load(file)
+        elif path.suffix in (".yaml", ".yml"):
+            if yaml is None:
+                raise Exception("PyYAML is needed to read a YAML config, or use a TOML file.")
+            params = yaml.safe_load(path.read_text()) or {}
+        else:
+            raise ValueError(f"unknown config format {path.suffix!r}")
+        return cls.from_dict(params)
+
+    def to_dict(self) -> dict:
+        """The parameters of the config, without the derived constants (from_dict(to_dict()) gives the same config)."""
+        params = {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+        params["fair_price_params"] = dict(self.fair_price_params)
+        return params
+
+    def __reduce__(self):
+        # a mappingproxy cannot be pickled, the config is rebuilt from its parameters (e.g. in the BookManager workers)
+        return type(self).from_dict, (self.to_dict(),)
+
+
+DEFAULT_CONFIG = MarketConfig()
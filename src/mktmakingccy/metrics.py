@@ -0,0 +1,387 @@
+import sys
+import time
+import inspect
+import functools
+import threading
+import numpy as np
+import polars as pl
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass
+
+from . import utils
+from . import order_book
+from . import trade
+
+
+@dataclass
+class Summary:
+    """Count, sum and max of the observed values of a timer (nanoseconds) or of a distribution."""
+    count: int = 0
+    total: float = 0
+    max: float = 0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+class MetricsRegistry:
+    """Counters, gauges, timers and distributions of a run, filled by the hooks installed by enable()."""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.distributions = {}
+        self.simulation_time = None  # timestamp of the tick being processed, see SamplingProfiler
+
+    def inc(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+        self.distributions.setdefault(name, Summary()).observe(value)
+
+    def observe(self, name: str, value: float):
+        self.distributions.setdefault(name, Summary()).observe(value)
+
+    def time(self, name: str, nanoseconds: int):
+        self.timers.setdefault(name, Summary()).observe(nanoseconds)
+
+    def to_polars(self) -> pl.DataFrame:
+        """One row per metric: name, kind (counter, gauge, timer or distribution), count, total, mean, max and last value (timers in seconds)."""
+        rows = [
+            {"name": name, "kind": "counter", "count": None, "total": float(value), "mean": None, "max": None, "last": None}
+            for name, value in self.counters.items()
+        ]
+        for kind, metrics, scale in (("timer", self.timers, 1e-9), ("distribution", self.distributions, 1)):
+            for name, summary in metrics.items():
+                rows.append(
+                    {
+                        "name": name,
+                        "kind": "gauge" if name in self.gauges else kind,
+                        "count": summary.count,
+                        "total": summary.total * scale,
+                        "mean": summary.total * scale / summary.count if summary.count else None,
+                        "max": summary.max * scale,
+                        "last": float(self.gauges[name]) if name in self.gauges else None,
+                    }
+                )
+        schema = {
+            "name": pl.String, "kind": pl.String, "count": pl.Int64, "total": pl.Float64,
+            "mean": pl.Float64, "max": pl.Float64, "last": pl.Float64,
+        }
+        return pl.DataFrame(rows, schema=schema)
+
+    def to_prometheus(self, prefix: str = "mktmakingccy") -> str:
+        """The metrics in the Prometheus text exposition format."""
+        clean = lambda name: f"{prefix}_" + "".join(c if c.isalnum() else "_" for c in name)
+        lines = []
+        for name, value in self.counters.items():
+            lines += [f"# TYPE {clean(name)}_total counter", f"{clean(name)}_total {value}"]
+        for name, value in self.gauges.items():
+            lines += [f"# TYPE {clean(name)} gauge", f"{clean(name)} {value}"]
+        for name, summary in self.timers.items():
+            metric = f"{clean(name)}_seconds"
+            lines += [
+                f"# TYPE {metric} summary",
+                f"{metric}_sum {summary.total * 1e-9}",
+                f"{metric}_count {summary.count}",
+                f"# TYPE {metric}_max gauge",
+                f"{metric}_max {summary.max * 1e-9}",
+            ]
+        for name, summary in self.distributions.items():
+            if name in self.gauges:
+                continue
+            lines += [
+                f"# TYPE {clean(name)} summary",
+                f"{clean(name)}_sum {summary.total}",
+                f"{clean(name)}_count {summary.count}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# originals of the patched functions, to restore them in disable()
+_ORIGINALS = {}
+# registries of the enable() calls not disabled yet, the hooks record in the last one
+_REGISTRIES = []
+_PACKAGE_FOLDER = Path(__file__).resolve().parent
+
+
+def _timed(name: str, func, registry: MetricsRegistry):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registry.time(name, time.perf_counter_ns() - start)
+    return wrapper
+
+
+def _book_hook(name: str, func, registry: MetricsRegistry):
+    """update_order/delete_order: call counter, timer and book depth."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return func(self, *args, **kwargs)
+        finally:  # a failed call is counted too, and the depth is the one it left
+            registry.time(name, time.perf_counter_ns() - start)
+            registry.inc(f"{name}.calls")
+            if isinstance(self, order_book.ArrayOrderBook):
+                bid_depth, ask_depth = self._bids.count, self._asks.count
+            else:
+                bid_depth, ask_depth = self.bids.height, self.asks.height
+            registry.set_gauge("book.depth.bid", bid_depth)
+            registry.set_gauge("book.depth.ask", ask_depth)
+    return wrapper
+
+
+def _sweep_hook(name: str, func, registry: MetricsRegistry):
+    """post_market_order: timer, and levels swept, one per fill logged in the trade history (the last one may be partial)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        history = trade.get_history()
+        n_trades = len(history)
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registry.time(name, time.perf_counter_ns() - start)
+            registry.observe("post_market_order.levels_swept", len(history) - n_trades)
+    return wrapper
+
+
+def _fills_hook(name: str, func, registry: MetricsRegistry):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        n_trades = len(self)
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            registry.inc("trade_history.fills_logged", len(self) - n_trades)
+    return wrapper
+
+
+def _match_hook(name: str, func, registry: MetricsRegistry):
+    """_match_orders: timer, orders matched, fills and levels swept per order."""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs).arguments
+        orders, fill_price = arguments["orders"], arguments["fill_price"]
+        n_fills = len(fill_price)
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registry.time(name, time.perf_counter_ns() - start)
+            fills = len(fill_price) - n_fills
+            registry.inc("match.orders", len(orders))
+            registry.inc("match.fills", fills)
+            if len(orders):
+                registry.observe("match.levels_swept_per_order", fills / len(orders))
+    return wrapper
+
+
+def _clock_hook(name: str, func, registry: MetricsRegistry):
+    """Book (re)pricing at a tick: timer, and the tick timestamp is the current simulation time of the samples."""
+    signature = inspect.signature(func)
+    timestamp_argument = next(iter(list(signature.parameters)[1:]))  # base_date or timestamp
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        registry.simulation_time = signature.bind(*args, **kwargs).arguments[timestamp_argument]
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registry.time(name, time.perf_counter_ns() - start)
+    return wrapper
+
+
+def _targets() -> list[tuple[object, str, str, object]]:
+    """(owner, attribute, metric name, hook) of every instrumented function."""
+    targets = []
+    for book in (order_book.OrderBook, order_book.ArrayOrderBook):
+        targets += [
+            (book, "update_order", f"{book.__name__}.update_order", _book_hook),
+            (book, "delete_order", f"{book.__name__}.delete_order", _book_hook),
+            (book, "get_base_pricing", f"{book.__name__}.get_base_pricing", _clock_hook),
+        ]
+    targets += [
+        (order_book.ArrayOrderBook, "load_ladder", "ArrayOrderBook.load_ladder", _clock_hook),
+        (trade.MarketOrder, "post_market_order", "MarketOrder.post_market_order", _sweep_hook),
+        (trade.TradeHistory, "log", "TradeHistory.log", _fills_hook),
+        (trade.TradeHistory, "extend", "TradeHistory.extend", _fills_hook),
+        (trade, "_match_orders", "trade._match_orders", _match_hook),
+        (trade, "match_market_orders", "trade.match_market_orders", _timed),
+    ]
+    for name, func in vars(utils).items():
+        if inspect.isfunction(func) and func.__module__ == utils.__name__ and not name.startswith("_affine"):
+            targets.append((utils, name, f"utils.{name}", _timed))
+    return targets
+
+
+def _package_modules():
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path and module.__name__ != "__main__" and Path(path).resolve().parent == _PACKAGE_FOLDER:
+            yield module
+
+
+def _rebind(replacements: dict):
+    """Replaces the module level names bound to the originals (e.g. "from trade import _match_orders") in the package modules.
+
+    Args:
+        replacements (dict): id(original) -> replacement
+    """
+    for module in _package_modules():
+        for name, value in list(vars(module).items()):
+            if id(value) in replacements:
+                setattr(module, name, replacements[id(value)])
+
+
+def _install(registry: MetricsRegistry):
+    replacements = {}
+    try:
+        for owner, attribute, name, hook in _targets():
+            original = vars(owner)[attribute]
+            wrapper = hook(name, original, registry)
+            setattr(owner, attribute, wrapper)
+            _ORIGINALS[(owner, attribute)] = (original, wrapper)
+            if inspect.ismodule(owner):
+                replacements[id(original)] = wrapper
+    finally:  # the module names follow the functions that were patched, even if a hook failed
+        _rebind(replacements)
+
+
+def _uninstall():
+    replacements = {}
+    for (owner, attribute), (original, wrapper) in _ORIGINALS.items():
+        setattr(owner, attribute, original)
+        if inspect.ismodule(owner):
+            replacements[id(wrapper)] = original
+    _rebind(replacements)
+    _ORIGINALS.clear()
+
+
+def enable(registry: MetricsRegistry = REGISTRY) -> MetricsRegistry:
+    """Installs the hooks recording in registry, until the matching disable(). When the metrics are disabled the original functions run, without any overhead.
+
+    The calls nest: the hooks record in the registry of the last enable() and, once it is disabled, in the previous one again.
+    """
+    _uninstall()
+    _REGISTRIES.append(registry)
+    try:
+        _install(registry)
+    except BaseException:
+        disable()  # back to the hooks of the previous registry
+        raise
+    return registry
+
+
+def disable():
+    """Undoes the last enable(): the hooks of the previous registry are installed again, or the original functions restored."""
+    if not _REGISTRIES:
+        return
+    _uninstall()
+    _REGISTRIES.pop()
+    if _REGISTRIES:
+        _install(_REGISTRIES[-1])
+
+
+def is_enabled() -> bool:
+    return bool(_REGISTRIES)
+
+
+class instrument:
+    """Context manager that enables the metrics in a fresh (or given) registry: with instrument() as registry: ..."""
+
+    def __init__(self, registry: MetricsRegistry = None) -> None:
+        self.registry = registry or MetricsRegistry()
+
+    def __enter__(self) -> MetricsRegistry:
+        enable(self.registry)
+        return self.registry
+
+    def __exit__(self, *exc):
+        disable()
+        return False
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005, registry: MetricsRegistry = REGISTRY, max_depth: int = 32) -> None:
+        """
+        Statistical profiler: a background thread samples the stack of the profiled thread every interval
+        seconds, and tags each sample with the simulation timestamp of the tick being processed (set by the
+        get_base_pricing/load_ladder hooks, so the metrics have to be enabled with this registry).
+
+        Parameters:
+            interval (float): Seconds between two samples.
+            registry (MetricsRegistry): Registry holding the current simulation time.
+            max_depth (int): Number of frames kept per sample.
+        """
+        self.interval = interval
+        self.registry = registry
+        self.max_depth = max_depth
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).stem}.{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                simulation_time = self.registry.simulation_time
+                if isinstance(simulation_time, np.datetime64):
+                    simulation_time = simulation_time.astype("datetime64[us]").item()
+                self.samples.append((datetime.now(), simulation_time, stack[0], ";".join(reversed(stack))))
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def to_polars(self) -> pl.DataFrame:
+        """One row per sample: wall time, simulation timestamp, innermost function and the collapsed stack (root first)."""
+        return pl.DataFrame(
+            self.samples,
+            schema={
+                "wall_time": pl.Datetime("us"),
+                "simulation_time": pl.Datetime("us"),
+                "function": pl.String,
+                "stack": pl.String,
+            },
+            orient="row",
+        )
@@ -1,7 +1,16 @@
+import itertools
 import polars as pl
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Literal
 from datetime import datetime
 
+try:  # optional compiled kernels
+    from numba import njit
+except ImportError:
+    njit = None
+
 #TODO: utiliser la fct qui créer la proba de trade pour créer une fct qui génère l'instance de market order en fct de la proba 
 # resultat final: colonne appelée market order ou chaque élément est une instace de market order _
 # ou en fct de la proba ça va dire s'il y a eu un market order ou pas _
@@ -11,6 +20,84 @@ from datetime import datetime
 
 #TODO remove timestamp from orderbook ???
 
+
+def default_sizes(n_levels: int) -> list[float]:
+    """Default size of each level of the base pricing: 5 x 100k, 500k, then 1M."""
+    return [100_000] * 5 + [500_000] + [1_000_000] * (n_levels - 6)
+
+
+def compute_quote_ladders(
+    fair_prices: np.ndarray,
+    spreads: np.ndarray,
+    n_levels: int,
+    alpha: float | np.ndarray = None,
+    bid_sizes: list[float] = None,
+    ask_sizes: list[float] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Computes the base pricing ladders of many time steps in one pass
+
+    Level i (from 0) of time step t is quoted at fair_price[t] * (1 - alpha[i] * spread[t] -/+ spread[t] / 2) ** (i + 1),
+    as in OrderBook.get_base_pricing.
+
+    Args:
+        fair_prices (np.ndarray): The fair price of each time step
+        spreads (np.ndarray): The bid-ask spread of each time step
+        n_levels (int): Number of levels of each side
+        alpha (float | np.ndarray, optional): Mid/fair price adjustment, one value or one per level. Defaults to the size imbalance of the two sides.
+        bid_sizes (list[float], optional): The size of each bid level. Defaults to default_sizes(n_levels).
+        ask_sizes (list[float], optional): The size of each ask level. Defaults to default_sizes(n_levels).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: The bid prices, bid sizes, ask prices and ask sizes, each of shape (time steps, n_levels)
+    """
+    fair_prices = np.asarray(fair_prices, dtype=np.float64).reshape(-1, 1)
+    spreads = np.asarray(spreads, dtype=np.float64).reshape(-1, 1)
+    bid_sizes = np.asarray(default_sizes(n_levels) if bid_sizes is None else bid_sizes, dtype=np.float64)
+    ask_sizes = np.asarray(default_sizes(n_levels) if ask_sizes is None else ask_sizes, dtype=np.float64)
+    if alpha is None:
+        alpha = (ask_sizes.sum() - bid_sizes.sum()) / (ask_sizes.sum() + bid_sizes.sum())
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=np.float64), (n_levels,))
+
+    exponents = np.arange(1, n_levels + 1)
+    bid_prices = fair_prices * (1 - alpha * spreads - spreads / 2) ** exponents
+    ask_prices = fair_prices * (1 - alpha * spreads + spreads / 2) ** exponents
+    shape = bid_prices.shape
+    return (
+        bid_prices,
+        np.broadcast_to(bid_sizes, shape),
+        ask_prices,
+        np.broadcast_to(ask_sizes, shape),
+    )
+
+
+def quote_ladders_frame(
+    historical_bid_ask: pl.DataFrame,
+    n_levels: int,
+    alpha: float | np.ndarray = None,
+    bid_sizes: list[float] = None,
+    ask_sizes: list[float] = None,
+) -> pl.DataFrame:
+    """Long frame of the ladders of compute_quote_ladders, from a DF with timestamp, fair_price and spread columns (e.g. utils.compute_all_bid_ask)
+
+    Returns:
+        pl.DataFrame: One row per time step and level with timestamp, level, bid, size_bid, ask and size_ask
+    """
+    df = historical_bid_ask.drop_nulls("spread")
+    bid_prices, bid_sizes, ask_prices, ask_sizes = compute_quote_ladders(
+        df["fair_price"].to_numpy(), df["spread"].to_numpy(), n_levels, alpha, bid_sizes, ask_sizes
+    )
+    return pl.DataFrame(
+        {
+            "timestamp": df["timestamp"].to_numpy().repeat(n_levels),
+            "level": np.tile(np.arange(n_levels, dtype=np.uint32), df.height),
+            "bid": bid_prices.ravel(),
+            "size_bid": bid_sizes.ravel(),
+            "ask": ask_prices.ravel(),
+            "size_ask": ask_sizes.ravel(),
+        }
+    )
+
+
 class OrderBook:
     def __init__(self, n_levels: int) -> None:
         """
@@ -20,6 +107,12 @@ class OrderBook:
             n_levels (int): Max levels for both bid and ask sides.
         """
         self.n_levels = n_levels
+        # incremented at each mutation, the snapshots below are rebuilt only when it changes
+        self.version = 0
+        self._snapshot = None
+        self._snapshot_version = -1
+        self._depth = None
+        self._depth_version = -1
         self.bids = pl.DataFrame(
             {"bid": [], "size_bid": [], "timestamp_bid": [], "client_bid": []}
         ).cast(
@@ -41,6 +134,27 @@ class OrderBook:
             }
         )
 
+    @property
+    def bids(self) -> pl.DataFrame:
+        return self._bids
+
+    @bids.setter
+    def bids(self, bids: pl.DataFrame):
+        self._bids = bids
+        # top of book kept up to date at each mutation
+        self._best_bid = bids.row(0) if len(bids) else (None, None, None, None)
+        self.version += 1
+
+    @property
+    def asks(self) -> pl.DataFrame:
+        return self._asks
+
+    @asks.setter
+    def asks(self, asks: pl.DataFrame):
+        self._asks = asks
+        self._best_ask = asks.row(0) if len(asks) else (None, None, None, None)
+        self.version += 1
+
     def get_base_pricing(
         self,
         base_date: datetime,
@@ -55,7 +169,7 @@ class OrderBook:
         Args:
             fair_price (float): The actual fair price
             spread (float): The bid-ask spread
-            alpha (float, optional): Parameter that adjust the mid and fair prices difference based on the liquidity. Defaults to None.
+            alpha (float | np.ndarray, optional): Parameter that adjust the mid and fair prices difference based on the liquidity, one value or one per level. Defaults to None.
             bid_sizes (list[float], optional): A list with all the bid sizes. Defaults to None.
             ask_sizes (list[float], optional): A list with all the ask sizes. Defaults to None.
 
@@ -63,28 +177,12 @@ class OrderBook:
             pl.DataFrame: Return the order book
         """
         # TODO Change the bid/ask computation based on the functions in utils
-        # Define default parameter values
-        if bid_sizes is None:
-            bid_sizes_ok = [100_000] * 5 + [500_000] + [1_000_000] * (self.n_levels - 6)
-        else:
-            bid_sizes_ok = bid_sizes.copy()
-        if ask_sizes is None:
-            ask_sizes_ok = [100_000] * 5 + [500_000] + [1_000_000] * (self.n_levels - 6)
-        else:
-            ask_sizes_ok = ask_sizes.copy()
-        # TODO Alpha should be a list with a different value for each level linked to the size
-        if alpha is None:
-            alpha_ok = (sum(ask_sizes_ok) - sum(bid_sizes_ok)) / (
-                sum(ask_sizes_ok) + sum(bid_sizes_ok)
+        bid_prices, bid_sizes_ok, ask_prices, ask_sizes_ok = (
+            ladder[0] for ladder in compute_quote_ladders(
+                [fair_price], [spread], self.n_levels, alpha, bid_sizes, ask_sizes
             )
-        else:
-            alpha_ok = alpha
+        )
 
-        # Compute Bid levels
-        bid_prices = [
-            fair_price * ((1 - alpha_ok * spread - spread / 2) ** (i + 1))
-            for i in range(self.n_levels)
-        ]
         # compute datetimes to use
         bid_timestamps = [base_date for _ in range(self.n_levels)]
 
@@ -108,11 +206,6 @@ class OrderBook:
             .sort("bid", descending=True)
             .head(self.n_levels)
         )
-        # Compute Ask levels
-        ask_prices = [
-            fair_price * ((1 - alpha_ok * spread + spread / 2) ** (i + 1))
-            for i in range(self.n_levels)
-        ]
         # compute datetimes asks
         ask_timestamps = [base_date for _ in range(self.n_levels)]
         new_asks = pl.DataFrame(
@@ -209,29 +302,11 @@ class OrderBook:
 
     def get_best_bid(self) -> tuple:
         """Returns the best bid price, size and timestamp."""
-        return (
-            (
-                self.bids["bid"][0],
-                self.bids["size_bid"][0],
-                self.bids["timestamp_bid"][0],
-                self.bids["client_bid"][0],
-            )
-            if len(self.bids)
-            else (None, None, None, None)
-        )
+        return self._best_bid
 
     def get_best_ask(self) -> tuple:
         """Returns the best ask price and size."""
-        return (
-            (
-                self.asks["ask"][0],
-                self.asks["size_ask"][0],
-                self.asks["timestamp_ask"][0],
-                self.asks["client_ask"][0],
-            )
-            if len(self.asks)
-            else (None, None, None, None)
-        )
+        return self._best_ask
 
     def delete_order(self, price: float, size: float, side: Literal["bid", "ask"]):
         """deletes a specific order from the order book
@@ -250,21 +325,44 @@ class OrderBook:
 
         if side == "ask":
             self.asks = self.asks.filter(
-                (self.asks["ask"] != price) & (self.asks["size_ask"] != size)
-            )  # removing order
+                ~((self.asks["ask"] == price) & (self.asks["size_ask"] == size))
+            )  # removing only the order with this price and size
         elif side == "bid":
             self.bids = self.bids.filter(
-                (self.bids["bid"] != price) & (self.bids["size_bid"] != size)
+                ~((self.bids["bid"] == price) & (self.bids["size_bid"] == size))
+            )
+
+    def get_depth(self, k: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the bid prices, bid sizes, ask prices and ask sizes of the k best levels (all if None) as read-only NumPy arrays."""
+        if self._depth_version != self.version:
+            self._depth = (
+                self.bids["bid"].to_numpy(),
+                self.bids["size_bid"].to_numpy(),
+                self.asks["ask"].to_numpy(),
+                self.asks["size_ask"].to_numpy(),
             )
+            for array in self._depth:
+                array.flags.writeable = False
+            self._depth_version = self.version
+        return tuple(array[:k] for array in self._depth)
 
     def get_order_book(self) -> pl.DataFrame:
-        """Returns the full order book as a Polars DataFrame with the correct column order."""
+        """Returns the full order book as a Polars DataFrame with the correct column order.
+
+        The frame is cached and only rebuilt when the book changed since the last call.
+        """
+        if self._snapshot_version != self.version:
+            self._snapshot = self._build_order_book()
+            self._snapshot_version = self.version
+        return self._snapshot
+
+    def _build_order_book(self) -> pl.DataFrame:
         # Add index columns for joining
         asks_indexed = self.asks.with_row_index()
         bids_indexed = self.bids.with_row_index()
 
         # Join on index to align rows
-        order_book = asks_indexed.join(bids_indexed, on="index", how="outer").drop(
+        order_book = asks_indexed.join(bids_indexed, on="index", how="full").drop(
             "index"
         )
 
@@ -279,3 +377,770 @@ class OrderBook:
             pl.col("timestamp_ask").cast(pl.Datetime),
             pl.col("client_ask").cast(pl.Boolean),
         )
+
+
+class FillBuffer:
+    def __init__(self, capacity: int = 256) -> None:
+        """
+        Preallocated fill arrays written by the sweep kernels of _BookSide.sweep, the caller reads the
+        first n fills and resets n once the buffer is full (or the sweep is over).
+
+        Parameters:
+            capacity (int): Max fills written by one sweep call.
+        """
+        self.prices = np.empty(capacity, dtype=np.float64)
+        self.sizes = np.empty(capacity, dtype=np.float64)
+        self.clients = np.empty(capacity, dtype=np.bool_)
+        self.n = 0
+
+
+def _sweep_loop(
+    keys: np.ndarray,
+    prices: np.ndarray,
+    sizes: np.ndarray,
+    timestamps: np.ndarray,
+    clients: np.ndarray,
+    count: int,
+    sign: float,
+    remaining: float,
+    timestamp: int,
+    fair_price: float,
+    requote: bool,
+    requote_volume: float,
+    fill_prices: np.ndarray,
+    fill_sizes: np.ndarray,
+    fill_clients: np.ndarray,
+    n_fills: int,
+) -> tuple[int, int, float]:
+    """Sweep of one book side (arrays of a _BookSide, timestamps as int64 microseconds) by a market order
+
+    The best levels are consumed until the order is filled, the side is empty or the fill buffer is full, and
+    each consumed non client level is requoted at fair_price + (price - fair_price) * (1 + traded / requote_volume)
+    (utils.compute_one_new_bid/ask) with set_level semantics. Compiled with numba when it is installed.
+
+    Returns:
+        tuple[int, int, float]: The number of fills in the buffer, the number of levels and the unfilled size
+    """
+    n_levels = len(keys)
+    capacity = len(fill_prices)
+    while remaining > 0 and count > 0 and n_fills < capacity:
+        best_price = prices[0]
+        best_size = sizes[0]
+        client = clients[0]
+        traded = min(remaining, best_size)
+        if traded < best_size:
+            sizes[0] -= traded
+            timestamps[0] = timestamp
+        else:
+            for i in range(count - 1):
+                keys[i] = keys[i + 1]
+                prices[i] = prices[i + 1]
+                sizes[i] = sizes[i + 1]
+                timestamps[i] = timestamps[i + 1]
+                clients[i] = clients[i + 1]
+            count -= 1
+        if requote and not client:
+            new_price = fair_price + (best_price - fair_price) * (1 + traded / requote_volume)
+            key = sign * new_price
+            pos = np.searchsorted(keys[:count], key)
+            if pos < count and keys[pos] == key:  # we remove the old level at the same price
+                for i in range(pos, count - 1):
+                    keys[i] = keys[i + 1]
+                    prices[i] = prices[i + 1]
+                    sizes[i] = sizes[i + 1]
+                    timestamps[i] = timestamps[i + 1]
+                    clients[i] = clients[i + 1]
+                count -= 1
+            if pos < n_levels:
+                last = min(count, n_levels - 1)
+                for i in range(last, pos, -1):
+                    keys[i] = keys[i - 1]
+                    prices[i] = prices[i - 1]
+                    sizes[i] = sizes[i - 1]
+                    timestamps[i] = timestamps[i - 1]
+                    clients[i] = clients[i - 1]
+                keys[pos] = key
+                prices[pos] = new_price
+                sizes[pos] = traded
+                timestamps[pos] = timestamp
+                clients[pos] = False
+                count = last + 1
+        remaining -= traded
+        fill_prices[n_fills] = best_price
+        fill_sizes[n_fills] = traded
+        fill_clients[n_fills] = client
+        n_fills += 1
+    return n_fills, count, remaining
+
+
+_sweep_kernel = njit(cache=True)(_sweep_loop) if njit is not None else None
+
+
+def _sweep_compiled(
+    book_side: "_BookSide",
+    remaining: float,
+    timestamp: np.datetime64,
+    fair_price: float,
+    requote: bool,
+    requote_volume: float,
+    fills: FillBuffer,
+    kernel=None,
+) -> float:
+    """Runs the sweep kernel (_sweep_loop, compiled if possible) on the arrays of a book side, returns the unfilled size."""
+    fills.n, book_side.count, remaining = (kernel or _sweep_kernel)(
+        book_side.keys, book_side.prices, book_side.sizes, book_side.timestamps.view(np.int64), book_side.clients,
+        book_side.count, book_side._sign, float(remaining), timestamp.astype("datetime64[us]").astype(np.int64), float(fair_price),
+        requote, float(requote_volume), fills.prices, fills.sizes, fills.clients, fills.n,
+    )
+    book_side.version += 1
+    return remaining
+
+
+def _sweep_numpy(
+    book_side: "_BookSide",
+    remaining: float,
+    timestamp: np.datetime64,
+    fair_price: float,
+    requote: bool,
+    requote_volume: float,
+    fills: FillBuffer,
+) -> float:
+    """NumPy version of _sweep_loop: the levels consumed by the order are found with a cumulative sum and removed at once.
+
+    A pass stops before a level that a requote of a previous level would come before (or replace), since the
+    order would trade the requoted level first; the next pass starts from the updated side. An order that fits
+    in the best level (the most common case), or whose requote of the best level comes before the next level,
+    is filled without array operations.
+    """
+    capacity = len(fills.prices)
+    while remaining > 0 and book_side.count and fills.n < capacity:
+        best_price, best_size, client = float(book_side.prices[0]), float(book_side.sizes[0]), bool(book_side.clients[0])
+        if requote and not client:
+            new_price = fair_price + (best_price - fair_price) * (1 + min(remaining, best_size) / requote_volume)
+        if remaining <= best_size or book_side.count == 1 or (
+            requote and not client and book_side._sign * new_price <= book_side.keys[1]
+        ):  # a pass of one level, without array operations
+            traded = min(remaining, best_size)
+            if traded < best_size:
+                book_side.fill_best(traded, timestamp)
+            else:
+                book_side.remove_at(0)
+            if requote and not client:
+                book_side.set_level(new_price, traded, timestamp, False)
+            remaining -= traded
+            fills.prices[fills.n] = best_price
+            fills.sizes[fills.n] = traded
+            fills.clients[fills.n] = client
+            fills.n += 1
+            continue
+        n = min(book_side.count, capacity - fills.n)
+        consumed = np.cumsum(book_side.sizes[:n])
+        n_full = int(consumed.searchsorted(remaining, side="right"))  # levels with a cumulative size <= remaining
+        touched = n_full + int(n_full < n and consumed[n_full - 1] < remaining)
+        traded = book_side.sizes[:touched].copy()
+        if n_full < touched:  # the last touched level is partially filled
+            traded[-1] = remaining - consumed[n_full - 1]
+        prices = book_side.prices[:touched].copy()
+        clients = book_side.clients[:touched].copy()
+        if requote:
+            new_prices = fair_price + (prices - fair_price) * (1 + traded / requote_volume)
+            new_keys = np.where(clients, np.inf, book_side._sign * new_prices)
+            before = np.flatnonzero(np.minimum.accumulate(new_keys[:-1]) <= book_side.keys[1:touched])
+            if len(before):
+                touched = n_full = int(before[0]) + 1
+                traded, prices, clients, new_prices = traded[:touched], prices[:touched], clients[:touched], new_prices[:touched]
+
+        i = fills.n
+        fills.prices[i : i + touched] = prices
+        fills.sizes[i : i + touched] = traded
+        fills.clients[i : i + touched] = clients
+        fills.n += touched
+        if n_full:
+            n = book_side.count
+            for col in book_side._columns():
+                col[: n - n_full] = col[n_full:n]
+            book_side.count -= n_full
+        if n_full < touched:
+            book_side.sizes[0] -= traded[-1]
+            book_side.timestamps[0] = timestamp
+            remaining = 0.0
+        else:
+            remaining -= float(traded.sum())
+        book_side.version += 1
+        if requote:
+            _requote_levels(book_side, new_prices[~clients], traded[~clients], timestamp)
+    return remaining
+
+
+def _requote_levels(book_side: "_BookSide", prices: np.ndarray, sizes: np.ndarray, timestamp: np.datetime64):
+    """set_level of each of these levels in order, merged into the side with one stable sort when there are several."""
+    if len(prices) <= 2:
+        for price, size in zip(prices.tolist(), sizes.tolist()):
+            book_side.set_level(price, size, timestamp, False)
+        return
+    n = book_side.count
+    keys = np.concatenate([book_side.keys[:n], book_side._sign * prices])
+    order = np.argsort(keys, kind="stable")
+    # at equal prices the last level set replaces the others, then only the n_levels best are kept
+    last = np.append(keys[order[1:]] != keys[order[:-1]], True)
+    order = order[last][: book_side.n_levels]
+    new_levels = (
+        keys,
+        np.concatenate([book_side.prices[:n], prices]),
+        np.concatenate([book_side.sizes[:n], sizes]),
+        np.concatenate([book_side.timestamps[:n], np.full(len(prices), timestamp)]),
+        np.concatenate([book_side.clients[:n], np.zeros(len(prices), dtype=np.bool_)]),
+    )
+    m = len(order)
+    for col, new_col in zip(book_side._columns(), new_levels):
+        col[:m] = new_col[order]
+    book_side.count = m
+    book_side.version += 1
+
+
+@dataclass(slots=True)
+class RestingOrder:
+    """A limit order resting in the queue of a price level of an ArrayOrderBook."""
+    order_id: int
+    side: Literal["bid", "ask"]
+    price: float
+    size: float
+    timestamp: datetime
+    client: bool
+
+
+class _BookSide:
+    def __init__(
+        self,
+        side: Literal["bid", "ask"],
+        n_levels: int,
+        orders: dict[int, RestingOrder] = None,
+        order_ids: itertools.count = None,
+    ) -> None:
+        """
+        One side of an ArrayOrderBook, stored in preallocated NumPy arrays kept sorted best price first.
+        The arrays hold the total size of each level. A level that received individual orders (add_order)
+        also has a FIFO queue of its orders, an OrderedDict order_id -> RestingOrder in time priority, and the
+        levels without queue (base pricing, set_level) behave as a single order.
+
+        Parameters:
+            side (str): "bid" or "ask".
+            n_levels (int): Max levels kept on this side.
+            orders (dict[int, RestingOrder]): order_id -> order index, shared by the two sides of the book.
+            order_ids (itertools.count): Generator of the order ids, shared by the two sides of the book.
+        """
+        self.side = side
+        self.n_levels = n_levels
+        # bids are stored with a negated key so that both sides are sorted ascending for searchsorted
+        self._sign = -1.0 if side == "bid" else 1.0
+        self.keys = np.empty(n_levels, dtype=np.float64)
+        self.prices = np.empty(n_levels, dtype=np.float64)
+        self.sizes = np.empty(n_levels, dtype=np.float64)
+        self.timestamps = np.empty(n_levels, dtype="datetime64[us]")
+        self.clients = np.empty(n_levels, dtype=np.bool_)  # client flag of the first order of the level
+        self.count = 0
+        self.version = 0  # incremented at each mutation
+        self.orders = {} if orders is None else orders
+        self.order_ids = itertools.count(1) if order_ids is None else order_ids
+        self.queues: dict[float, OrderedDict[int, RestingOrder]] = {}
+
+    def _columns(self) -> tuple:
+        return (self.keys, self.prices, self.sizes, self.timestamps, self.clients)
+
+    def find(self, price: float) -> int:
+        """Returns the position of the level at this price, or -1 if there is none."""
+        key = self._sign * price
+        pos = int(self.keys[: self.count].searchsorted(key))
+        if pos < self.count and self.keys[pos] == key:
+            return pos
+        return -1
+
+    def _drop_queue(self, price: float):
+        """Forgets the orders queued at this price, when their level is removed."""
+        queue = self.queues.pop(float(price), None)
+        if queue:
+            for order_id in queue:
+                del self.orders[order_id]
+
+    def remove_at(self, pos: int):
+        """Removes the level at position pos, shifting the worse levels up."""
+        if self.queues:
+            self._drop_queue(self.prices[pos])
+        n = self.count
+        for col in self._columns():
+            col[pos : n - 1] = col[pos + 1 : n]
+        self.count -= 1
+        self.version += 1
+
+    def insert(self, price: float, size: float, timestamp: datetime, client: bool) -> bool:
+        """Inserts a level at its sorted position, dropping the worst level if the side is full. Returns False if the level is not kept."""
+        key = self._sign * price
+        n = self.count
+        pos = int(self.keys[:n].searchsorted(key))
+        if pos >= self.n_levels:
+            return False  # worse than every kept level, same as .head(n_levels)
+        if n == self.n_levels and self.queues:
+            self._drop_queue(self.prices[n - 1])
+        last = min(n, self.n_levels - 1)
+        for col in self._columns():
+            col[pos + 1 : last + 1] = col[pos:last]
+        self.keys[pos] = key
+        self.prices[pos] = price
+        self.sizes[pos] = size
+        self.timestamps[pos] = timestamp
+        self.clients[pos] = client
+        self.count = last + 1
+        self.version += 1
+        return True
+
+    def head(self) -> tuple[float, float, bool]:
+        """Returns the price, size and client flag of the first order (in time priority) of the best level."""
+        price = float(self.prices[0])
+        queue = self.queues.get(price) if self.queues else None
+        if queue is None:
+            return price, float(self.sizes[0]), bool(self.clients[0])
+        order = next(iter(queue.values()))
+        return price, order.size, order.client
+
+    def fill_best(self, size: float, timestamp: datetime):
+        """Reduces the size of the first order of the best level after a partial fill."""
+        if self.queues:
+            queue = self.queues.get(float(self.prices[0]))
+            if queue is not None:
+                next(iter(queue.values())).size -= size
+        self.sizes[0] -= size
+        self.timestamps[0] = timestamp
+        self.version += 1
+
+    def pop_best(self):
+        """Removes the first order of the best level after a full fill, and the level with its last order."""
+        queue = self.queues.get(float(self.prices[0])) if self.queues else None
+        if queue is None or len(queue) == 1:
+            self.remove_at(0)
+            return
+        order_id, order = queue.popitem(last=False)
+        del self.orders[order_id]
+        self.sizes[0] -= order.size
+        self.clients[0] = next(iter(queue.values())).client
+        self.version += 1
+
+    def _queue(self, pos: int) -> OrderedDict[int, RestingOrder]:
+        """The queue of the level at pos, a level without queue becomes a queue of one order."""
+        price = float(self.prices[pos])
+        queue = self.queues.get(price)
+        if queue is None:
+            order = RestingOrder(
+                next(self.order_ids), self.side, price, float(self.sizes[pos]),
+                self.timestamps[pos].item(), bool(self.clients[pos]),
+            )
+            self.orders[order.order_id] = order
+            queue = self.queues[price] = OrderedDict({order.order_id: order})
+        return queue
+
+    def add_order(self, price: float, size: float, timestamp: datetime, client: bool) -> RestingOrder | None:
+        """Queues a new order at the back of its level (creating the level if needed), returns None if the level is not kept."""
+        pos = self.find(price)
+        if pos < 0:
+            if not self.insert(price, size, timestamp, client):
+                return None
+            queue = self.queues[price] = OrderedDict()
+        else:
+            queue = self._queue(pos)
+            self.sizes[pos] += size
+            self.version += 1
+        order = RestingOrder(next(self.order_ids), self.side, price, size, timestamp, client)
+        queue[order.order_id] = order
+        self.orders[order.order_id] = order
+        return order
+
+    def cancel(self, order: RestingOrder):
+        """Removes an order from its queue, and its level if it was the last order."""
+        queue = self.queues[order.price]
+        pos = self.find(order.price)
+        if len(queue) == 1:
+            self.remove_at(pos)
+            return
+        first = next(iter(queue))
+        del queue[order.order_id]
+        del self.orders[order.order_id]
+        self.sizes[pos] -= order.size
+        if first == order.order_id:
+            self.clients[pos] = next(iter(queue.values())).client
+        self.version += 1
+
+    def amend(self, order: RestingOrder, size: float):
+        """Changes the size of an order: a decrease keeps its queue position, an increase sends it to the back of the queue."""
+        queue = self.queues[order.price]
+        pos = self.find(order.price)
+        self.sizes[pos] += size - order.size
+        if size > order.size:
+            queue.move_to_end(order.order_id)
+            self.clients[pos] = next(iter(queue.values())).client
+        order.size = size
+        self.version += 1
+
+    def clear(self):
+        """Removes every level, without reallocating the arrays."""
+        for price in list(self.queues):
+            self._drop_queue(price)
+        self.count = 0
+        self.version += 1
+
+    def load(self, prices: np.ndarray, sizes: np.ndarray, timestamp: datetime) -> bool:
+        """Copies a ladder sorted best price first into an empty side, returns False if it cannot (side not empty or ladder not sorted)."""
+        keys = self._sign * prices[: self.n_levels]
+        if self.count or np.any(np.diff(keys) <= 0) or np.any(sizes[: self.n_levels] <= 0):
+            return False
+        n = len(keys)
+        self.keys[:n] = keys
+        self.prices[:n] = prices[:n]
+        self.sizes[:n] = sizes[:n]
+        self.timestamps[:n] = timestamp
+        self.clients[:n] = False
+        self.count = n
+        self.version += 1
+        return True
+
+    def set_level(self, price: float, size: float, timestamp: datetime, client: bool):
+        """Replaces the level at this price (and its queued orders) by a single order, or removes it if size is 0, like OrderBook.update_order."""
+        pos = self.find(price)
+        if pos >= 0:
+            self.remove_at(pos)  # we remove the old level at the same price
+        if size > 0:
+            self.insert(price, size, timestamp, client)
+
+    def sweep(
+        self,
+        remaining: float,
+        timestamp: np.datetime64,
+        fair_price: float,
+        requote: bool,
+        requote_volume: float,
+        fills: FillBuffer,
+    ) -> float:
+        """Consumes the best levels for a market order of this size, writing the fills into the buffer
+
+        The consumed non client levels are requoted further away like utils.compute_one_new_bid/ask. A side
+        without queued orders is swept in one call of the compiled kernel (or its NumPy version), the queued
+        orders are filled one after the other in time priority. Stops when the buffer is full.
+
+        Returns:
+            float: The size left to fill
+        """
+        if not self.queues:
+            if _sweep_kernel is not None:
+                return _sweep_compiled(self, remaining, timestamp, fair_price, requote, requote_volume, fills)
+            return _sweep_numpy(self, remaining, timestamp, fair_price, requote, requote_volume, fills)
+        capacity = len(fills.prices)
+        while remaining > 0 and self.count and fills.n < capacity:
+            best_price, best_size, client = self.head()
+            traded = min(remaining, best_size)
+            if traded < best_size:
+                self.fill_best(traded, timestamp)
+            else:
+                self.pop_best()
+            if requote and not client:
+                new_price = fair_price + (best_price - fair_price) * (1 + traded / requote_volume)
+                self.set_level(new_price, traded, timestamp, False)
+            remaining -= traded
+            fills.prices[fills.n] = best_price
+            fills.sizes[fills.n] = traded
+            fills.clients[fills.n] = client
+            fills.n += 1
+        return remaining
+
+    def best(self) -> tuple:
+        """Returns the best price, size, timestamp and client flag."""
+        if not self.count:
+            return (None, None, None, None)
+        return (
+            float(self.prices[0]),
+            float(self.sizes[0]),
+            self.timestamps[0].item(),
+            bool(self.clients[0]),
+        )
+
+    def to_frame(self, height: int = None) -> pl.DataFrame:
+        """Returns the side as a Polars DataFrame with the same schema as OrderBook.bids/asks, padded with nulls up to height rows."""
+        n = self.count
+        pad = 0 if height is None else height - n
+        side = self.side
+        return pl.DataFrame(
+            [
+                pl.Series(side, self.prices[:n]),
+                pl.Series(f"size_{side}", self.sizes[:n]),
+                pl.Series(f"timestamp_{side}", self.timestamps[:n]),
+                pl.Series(f"client_{side}", self.clients[:n]),
+            ]
+        ).extend(
+            pl.DataFrame(
+                schema={
+                    side: pl.Float64,
+                    f"size_{side}": pl.Float64,
+                    f"timestamp_{side}": pl.Datetime,
+                    f"client_{side}": pl.Boolean,
+                }
+            ).clear(pad)
+        )
+
+
+class ArrayOrderBook:
+    def __init__(self, n_levels: int) -> None:
+        """
+        Order book with the same API as OrderBook, but each side is kept in preallocated NumPy arrays.
+        Inserts use a binary search plus a shift of at most n_levels elements, and a Polars frame is
+        only built when get_order_book() (or the bids/asks properties) is called.
+        On top of the level API, add_order queues individual orders in time priority at their level, and
+        they can be cancelled or amended by id (see cancel_order and amend_order).
+
+        Parameters:
+            n_levels (int): Max levels for both bid and ask sides.
+        """
+        self.n_levels = n_levels
+        # order_id -> resting order of both sides
+        self.orders = {}
+        order_ids = itertools.count(1)
+        self._bids = _BookSide("bid", n_levels, self.orders, order_ids)
+        self._asks = _BookSide("ask", n_levels, self.orders, order_ids)
+        # frames cached with the versions of the sides they were built from
+        self._frames = {}
+
+    @classmethod
+    def from_order_book(cls, orderbook: OrderBook) -> "ArrayOrderBook":
+        """Builds an ArrayOrderBook with the same levels as a Polars OrderBook."""
+        return cls(orderbook.n_levels).load_frames(orderbook.bids, orderbook.asks)
+
+    def load_frames(self, bids: pl.DataFrame, asks: pl.DataFrame) -> "ArrayOrderBook":
+        """Adds the levels of bid and ask frames (with the schema of OrderBook.bids/asks, e.g. the bids and asks of another book) to the book."""
+        for side, frame in (("bid", bids), ("ask", asks)):
+            book_side = self.get_side(side)
+            for price, size, timestamp, client in frame.iter_rows():
+                book_side.set_level(price, size, timestamp, client)
+        return self
+
+    def clear(self):
+        """Removes every level of the book, without reallocating the arrays."""
+        self._bids.clear()
+        self._asks.clear()
+
+    def get_side(self, side: Literal["bid", "ask"]) -> _BookSide:
+        """Returns the arrays of one side of the book."""
+        side = side.strip().lower()
+        if side == "bid":
+            return self._bids
+        if side == "ask":
+            return self._asks
+        raise Exception("Input a valid side argument : either 'bid' or 'ask'.")
+
+    @property
+    def version(self) -> tuple[int, int]:
+        """Versions of the bid and ask sides, they change at each mutation."""
+        return (self._bids.version, self._asks.version)
+
+    def _cached(self, name: str, version, build):
+        cached_version, frame = self._frames.get(name, (None, None))
+        if cached_version != version:
+            frame = build()
+            self._frames[name] = (version, frame)
+        return frame
+
+    @property
+    def bids(self) -> pl.DataFrame:
+        """The bid side as a Polars DataFrame (built when the side changed)."""
+        return self._cached("bids", self._bids.version, self._bids.to_frame)
+
+    @property
+    def asks(self) -> pl.DataFrame:
+        """The ask side as a Polars DataFrame (built when the side changed)."""
+        return self._cached("asks", self._asks.version, self._asks.to_frame)
+
+    def get_base_pricing(
+        self,
+        base_date: datetime,
+        fair_price: float,
+        spread: float,
+        alpha: float = None,
+        bid_sizes: list[float] = None,
+        ask_sizes: list[float] = None,
+    ):
+        """Generates the base pricing order book, see OrderBook.get_base_pricing
+
+        Args:
+            fair_price (float): The actual fair price
+            spread (float): The bid-ask spread
+            alpha (float | np.ndarray, optional): Parameter that adjust the mid and fair prices difference based on the liquidity, one value or one per level. Defaults to None.
+            bid_sizes (list[float], optional): A list with all the bid sizes. Defaults to None.
+            ask_sizes (list[float], optional): A list with all the ask sizes. Defaults to None.
+
+        Returns:
+            ArrayOrderBook: Return the order book
+        """
+        bid_prices, bid_sizes, ask_prices, ask_sizes = (
+            ladder[0] for ladder in compute_quote_ladders(
+                [fair_price], [spread], self.n_levels, alpha, bid_sizes, ask_sizes
+            )
+        )
+        return self.load_ladder(base_date, bid_prices, bid_sizes, ask_prices, ask_sizes)
+
+    def load_ladder(
+        self,
+        timestamp: datetime,
+        bid_prices: np.ndarray,
+        bid_sizes: np.ndarray,
+        ask_prices: np.ndarray,
+        ask_sizes: np.ndarray,
+    ) -> "ArrayOrderBook":
+        """Adds the levels of one time step of compute_quote_ladders to the book
+
+        On an empty book the sorted ladders are copied directly into the arrays, in O(n_levels) and without sort.
+
+        Returns:
+            ArrayOrderBook: Return the order book
+        """
+        for book_side, prices, sizes in ((self._bids, bid_prices, bid_sizes), (self._asks, ask_prices, ask_sizes)):
+            if not book_side.load(prices, sizes, timestamp):
+                for price, size in zip(prices.tolist(), sizes.tolist()):
+                    book_side.set_level(price, size, timestamp, False)
+        return self
+
+    def update_order(
+        self,
+        price: float,
+        size: float,
+        side: Literal["bid", "ask"],
+        client: bool = False,
+    ):
+        """
+        Updates the order book with a new or modified order.
+
+        Parameters:
+            price (float): Price level of the order.
+            size (float): Size (quantity) of the order.
+            side (str): "bid" or "ask".
+        """
+        self.get_side(side).set_level(float(price), float(size), datetime.now(), client)
+
+    def add_order(
+        self,
+        price: float,
+        size: float,
+        side: Literal["bid", "ask"],
+        client: bool = False,
+        timestamp: datetime = None,
+    ) -> int | None:
+        """Adds a limit order at the back of the queue of its price level
+
+        Unlike update_order, the orders already resting at this price keep their size and time priority.
+
+        Args:
+            price (float): Price of the order
+            size (float): Size of the order
+            side (str): "bid" or "ask"
+            client (bool, optional): Client order, not requoted when it trades. Defaults to False.
+            timestamp (datetime, optional): Time of the order. Defaults to now.
+
+        Returns:
+            int | None: The order id, or None if the price is worse than the n_levels kept levels
+        """
+        if timestamp is None:
+            timestamp = datetime.now()
+        order = self.get_side(side).add_order(float(price), float(size), timestamp, client)
+        return None if order is None else order.order_id
+
+    def get_order(self, order_id: int) -> RestingOrder | None:
+        """Returns the resting order with this id, or None if it was filled or cancelled."""
+        return self.orders.get(order_id)
+
+    def cancel_order(self, order_id: int) -> RestingOrder | None:
+        """Cancels an order by id in O(1), returns the cancelled order or None if it is no longer in the book."""
+        order = self.orders.get(order_id)
+        if order is not None:
+            self.get_side(order.side).cancel(order)
+        return order
+
+    def amend_order(self, order_id: int, size: float) -> RestingOrder | None:
+        """Changes the size of an order by id: a decrease keeps its queue position, an increase loses it, and 0 cancels it.
+
+        Returns:
+            RestingOrder | None: The amended order, or None if it is no longer in the book
+        """
+        order = self.orders.get(order_id)
+        if order is None or size <= 0:
+            return self.cancel_order(order_id)
+        self.get_side(order.side).amend(order, float(size))
+        return order
+
+    def get_queue(self, price: float, side: Literal["bid", "ask"]) -> list[RestingOrder]:
+        """Returns the orders of a price level in time priority (a level without queued orders is one order without id)."""
+        book_side = self.get_side(side)
+        pos = book_side.find(float(price))
+        if pos < 0:
+            return []
+        queue = book_side.queues.get(float(price))
+        if queue is None:
+            return [
+                RestingOrder(
+                    None, book_side.side, float(price), float(book_side.sizes[pos]),
+                    book_side.timestamps[pos].item(), bool(book_side.clients[pos]),
+                )
+            ]
+        return list(queue.values())
+
+    def get_best_bid(self) -> tuple:
+        """Returns the best bid price, size and timestamp."""
+        return self._bids.best()
+
+    def get_best_ask(self) -> tuple:
+        """Returns the best ask price and size."""
+        return self._asks.best()
+
+    def delete_order(self, price: float, size: float, side: Literal["bid", "ask"]):
+        """deletes a specific order from the order book
+
+        Args:
+            price (float): price of the order to delete
+            size (float): size of the order to delete
+            side (str): side of the order to delete. should be either 'bid' or 'ask'
+
+        Raises:
+            Exception: if the side is not correctly specified as 'bid' or 'ask'
+        """
+        book_side = self.get_side(side)
+        pos = book_side.find(float(price))
+        if pos >= 0 and book_side.sizes[pos] == size:
+            book_side.remove_at(pos)
+
+    def get_depth(self, k: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the bid prices, bid sizes, ask prices and ask sizes of the k best levels (all if None).
+
+        These are read-only views on the book arrays, they are only valid until the next mutation.
+        """
+        views = []
+        for book_side in (self._bids, self._asks):
+            n = book_side.count if k is None else min(k, book_side.count)
+            for array in (book_side.prices, book_side.sizes):
+                view = array[:n]
+                view.flags.writeable = False
+                views.append(view)
+        return tuple(views)
+
+    def get_order_book(self) -> pl.DataFrame:
+        """Returns the full order book as a Polars DataFrame with the correct column order.
+
+        The frame is cached and only rebuilt when the book changed since the last call.
+        """
+        return self._cached("order_book", self.version, self._build_order_book)
+
+    def _build_order_book(self) -> pl.DataFrame:
+        # pad the shorter side with nulls to align rows, like the outer join on index in OrderBook
+        height = max(self._bids.count, self._asks.count)
+        return self._bids.to_frame(height).hstack(self._asks.to_frame(height)).select(
+            "client_bid",
+            "timestamp_bid",
+            "size_bid",
+            "bid",
+            "ask",
+            "size_ask",
+            "timestamp_ask",
+            "client_ask",
+        )
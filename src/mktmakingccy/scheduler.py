@@ -0,0 +1,162 @@
+import numpy as np
+import polars as pl
+
+from .order_book import ArrayOrderBook, compute_quote_ladders
+from .trade import TradeHistory, _match_orders, _fills_frame
+
+
+def session_quote_grids(
+    historical_bid_ask: pl.DataFrame,
+    n_levels: int = 15,
+    every: str = "1d",
+    quote_offset: str = "0h",
+    quote_period: str = "1h",
+    alpha: float | np.ndarray = None,
+    bid_sizes: list[float] = None,
+    ask_sizes: list[float] = None,
+) -> pl.DataFrame:
+    """Computes the base pricing grid of each session once
+
+    The time steps are grouped by session with group_by_dynamic, and only the ones in the quoting window
+    [session start + quote_offset, session start + quote_offset + quote_period) are kept (e.g. the first
+    hour of the day, or the second one with quote_offset="1h"). The session is priced with the mean fair
+    price and spread of that window, see order_book.compute_quote_ladders. The grid is only known at the
+    end of the window, so it is active from then on (active_from), and never prices orders of its own window.
+
+    Args:
+        historical_bid_ask (pl.DataFrame): DF with timestamp, fair_price and spread columns (e.g. utils.compute_all_bid_ask)
+        n_levels (int, optional): Number of levels of each side. Defaults to 15.
+        every (str, optional): Length of a session, as a Polars duration. Defaults to "1d".
+        quote_offset (str, optional): Start of the quoting window in the session. Defaults to "0h".
+        quote_period (str, optional): Length of the quoting window. Defaults to "1h".
+        alpha, bid_sizes, ask_sizes: see OrderBook.get_base_pricing.
+
+    Returns:
+        pl.DataFrame: One row per session with session, active_from, fair_price, spread, and the bid, size_bid, ask and size_ask levels as arrays
+    """
+    session_start = pl.col("timestamp").dt.truncate(every)
+    in_window = pl.col("timestamp").is_between(
+        session_start.dt.offset_by(quote_offset),
+        session_start.dt.offset_by(quote_offset).dt.offset_by(quote_period),
+        closed="left",
+    )
+    sessions = (
+        historical_bid_ask.lazy()
+        .select("timestamp", "fair_price", "spread")
+        .drop_nulls()
+        .filter(in_window)
+        .sort("timestamp")
+        .group_by_dynamic("timestamp", every=every)
+        .agg(pl.col("fair_price").mean(), pl.col("spread").mean())
+        .rename({"timestamp": "session"})
+        .with_columns(pl.col("session").dt.offset_by(quote_offset).dt.offset_by(quote_period).alias("active_from"))
+        .select("session", "active_from", "fair_price", "spread")
+        .collect()
+    )
+    bid_prices, bid_sizes, ask_prices, ask_sizes = compute_quote_ladders(
+        sessions["fair_price"].to_numpy(), sessions["spread"].to_numpy(), n_levels, alpha, bid_sizes, ask_sizes
+    )
+    array_dtype = pl.Array(pl.Float64, n_levels)
+    return sessions.with_columns(
+        pl.Series("bid", bid_prices, dtype=array_dtype),
+        pl.Series("size_bid", np.ascontiguousarray(bid_sizes), dtype=array_dtype),
+        pl.Series("ask", ask_prices, dtype=array_dtype),
+        pl.Series("size_ask", np.ascontiguousarray(ask_sizes), dtype=array_dtype),
+    )
+
+
+class SessionScheduler:
+    def __init__(
+        self,
+        historical_bid_ask: pl.DataFrame,
+        n_levels: int = 15,
+        every: str = "1d",
+        quote_offset: str = "0h",
+        quote_period: str = "1h",
+        refill: bool = True,
+        **pricing_params,
+    ) -> None:
+        """
+        Rebalancing of the order book: the book is reset to the session quote grid when it becomes active (at
+        the end of the quoting window of the session, so the grid only uses past prices), and after each trade
+        the consumed levels are refilled in place at their grid price and size. The grids are computed once
+        with session_quote_grids, so a reset costs O(n_levels) and a refill only touches the consumed levels,
+        instead of rerunning get_base_pricing or compute_one_new_bid/ask. Until the grid of a session is
+        active, and for a session without time steps in its quoting window, the previous grid is kept.
+
+        Parameters:
+            historical_bid_ask (pl.DataFrame): DF with timestamp, fair_price and spread columns (e.g. utils.compute_all_bid_ask).
+            n_levels, every, quote_offset, quote_period: see session_quote_grids.
+            refill (bool): Refill the consumed levels after each trade. Defaults to True.
+            pricing_params: alpha, bid_sizes and ask_sizes passed to session_quote_grids.
+        """
+        self.n_levels = n_levels
+        self.every = every
+        self.refill = refill
+        self.grids = session_quote_grids(
+            historical_bid_ask, n_levels, every, quote_offset, quote_period, **pricing_params
+        )
+        self._sessions = self.grids["session"].cast(pl.Datetime("us")).to_numpy()
+        self._active_from = self.grids["active_from"].cast(pl.Datetime("us")).to_numpy()
+        self._ladders = [
+            self.grids[name].to_numpy() for name in ("bid", "size_bid", "ask", "size_ask")
+        ]
+        self.book = ArrayOrderBook(n_levels)
+        self.session = None  # index of the grid loaded in the book
+        self._refill_sizes = {"bid": {}, "ask": {}}
+
+    def reset(self, session: int) -> ArrayOrderBook:
+        """Loads the grid of this session in an emptied book."""
+        bid_prices, bid_sizes, ask_prices, ask_sizes = (ladder[session] for ladder in self._ladders)
+        self.book.clear()
+        self.book.load_ladder(self._active_from[session], bid_prices, bid_sizes, ask_prices, ask_sizes)
+        self._refill_sizes = {
+            "bid": dict(zip(bid_prices.tolist(), bid_sizes.tolist())),
+            "ask": dict(zip(ask_prices.tolist(), ask_sizes.tolist())),
+        }
+        self.session = session
+        return self.book
+
+    def match(self, market_orders: pl.DataFrame, trade_history: TradeHistory = None) -> pl.DataFrame:
+        """Matches a stream of market orders, in time order, resetting and refilling the book on the way
+
+        The scheduler keeps its book and session between calls, so a long stream can be matched chunk by chunk.
+
+        Args:
+            market_orders (pl.DataFrame): The orders with timestamp, side ('buy' or 'sell') and size columns (e.g. utils.sample_market_orders)
+            trade_history (TradeHistory, optional): History where the fills are logged. Defaults to None.
+
+        Returns:
+            pl.DataFrame: The fills (order_id, timestamp, side, price, size, client), see trade.match_market_orders
+        """
+        timestamps = market_orders["timestamp"].cast(pl.Datetime("us")).to_numpy()
+        is_buy = (market_orders["side"].cast(pl.String) == "buy").to_list()
+        sizes = market_orders["size"].cast(pl.Float64).to_list()
+        order_sessions = (np.searchsorted(self._active_from, timestamps, side="right") - 1).tolist()
+
+        fill_order, fill_price, fill_size, fill_client = [], [], [], []
+        for k, session in enumerate(order_sessions):
+            if session < 0:  # before the first active grid, nothing is quoted
+                continue
+            if session != self.session:
+                self.reset(session)
+            n_fills = len(fill_price)
+            # no requote here: the consumed levels go back to the grid
+            _match_orders(
+                self.book, range(k, k + 1), timestamps, is_buy, sizes, None, False,
+                fill_order, fill_price, fill_size, fill_client,
+            )
+            if self.refill:
+                side = "ask" if is_buy[k] else "bid"
+                book_side = self.book.get_side(side)
+                refill_sizes = self._refill_sizes[side]
+                for j in range(n_fills, len(fill_price)):
+                    # only the grid levels are refilled, not the client orders nor the levels added off the grid
+                    refill_size = None if fill_client[j] else refill_sizes.get(fill_price[j])
+                    if refill_size is not None:
+                        book_side.set_level(fill_price[j], refill_size, timestamps[k], False)
+
+        fills = _fills_frame(market_orders, fill_order, fill_price, fill_size, fill_client)
+        if trade_history is not None:
+            trade_history.extend(fills)
+        return fills
@@ -0,0 +1,281 @@
+import math
+import time
+import asyncio
+import numpy as np
+import polars as pl
+from datetime import datetime
+from typing import AsyncIterator
+
+from . import utils
+from . import values as vl
+from .config import MarketConfig, DEFAULT_CONFIG
+from .order_book import ArrayOrderBook, compute_quote_ladders
+from .trade import MarketOrder, TradeHistory, _match_orders
+from .ticks import TickSource
+
+
+class LatencyHistogram:
+    """Latency histogram with log spaced buckets (about 4% wide), constant memory whatever the number of samples."""
+
+    _BUCKETS_PER_OCTAVE = 16
+
+    def __init__(self) -> None:
+        self.counts = {}
+        self.count = 0
+        self.max = 0
+
+    def record(self, nanoseconds: int):
+        bucket = int(math.log2(max(nanoseconds, 1)) * self._BUCKETS_PER_OCTAVE)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.max = max(self.max, nanoseconds)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket of the q quantile, in nanoseconds."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(2 ** ((bucket + 1) / self._BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Number of samples, p50, p99 and max in microseconds."""
+        to_us = lambda ns: None if ns is None else ns / 1_000
+        return {
+            "count": self.count,
+            "p50_us": to_us(self.quantile(0.5)),
+            "p99_us": to_us(self.quantile(0.99)),
+            "max_us": to_us(self.max if self.count else None),
+        }
+
+
+class QuotingService:
+    def __init__(
+        self,
+        n_levels: int = None,
+        volume: float = 0,
+        lambda_val: float = None,
+        bid_asymetry: float = None,
+        inventory_skew: float = 0.0,
+        pricing_params: dict = None,
+        requote: bool = True,
+        max_pending_orders: int = 1024,
+        trade_history: TradeHistory = None,
+        config: MarketConfig = None,
+    ) -> None:
+        """
+        Long-lived market maker on an asyncio event loop, with one task per stage:
+        - quote: takes the latest fair price tick, updates the running volatility and spread, and rebuilds the book ladder.
+          The spread is widened by the volume traded in the day and the ladder is skewed against the inventory,
+          both kept up to date by the fills in a utils.QuotingState.
+          The ticks that arrive while a quote is computed are coalesced: only the latest one is quoted.
+        - orders: matches the market orders against the book, requoting the consumed levels with
+          utils.compute_one_new_bid/ask. The order queue is bounded, so submit() waits when the service is behind.
+        The tick -> quote and order -> fill latencies are recorded in histograms, see latency_stats.
+
+        Parameters:
+            n_levels (int): Levels of the order book. Defaults to config.n_levels.
+            volume (float): Traded volume of the first day before the start of the service.
+            lambda_val, bid_asymetry, inventory_skew: see utils.QuotingState. Default to the ones of the config.
+            pricing_params (dict): alpha, bid_sizes and ask_sizes passed to order_book.compute_quote_ladders. The sizes default to config.level_sizes.
+            requote (bool): Requote the consumed non client levels.
+            max_pending_orders (int): Size of the order queue.
+            trade_history (TradeHistory): History where the fills are logged. Defaults to None.
+            config (MarketConfig): Market parameters (book depth, quoting, volume normaliser). Defaults to config.DEFAULT_CONFIG.
+        """
+        self.config = DEFAULT_CONFIG if config is None else config
+        n_levels = self.config.n_levels if n_levels is None else n_levels
+        self.book = ArrayOrderBook(n_levels)
+        self.volume = volume
+        self.lambda_val = self.config.lambda_val if lambda_val is None else lambda_val
+        self.bid_asymetry = self.config.bid_asymetry if bid_asymetry is None else bid_asymetry
+        self.state = utils.QuotingState(
+            self.lambda_val, self.bid_asymetry, inventory_skew, self.config.volume_normaliser, daily_volume=float(volume)
+        )
+        level_sizes = self.config.pricing_params if n_levels == self.config.n_levels else {}
+        self.pricing_params = level_sizes | (pricing_params or {})
+        self.requote = requote
+        self.trade_history = trade_history
+        self.volatility = utils.RunningVolatility()
+        self.latencies = {"tick_to_quote": LatencyHistogram(), "order_to_fill": LatencyHistogram()}
+
+        self.max_pending_orders = max_pending_orders
+        self.orders = None
+        self._tick = None  # latest tick not quoted yet: (timestamp, fair_price, arrival ns)
+        self._tick_ready = None
+        self.timestamp = None
+        self.fair_price = None
+        self.n_ticks = 0
+        self.n_coalesced = 0
+        self.n_quotes = 0
+        self.n_orders = 0
+        self.n_fills = 0
+        self.traded_volume = 0.0
+
+    def _bind_loop(self):
+        # asyncio objects are created in the running loop
+        self.orders = asyncio.Queue(self.max_pending_orders)
+        self._tick_ready = asyncio.Event()
+
+    def push_tick(self, timestamp: datetime, fair_price: float):
+        """Hands a tick to the quote task, replacing the previous one if it was not quoted yet."""
+        if self._tick is not None:
+            self.n_coalesced += 1
+        self._tick = (timestamp, fair_price, time.perf_counter_ns())
+        self.n_ticks += 1
+        self._tick_ready.set()
+
+    async def submit(self, order: MarketOrder | tuple[str, float]):
+        """Queues a MarketOrder (side 'bid' buys at the ask) or a (side, size) pair with side 'buy' or 'sell', waits if the queue is full."""
+        if isinstance(order, MarketOrder):
+            order = ("buy" if order.side == "bid" else "sell", order.size)
+        await self.orders.put((order[0] == "buy", float(order[1]), time.perf_counter_ns()))
+
+    def _quote(self, timestamp: datetime, fair_price: float):
+        if self.fair_price is not None:
+            self.volatility.update(math.log(fair_price / self.fair_price))
+        self.timestamp, self.fair_price = timestamp, fair_price
+        spread, _, _ = self.state.quote(timestamp, fair_price, self.volatility.std)
+        if spread is None:
+            return False
+        # the ladder is centred on the skewed mid and as wide as the widened quotes
+        reference = fair_price - spread * self.state.shift()
+        ladders = compute_quote_ladders(
+            [reference], [spread * self.state.widening()], self.book.n_levels, **self.pricing_params
+        )
+        self.book.clear()
+        self.book.load_ladder(timestamp, *(ladder[0] for ladder in ladders))
+        return True
+
+    async def _quote_loop(self):
+        while True:
+            await self._tick_ready.wait()
+            self._tick_ready.clear()
+            timestamp, fair_price, arrival = self._tick
+            self._tick = None
+            if self._quote(timestamp, fair_price):
+                self.n_quotes += 1
+                self.latencies["tick_to_quote"].record(time.perf_counter_ns() - arrival)
+
+    async def _order_loop(self):
+        while True:  # before the first quote the book is empty and the orders are not filled
+            is_buy, size, arrival = await self.orders.get()
+            try:
+                self._match(is_buy, size, arrival)
+            finally:  # orders.join() must not wait for an order whose match failed
+                self.orders.task_done()
+
+    def _match(self, is_buy: bool, size: float, arrival: int):
+        fill_order, fill_price, fill_size, fill_client = [], [], [], []
+        _match_orders(
+            self.book, range(1), [self.timestamp], [is_buy], [size], [self.fair_price], self.requote,
+            fill_order, fill_price, fill_size, fill_client, requote_volume=self.state.normaliser,
+        )
+        self.latencies["order_to_fill"].record(time.perf_counter_ns() - arrival)
+        self.n_orders += 1
+        self.n_fills += len(fill_price)
+        self.traded_volume += sum(fill_size)
+        side = "buy" if is_buy else "sell"
+        for price, traded, client in zip(fill_price, fill_size, fill_client):
+            self.state.on_fill(self.timestamp, side, traded)
+            if self.trade_history is not None:
+                self.trade_history.log(side, price, traded, client, self.timestamp)
+
+    async def _feed_ticks(self, ticks: TickSource, tick_interval: float):
+        async for batch in ticks.abatches():
+            for timestamp, fair_price in batch.iter_rows():
+                self.push_tick(timestamp, fair_price)
+                await asyncio.sleep(tick_interval)  # 0 still lets the other tasks run
+
+    async def _feed_orders(self, orders: AsyncIterator):
+        async for order in orders:
+            await self.submit(order)
+
+    async def _drain(self, feeds: list):
+        await asyncio.gather(*feeds)
+        await self.orders.join()
+
+    async def run(self, ticks: TickSource, orders: AsyncIterator = None, tick_interval: float = 0) -> dict:
+        """Runs the service until the ticks and the orders are exhausted, then drains the pending orders
+
+        Args:
+            ticks (TickSource): The fair price ticks
+            orders (AsyncIterator, optional): The market orders, e.g. order_flow. Defaults to None.
+            tick_interval (float, optional): Seconds between two ticks of the source, 0 replays them as fast as possible. Defaults to 0.
+
+        Returns:
+            dict: The counters and the latency_stats of the run
+
+        Raises:
+            Exception: The error of a feed or of the quote or order task, which stops the service
+        """
+        self._bind_loop()
+        workers = [asyncio.create_task(self._quote_loop()), asyncio.create_task(self._order_loop())]
+        feeds = [self._feed_ticks(ticks, tick_interval)]
+        if orders is not None:
+            feeds.append(self._feed_orders(orders))
+        drain = asyncio.create_task(self._drain(feeds))
+        tasks = [drain, *workers]
+        try:
+            # the workers never return, so the first task done is the drained run or a failed task
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # raises the error of the task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.stats()
+
+    def latency_stats(self) -> pl.DataFrame:
+        """p50, p99 and max latency of each stage, in microseconds."""
+        return pl.DataFrame([{"stage": stage} | histogram.summary() for stage, histogram in self.latencies.items()])
+
+    def stats(self) -> dict:
+        """Counters of the service and p50/p99/max latency of each stage."""
+        return {
+            "ticks": self.n_ticks,
+            "coalesced_ticks": self.n_coalesced,
+            "quotes": self.n_quotes,
+            "orders": self.n_orders,
+            "fills": self.n_fills,
+            "traded_volume": self.traded_volume,
+        } | {
+            f"{stage}_{name}": value
+            for stage, histogram in self.latencies.items()
+            for name, value in histogram.summary().items()
+            if name != "count"
+        }
+
+
+async def order_flow(
+    n_orders: int,
+    rate: float = 1_000,
+    burst_size: int = 1,
+    size_ladder: list[float] = None,
+    seed: int = None,
+) -> AsyncIterator[tuple[str, float]]:
+    """In-process order flow generator: bursts of market orders with exponential waiting times
+
+    Args:
+        n_orders (int): Number of orders
+        rate (float, optional): Mean number of bursts per second. Defaults to 1_000.
+        burst_size (int, optional): Number of orders sent at once in a burst. Defaults to 1.
+        size_ladder (list[float], optional): The candidate sizes. Defaults to vl.TRADE_SIZE_LADDER.
+        seed (int, optional): Seed of the random generator. Defaults to None.
+
+    Returns:
+        AsyncIterator[tuple[str, float]]: The (side, size) of each order, side is 'buy' or 'sell'
+    """
+    rng = np.random.default_rng(seed)
+    size_ladder = vl.TRADE_SIZE_LADDER if size_ladder is None else size_ladder
+    sent = 0
+    while sent < n_orders:
+        await asyncio.sleep(rng.exponential(1 / rate))
+        for _ in range(min(burst_size, n_orders - sent)):
+            yield ("buy" if rng.random() < 0.5 else "sell", float(rng.choice(size_ladder)))
+            sent += 1
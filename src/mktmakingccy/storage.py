@@ -0,0 +1,82 @@
+import polars as pl
+from pathlib import Path
+from typing import Literal
+
+# extension of the files of each format
+_EXTENSIONS = {"parquet": "parquet", "ipc": "arrow"}
+
+
+def _check_format(file_format: str) -> str:
+    if file_format not in _EXTENSIONS:
+        raise ValueError(f"unknown file format {file_format!r}")
+    return _EXTENSIONS[file_format]
+
+
+def write_partitioned(
+    df: pl.DataFrame,
+    root: str | Path,
+    partition_by: str | list[str] = "date",
+    file_format: Literal["parquet", "ipc"] = "parquet",
+    name: str = "part-0",
+) -> list[Path]:
+    """Writes a DF as hive partitioned files, root/key=value/.../name.parquet (or .arrow)
+
+    A "date" partition is computed from the timestamp column when the DF has no date column, so the
+    simulated paths (partition_by=["path", "date"]), quotes, orders and trade logs can all be stored by day.
+    Writing again with the same name overwrites the same files, and a new name adds files to the partitions.
+
+    Args:
+        df (pl.DataFrame): The DF to write
+        root (str | Path): Folder of the dataset
+        partition_by (str | list[str], optional): The partition columns. Defaults to "date".
+        file_format (str, optional): "parquet" or "ipc" (Arrow IPC, memory mapped when scanned). Defaults to "parquet".
+        name (str, optional): Name of the file written in each partition. Defaults to "part-0".
+
+    Returns:
+        list[Path]: The written files
+    """
+    extension = _check_format(file_format)
+    partition_by = [partition_by] if isinstance(partition_by, str) else list(partition_by)
+    if "date" in partition_by and "date" not in df.columns:
+        df = df.with_columns(pl.col("timestamp").dt.date().alias("date"))
+
+    paths = []
+    for keys, partition in df.partition_by(partition_by, as_dict=True, include_key=False).items():
+        folder = Path(root).joinpath(*(f"{column}={key}" for column, key in zip(partition_by, keys)))
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"{name}.{extension}"
+        if file_format == "parquet":
+            partition.write_parquet(path)
+        else:
+            partition.write_ipc(path)
+        paths.append(path)
+    return paths
+
+
+def scan_partitioned(
+    root: str | Path,
+    file_format: Literal["parquet", "ipc"] = "parquet",
+    schema: dict = None,
+) -> pl.LazyFrame:
+    """Lazily scans a dataset written by write_partitioned
+
+    The partition columns are read back from the folder names, and the filters on them (e.g.
+    pl.col("date") == date) skip the other partitions without opening their files. The IPC files are
+    memory mapped, so a dataset larger than the memory can go through track_pnl or compute_volume_history.
+
+    Args:
+        root (str | Path): Folder of the dataset
+        file_format (str, optional): "parquet" or "ipc". Defaults to "parquet".
+        schema (dict, optional): Schema of the dataset (with the partition columns), scanned as an empty frame when
+            no file was written, e.g. the fills of a run without trades. Defaults to None (scanning no file fails).
+
+    Returns:
+        pl.LazyFrame: The dataset, with the partition columns
+    """
+    extension = _check_format(file_format)
+    if schema is not None and next(Path(root).rglob(f"*.{extension}"), None) is None:
+        return pl.LazyFrame(schema=schema)
+    source = str(Path(root) / "**" / f"*.{extension}")
+    if file_format == "parquet":
+        return pl.scan_parquet(source, hive_partitioning=True)
+    return pl.scan_ipc(source, hive_partitioning=True, memory_map=True)
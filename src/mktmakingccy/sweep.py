@@ -0,0 +1,91 @@
+import os
+import itertools
+import inspect
+import contextlib
+import multiprocessing
+import numpy as np
+import polars as pl
+from concurrent.futures import ProcessPoolExecutor
+
+from .backtest import Backtest
+
+# grid keys that are passed to OrderBook.get_base_pricing rather than to Backtest
+_PRICING_PARAMS = ("alpha", "bid_sizes", "ask_sizes")
+# Backtest arguments set by the sweep itself, or that cannot be a column of the results
+_RESERVED_PARAMS = ("seed", "fair_prices", "config")
+
+
+@contextlib.contextmanager
+def _process_pool(n_workers: int):
+    """Pool of spawned worker processes with one Polars thread each, so that the runs scale with the number of cores."""
+    previous = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = "1"  # read by the workers when they import polars
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            yield pool
+    finally:
+        if previous is None:
+            del os.environ["POLARS_MAX_THREADS"]
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous
+
+
+def _run_one(params: dict, backtest_params: dict, seed: np.random.SeedSequence) -> dict:
+    """Runs the backtest of one (parameters, seed) pair of the sweep, in a worker process."""
+    kwargs = dict(backtest_params)
+    kwargs["pricing_params"] = dict(kwargs.get("pricing_params") or {})
+    for name, value in params.items():
+        if name in _PRICING_PARAMS:
+            kwargs["pricing_params"][name] = value
+        else:
+            kwargs[name] = value
+    summary = Backtest(**kwargs, seed=seed).run(resume=False)
+    return params | {"seed": seed.spawn_key[-1]} | summary.row(0, named=True)
+
+
+def run_sweep(
+    param_grid: dict[str, list],
+    n_seeds: int = 1,
+    backtest_params: dict = None,
+    seed: int = None,
+    n_workers: int = None,
+) -> pl.DataFrame:
+    """Runs the full simulate -> quote -> trade -> PnL backtest for every combination of the parameter grid and every seed
+
+    The runs are spread over a pool of processes (one Polars thread each, so that the sweep scales with
+    the number of cores), and each run gets its own random stream spawned from the same SeedSequence.
+
+    Args:
+        param_grid (dict[str, list]): Values to try for each parameter, e.g. lambda_val, bid_asymetry, spread_sensibility (Backtest arguments) or alpha, bid_sizes, ask_sizes (get_base_pricing arguments)
+        n_seeds (int, optional): Number of seeds for each combination. Defaults to 1.
+        backtest_params (dict, optional): Other Backtest arguments, shared by all the runs. Defaults to None.
+        seed (int, optional): Root seed of the sweep. Defaults to None.
+        n_workers (int, optional): Number of processes, 1 runs everything in this process. Defaults to os.cpu_count().
+
+    Returns:
+        pl.DataFrame: One row per run with the parameters, the seed index and the Backtest summary (PnL, inventory, fill rate, ...)
+    """
+    backtest_params = dict(backtest_params or {})
+    valid = set(inspect.signature(Backtest).parameters) | set(_PRICING_PARAMS)
+    unknown = set(param_grid) - valid
+    if unknown:
+        raise ValueError(f"unknown parameters {sorted(unknown)}")
+    reserved = set(param_grid) & set(_RESERVED_PARAMS)
+    if reserved:
+        raise ValueError(f"parameters {sorted(reserved)} cannot be swept, use the seed and n_seeds arguments or backtest_params")
+    if "seed" in backtest_params:
+        raise ValueError("the seed of the runs is spawned from the seed argument, it cannot be in backtest_params")
+    # no checkpoints, the runs would share the same output directory
+    backtest_params.pop("output_dir", None)
+
+    names = list(param_grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+    seeds = np.random.SeedSequence(seed).spawn(n_seeds)
+    tasks = [(params, backtest_params, seed_seq) for params in combinations for seed_seq in seeds]
+
+    if n_workers == 1:
+        rows = [_run_one(*task) for task in tasks]
+    else:
+        with _process_pool(n_workers) as executor:
+            rows = list(executor.map(_run_one, *zip(*tasks)))
+    return pl.DataFrame(rows)
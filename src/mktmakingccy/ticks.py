@@ -0,0 +1,287 @@
+import abc
+import queue
+import inspect
+import socket
+import asyncio
+import numpy as np
+import polars as pl
+from pathlib import Path
+from datetime import datetime
+from typing import Iterator
+
+from . import utils
+from .order_book import ArrayOrderBook, compute_quote_ladders
+
+# schema of the batches yielded by every tick source
+TICK_SCHEMA = {"timestamp": pl.Datetime("us"), "fair_price": pl.Float64}
+
+
+class TickSource(abc.ABC):
+    """Base class of the tick sources: a pull based stream of batches of ticks (timestamp, fair_price)
+
+    A source only produces a batch when the consumer asks for the next one, so a slow consumer slows the
+    source down (backpressure) and at most one batch per stage is held in memory. Subclasses implement
+    batches(), and the source can then be iterated tick by tick, batch by batch or with async for.
+    """
+
+    batch_size: int = 10_000
+
+    @abc.abstractmethod
+    def batches(self) -> Iterator[pl.DataFrame]:
+        """The batches of ticks, as DataFrames with the TICK_SCHEMA columns."""
+
+    def __iter__(self) -> Iterator[tuple[datetime, float]]:
+        for batch in self.batches():
+            yield from batch.iter_rows()
+
+    async def abatches(self):
+        """Async iterator over the batches, the blocking reads run in a thread so they do not block the event loop."""
+        batches = iter(self.batches())
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            yield batch
+
+    async def __aiter__(self):
+        async for batch in self.abatches():
+            for tick in batch.iter_rows():
+                yield tick
+
+
+class SyntheticTickSource(TickSource):
+    def __init__(
+        self,
+        start_timestamp: datetime = datetime(2025, 1, 1),
+        end_timestamp: datetime = datetime(2026, 1, 1),
+        step_size_in_seconds: int = 3600,
+        initial_price: float = 100.0,
+        seed: int | np.random.SeedSequence = None,
+        batch_size: int = 10_000,
+        **fair_price_params,
+    ) -> None:
+        """
+        Ticks of the fair price model of utils.simulate_fair_price, simulated batch by batch. The random
+        draws are made per batch, so a seed gives the path of simulate_fair_price only for a single batch.
+
+        Parameters:
+            start_timestamp, end_timestamp, step_size_in_seconds, initial_price, seed: see utils.simulate_fair_price.
+            batch_size (int): Number of ticks per batch.
+            fair_price_params: Overrides of the model parameters (mu, sigma, ...).
+        """
+        self.start_timestamp = start_timestamp
+        self.step_size_in_seconds = step_size_in_seconds
+        self.n_steps = int((end_timestamp - start_timestamp).total_seconds() // step_size_in_seconds) + 1
+        self.initial_price = initial_price
+        self.seed = seed
+        self.batch_size = batch_size
+        defaults = inspect.signature(utils.simulate_fair_price).parameters
+        self.fair_price_params = {name: defaults[name].default for name in utils._MODEL_PARAMS}
+        self.fair_price_params.update(fair_price_params)
+
+    def batches(self) -> Iterator[pl.DataFrame]:
+        rng = np.random.default_rng(self.seed)
+        dt = self.step_size_in_seconds / (24 * 3600)  # Convert to fraction of a day
+        step = np.timedelta64(self.step_size_in_seconds, "s")
+        price, X_t = self.initial_price, 0.0
+        for first in range(0, self.n_steps, self.batch_size):
+            size = min(self.batch_size, self.n_steps - first)
+            if first == 0:
+                prices, X_t = utils._simulate_fair_price_chunk(rng, size - 1, dt, price, X_t, **self.fair_price_params)
+                prices = np.concatenate([[price], prices])
+            else:
+                prices, X_t = utils._simulate_fair_price_chunk(rng, size, dt, price, X_t, **self.fair_price_params)
+            price = prices[-1]
+            timestamps = np.datetime64(self.start_timestamp, "us") + (first + np.arange(size)) * step
+            yield pl.DataFrame({"timestamp": timestamps, "fair_price": prices}, schema=TICK_SCHEMA)
+
+
+class FileTickSource(TickSource):
+    def __init__(
+        self,
+        path: str | Path,
+        timestamp_column: str = "timestamp",
+        price_column: str | tuple[str, str] = "fair_price",
+        batch_size: int = 10_000,
+    ) -> None:
+        """
+        Replay of historical ticks from a CSV, Parquet or Arrow IPC file (or glob), read in chunks by the
+        streaming engine so the file does not have to fit in memory.
+
+        Parameters:
+            path (str | Path): The file(s), the format is taken from the extension (.csv, .parquet, .arrow/.ipc).
+            timestamp_column (str): Column of the tick timestamps.
+            price_column (str | tuple[str, str]): Column of the fair price, or (bid, ask) columns whose mid is used.
+            batch_size (int): Number of ticks per batch.
+        """
+        self.path = Path(path)
+        self.timestamp_column = timestamp_column
+        self.price_column = price_column
+        self.batch_size = batch_size
+
+    def scan(self) -> pl.LazyFrame:
+        suffix = self.path.suffix.lower()
+        if suffix == ".csv":
+            lf = pl.scan_csv(self.path, try_parse_dates=True)
+        elif suffix == ".parquet":
+            lf = pl.scan_parquet(self.path)
+        elif suffix in (".arrow", ".ipc", ".feather"):
+            lf = pl.scan_ipc(self.path, memory_map=True)
+        else:
+            raise ValueError(f"unknown tick file format {suffix!r}")
+        if isinstance(self.price_column, str):
+            price = pl.col(self.price_column)
+        else:
+            bid, ask = self.price_column
+            price = (pl.col(bid) + pl.col(ask)) / 2
+        return lf.select(
+            pl.col(self.timestamp_column).cast(TICK_SCHEMA["timestamp"]).alias("timestamp"),
+            price.cast(pl.Float64).alias("fair_price"),
+        )
+
+    def batches(self) -> Iterator[pl.DataFrame]:
+        for batch in self.scan().collect_batches(chunk_size=self.batch_size):
+            if batch.height:
+                yield batch
+
+
+class QueueTickSource(TickSource):
+    def __init__(self, ticks: queue.Queue, batch_size: int = 1_000, timeout: float = 0.01) -> None:
+        """
+        Stand-in for a live feed: ticks (timestamp, fair_price) put in a queue by a producer thread, until
+        a None sentinel. With a bounded queue (queue.Queue(maxsize)) the producer blocks when the consumer
+        is behind, which is the backpressure of the feed.
+
+        Parameters:
+            ticks (queue.Queue): The queue of ticks.
+            batch_size (int): Maximum number of ticks per batch.
+            timeout (float): Seconds to wait for more ticks before yielding a partial batch.
+        """
+        self.ticks = ticks
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def batches(self) -> Iterator[pl.DataFrame]:
+        done = False
+        while not done:
+            batch = []
+            tick = self.ticks.get()  # wait for the first tick of the batch
+            while tick is not None:
+                batch.append(tick)
+                if len(batch) == self.batch_size:
+                    break
+                try:
+                    tick = self.ticks.get(timeout=self.timeout)
+                except queue.Empty:
+                    break
+            done = tick is None
+            if batch:
+                yield pl.DataFrame(batch, schema=TICK_SCHEMA, orient="row")
+
+
+class SocketTickSource(TickSource):
+    def __init__(self, host: str = "127.0.0.1", port: int = 9999, batch_size: int = 1_000, timeout: float = 0.01) -> None:
+        """
+        Live feed over a local TCP socket: one "timestamp,fair_price" line per tick (ISO timestamp), until
+        the sender closes the connection. The socket is only read when a batch is asked for, so TCP flow
+        control slows the sender down when the consumer is behind.
+
+        Parameters:
+            host, port: Address of the feed.
+            batch_size (int): Maximum number of ticks per batch.
+            timeout (float): Seconds to wait for more ticks before yielding a partial batch.
+        """
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def batches(self) -> Iterator[pl.DataFrame]:
+        with socket.create_connection((self.host, self.port)) as connection:
+            buffer = b""
+            closed = False
+            while not closed:
+                lines = []
+                connection.settimeout(None)  # wait for the first tick of the batch
+                while len(lines) < self.batch_size:
+                    try:
+                        data = connection.recv(65536)
+                    except TimeoutError:
+                        break
+                    if not data:
+                        closed = True
+                        break
+                    buffer += data
+                    *complete, buffer = buffer.split(b"\n")
+                    lines.extend(complete)
+                    connection.settimeout(self.timeout)
+                if closed and buffer.strip():
+                    lines.append(buffer)
+                ticks = [line.decode().split(",") for line in lines if line.strip()]
+                if ticks:
+                    yield pl.DataFrame(
+                        {
+                            "timestamp": [datetime.fromisoformat(timestamp) for timestamp, _ in ticks],
+                            "fair_price": [float(price) for _, price in ticks],
+                        },
+                        schema=TICK_SCHEMA,
+                    )
+
+
+def stream_quotes(
+    source: TickSource,
+    volume=0,
+    lambda_val: float = 2,
+    bid_asymetry: float = 0.5,
+    volatility: utils.RunningVolatility = None,
+) -> Iterator[pl.DataFrame]:
+    """Quotes of a tick source batch by batch, like utils.compute_all_bid_ask but with a running volatility
+
+    Args:
+        source (TickSource): The ticks
+        volume, lambda_val, bid_asymetry: see utils.compute_all_bid_ask.
+        volatility (utils.RunningVolatility, optional): Volatility state to continue from. Defaults to a new expanding volatility.
+
+    Returns:
+        Iterator[pl.DataFrame]: The batches with timestamp, fair_price, volatility, spread, bid and ask columns
+    """
+    volatility = volatility or utils.RunningVolatility()
+    previous = np.nan
+    for batch in source.batches():
+        prices = batch["fair_price"].to_numpy()
+        log_returns = np.diff(np.log(np.concatenate([[previous], prices])))
+        previous = prices[-1]
+        yield utils.compute_bid_ask(
+            batch.with_columns(pl.Series("volatility", volatility.update_many(log_returns)).fill_nan(None)),
+            volume,
+            lambda_val,
+            bid_asymetry,
+        )
+
+
+def stream_books(
+    quotes: Iterator[pl.DataFrame],
+    n_levels: int = 15,
+    book: ArrayOrderBook = None,
+    **pricing_params,
+) -> Iterator[tuple[datetime, ArrayOrderBook]]:
+    """Rebuilds the order book at each quoted tick, the ladders of a batch are computed at once
+
+    The same book is updated in place and yielded at every tick (copy what has to be kept).
+
+    Args:
+        quotes (Iterator[pl.DataFrame]): Batches with timestamp, fair_price and spread columns (e.g. stream_quotes)
+        n_levels (int, optional): Number of levels of each side. Defaults to 15.
+        book (ArrayOrderBook, optional): The book to update. Defaults to a new one.
+        pricing_params: alpha, bid_sizes and ask_sizes, see OrderBook.get_base_pricing.
+
+    Returns:
+        Iterator[tuple[datetime, ArrayOrderBook]]: The timestamp and the book after each tick with a spread
+    """
+    book = book or ArrayOrderBook(n_levels)
+    for batch in quotes:
+        batch = batch.drop_nulls("spread")
+        ladders = compute_quote_ladders(
+            batch["fair_price"].to_numpy(), batch["spread"].to_numpy(), book.n_levels, **pricing_params
+        )
+        for row, timestamp in enumerate(batch["timestamp"]):
+            book.clear()
+            book.load_ladder(timestamp, *(ladder[row] for ladder in ladders))
+            yield timestamp, book
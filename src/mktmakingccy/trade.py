@@ -1,46 +1,136 @@
-from order_book import OrderBook
-from datetime import datetime
+import logging
+from .order_book import OrderBook, ArrayOrderBook, FillBuffer
+from datetime import datetime, date
+import numpy as np
+import polars as pl
 from typing import Literal, List, Dict, Any
 from dataclasses import dataclass, field
-import utils
+from pathlib import Path
+from . import utils
+from . import storage
+from . import values as vl
 
 #TODO: check if client = True is well implemented 
-#TODO: FX PNL: with history: if inventory from yesterday + FX went from 1 to 2, now PNL is divided by 2 etc (PNL is expressed in $)
-# rediviser partie existante du track PNL par le FX du jour (diviser par fair price de xyz)
 #TODO: rebalancing de l'order book (refill qd trade et reset à la fin de chaque journée -> recupérer le dataframe du bid ask de tt les jour)
 # masque pour récupérer juste la premiere heure de la journée
 # faire tourner la fonction 15 fois car prix différent pour chaque niveau 
 # réutiliser la fonction et appliqué le masque sur la 2e h de la journée plutot que juste la 1ere 
 # petite fonction de raph : génère que 1 seul prix (avec taille du trade etc)
 
+SIDE_DTYPE = pl.Enum(["buy", "sell"])
+
+logger = logging.getLogger(__name__)
+
+
 @dataclass
 class TradeHistory:
-    trades: List[Dict[str, Any]] = field(default_factory=list)
-    _template: Dict[str, Any] = field(
-        default_factory=lambda: {
-            "timestamp":None,
-            "side": None,
-            "price": None,
-            "size": None,
-            "client":None,
-        },
-        init=False,
-        repr=False
-    )
+    """Columnar trade log, each column is a typed NumPy array that doubles its capacity when full.
+
+    to_polars() wraps the filled part of the arrays without copying the numeric columns, and the traded
+    volume of each day is kept up to date at each log so that compute_volume_history is O(1).
+    """
+    capacity: int = 1024
+    n_trades: int = field(default=0, init=False)
+    daily_volume: Dict[date, float] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self._timestamps = np.empty(self.capacity, dtype="datetime64[us]")
+        self._sides = np.empty(self.capacity, dtype=np.uint32)  # index in SIDE_DTYPE categories
+        self._prices = np.empty(self.capacity, dtype=np.float64)
+        self._sizes = np.empty(self.capacity, dtype=np.float64)
+        self._clients = np.empty(self.capacity, dtype=np.bool_)
+
+    def __len__(self) -> int:
+        return self.n_trades
+
+    def _grow(self):
+        # reallocate rather than resize in place, previous to_polars() views keep the old buffers
+        self.capacity *= 2
+        for name in ("_timestamps", "_sides", "_prices", "_sizes", "_clients"):
+            old = getattr(self, name)
+            new = np.empty(self.capacity, dtype=old.dtype)
+            new[: self.n_trades] = old[: self.n_trades]
+            setattr(self, name, new)
+
+    def log(self, side: str, price: float, size: float, client: bool, timestamp: datetime = None):
+        if side not in ("buy", "sell"):
+            raise Exception(f"The side of a trade should be either 'buy' or 'sell', not {side!r}.")
+        if timestamp is None:
+            timestamp = datetime.now()
+        if self.n_trades == self.capacity:
+            self._grow()
+        i = self.n_trades
+        self._timestamps[i] = np.datetime64(timestamp, "us")
+        self._sides[i] = 0 if side == "buy" else 1
+        self._prices[i] = price
+        self._sizes[i] = size
+        self._clients[i] = client
+        self.n_trades += 1
+        day = self._timestamps[i].astype("datetime64[D]").item()  # a date, whatever the type of timestamp
+        self.daily_volume[day] = self.daily_volume.get(day, 0.0) + size
+
+    def extend(self, trades: pl.DataFrame):
+        """Logs a whole frame of trades (timestamp, side, price, size, client) at once."""
+        n = trades.height
+        sides = trades["side"].cast(pl.String)
+        if not sides.is_in(["buy", "sell"]).all():
+            raise Exception("The side of a trade should be either 'buy' or 'sell'.")
+        while self.n_trades + n > self.capacity:
+            self._grow()
+        i, j = self.n_trades, self.n_trades + n
+        self._timestamps[i:j] = trades["timestamp"].cast(pl.Datetime("us")).to_numpy()
+        self._sides[i:j] = (sides != "buy").to_numpy()
+        self._prices[i:j] = trades["price"].to_numpy()
+        self._sizes[i:j] = trades["size"].to_numpy()
+        self._clients[i:j] = trades["client"].to_numpy()
+        self.n_trades = j
+        daily = trades.group_by(pl.col("timestamp").dt.date().alias("date")).agg(pl.col("size").sum())
+        for day, size in daily.iter_rows():
+            self.daily_volume[day] = self.daily_volume.get(day, 0.0) + size
+
+    def to_polars(self) -> pl.DataFrame:
+        """Returns the trades as a Polars DataFrame (timestamp, side, price, size, client)."""
+        n = self.n_trades
+        return pl.DataFrame(
+            [
+                pl.Series("timestamp", self._timestamps[:n].view(np.int64)).cast(pl.Datetime("us")),
+                pl.Series(SIDE_DTYPE.categories, dtype=SIDE_DTYPE).gather(self._sides[:n]).alias("side"),
+                pl.Series("price", self._prices[:n]),
+                pl.Series("size", self._sizes[:n]),
+                pl.Series("client", self._clients[:n]),
+            ]
+        )
+
+    def to_arrow(self):
+        """Returns the trades as a pyarrow Table (requires pyarrow)."""
+        return self.to_polars().to_arrow()
 
-    def log(self, side: str, price: float, size: float, client: bool):
-        entry = self._template.copy()
-        entry.update({
-            "timestamp": datetime.now(),
-            "side":side,
-            "price":price,
-            "size": size,
-            "client": client,
-        })
-        self.trades.append(entry)
+    def write(self, root: str | Path, file_format: Literal["parquet", "ipc"] = "parquet", name: str = "part-0") -> list[Path]:
+        """Writes the trade log partitioned by date, read it back lazily with storage.scan_partitioned."""
+        return storage.write_partitioned(self.to_polars(), root, "date", file_format, name)
 
+    @property
+    def trades(self) -> List[Dict[str, Any]]:
+        """The trades as a list of dicts, like the previous row-based log."""
+        return self.to_polars().with_columns(pl.col("side").cast(pl.String)).to_dicts()
 
-history = TradeHistory()
+
+_history = None
+
+
+def get_history() -> TradeHistory:
+    """The shared trade log of the Trade and MarketOrder classes, created on first use rather than at import."""
+    global _history
+    if _history is None:
+        _history = TradeHistory()
+    return _history
+
+
+def __getattr__(name: str):
+    # PEP 562: trade.history still gives the shared trade log
+    if name == "history":
+        return get_history()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Trade:
@@ -53,93 +143,54 @@ class Trade:
                 "The side argument should be either 'buy' or 'sell'. \nPlease input a valid argument"
             )
 
-    def update_orderbook_with_trade(self, orderbook: OrderBook, fair_price: float, trade_date: datetime = None): #TODO ajouter datetime?? enlever timestamp de l'orderbook??
-        if self.side == "buy":
-            # making sure the trade isnt bigger than the whole order book
-            max_size = orderbook.asks.select("size_ask").sum().to_series().to_list()[0]
-
-            if self.size > max_size:
-                raise Exception(
-                    f"Size is bigger than what is available in the order book. Please input a size inferior to {max_size}"
-                )
-
-            best_price, best_size, _, client = (
-                orderbook.get_best_ask()
-            )  # you buy at the ask and sell at the bid
-
-            if self.size <= best_size:
-                orderbook.update_order(
-                    price=best_price,
-                    size=best_size - self.size,
-                    side="ask",
-                    client=client,
-                )
-                if not client:
-                    new_ask = utils.compute_one_new_ask(fair_price=fair_price, old_ask=best_price, size=self.size) #TODO récupérer le fair price
-                    orderbook.update_order(
-                        price=new_ask,
-                        size= self.size,
-                        side='ask',
-                        client=False
-                    )
-            else:
-                orderbook.delete_order(
-                    price=best_price, size=best_size, side="ask"
-                )  # delete best order
-                if not client:
-                    new_ask = utils.compute_one_new_ask(fair_price=fair_price, old_ask=best_price, size=best_size) #TODO récupérer le fair price
-                    orderbook.update_order(
-                        price=new_ask,
-                        size= best_size,
-                        side='ask',
-                        client=False
-                    )
-                self.size -= best_size  # updating the size
-                orderbook = self.update_orderbook_with_trade(
-                    orderbook
-                )  # calling the function recursively
-
-        elif self.side == "sell":  # same thing but with bid
-            max_size = orderbook.bids.select("size_bid").sum().to_series().to_list()[0]
-
-            if self.size > max_size:
-                raise Exception(
-                    f"Size is bigger than what is available in the order book. Please input a size inferior to {max_size}"
-                )
-
-            best_price, best_size, _, client = orderbook.get_best_bid()
-
-            if self.size <= best_size:
-                orderbook.update_order(
-                    price=best_price,
-                    size=best_size - self.size,
-                    side="bid",
-                    client=client,
-                )  # timestamp updates automatically
-                if not client:
-                    new_bid = utils.compute_one_new_bid(fair_price=fair_price, old_ask=best_price, size=self.size) #TODO récupérer le fair price
-                    orderbook.update_order(
-                        price=new_bid,
-                        size= self.size,
-                        side='bid',
-                        client=False
-                    )
-            else:
-                orderbook.delete_order(price=best_price, size=best_size, side="bid")
-                if not client:
-                    new_bid = utils.compute_one_new_bid(fair_price=fair_price, old_ask=best_price, size=best_size) #TODO récupérer le fair price
-                    orderbook.update_order(
-                        price=new_bid,
-                        size= best_size,
-                        side='bid',
-                        client=False
-                    )
-                self.size -= best_size
-                orderbook = self.update_orderbook_with_trade()
+    def update_orderbook_with_trade(self, orderbook: OrderBook, fair_price: float, trade_date: datetime = None, requote_volume: float = None): #TODO ajouter datetime?? enlever timestamp de l'orderbook??
+        """Sweeps the opposite side of the book with this trade and requotes each consumed non client level further away
+
+        The whole sweep runs in one call of the sweep kernel (see _match_orders), on the arrays of an
+        ArrayOrderBook: a Polars OrderBook is copied into one and its bids/asks are updated at the end.
+        Each fill is logged in the trade history.
+
+        Args:
+            orderbook (OrderBook | ArrayOrderBook): The order book to trade against
+            fair_price (float): Fair price used for the requotes (utils.compute_one_new_bid/ask)
+            trade_date (datetime, optional): Time of the trade. Defaults to now.
+            requote_volume (float, optional): Volume normaliser of the requotes, e.g. MarketConfig.volume_normaliser. Defaults to sum(vl.VOLUME_LIST).
+
+        Raises:
+            Exception: if the trade is bigger than the whole opposite side of the book
+
+        Returns:
+            OrderBook | ArrayOrderBook: The updated order book
+        """
+        # you buy at the ask and sell at the bid
+        _, bid_sizes, _, ask_sizes = orderbook.get_depth()
+        max_size = float((ask_sizes if self.side == "buy" else bid_sizes).sum())
+        # making sure the trade isnt bigger than the whole order book
+        if self.size > max_size:
+            raise Exception(
+                f"Size is bigger than what is available in the order book. Please input a size inferior to {max_size}"
+            )
+        if trade_date is None:
+            trade_date = datetime.now()
+
+        if isinstance(orderbook, ArrayOrderBook):
+            array_book = orderbook
+        else:
+            array_book = ArrayOrderBook.from_order_book(orderbook)
+        fill_order, fill_price, fill_size, fill_client = [], [], [], []
+        _match_orders(
+            array_book, range(1), [trade_date], [self.side == "buy"], [self.size], [fair_price], True,
+            fill_order, fill_price, fill_size, fill_client, requote_volume=requote_volume,
+        )
 
         # adding to trade history
-        history.log(side=self.side, price=best_price, size=self.size, client=client)
+        history = get_history()
+        for price, size, client in zip(fill_price, fill_size, fill_client):
+            history.log(side=self.side, price=price, size=size, client=client, timestamp=trade_date)
 
+        if not isinstance(orderbook, ArrayOrderBook):
+            orderbook.bids = array_book.bids
+            orderbook.asks = array_book.asks
         return orderbook
 
 
@@ -153,89 +204,55 @@ class MarketOrder:
                 "The side argument should be either 'ask' or 'bid'. \nPlease input a valid argument"
             )
 
-    def post_market_order(self, orderbook: OrderBook, price: float = None):
-        if self.side == "bid":
-            best_price, best_size, _, client = (
-                orderbook.get_best_ask()
-            )  # you buy at the ask and sell at the bid
-
-            if (best_price is None) and (
-                best_size is None
-            ):  # there are no asks in the order book
-                if price is None:
-                    raise Exception(
-                        "price argument cannot be None if there are no matching orders in the order book. Please provide a price."
-                    )
-                print(
-                    f"We have reached the end of the order book. Posting order of size {self.size}"
-                )
-                orderbook.update_order(
-                    price=price, size=self.size, side="bid", client=True
-                )  # we post a new bid
-                # no trade to log here until that order is lifted
-
-            if self.size <= best_size:
-                orderbook.update_order(
-                    price=best_price,
-                    size=best_size - self.size,
-                    side="ask",
-                    client=client,
-                )
-                # logging the trade
-                history.log(side="buy", price=best_price, size=best_size, client=client)
-            elif self.size > best_size:
-                orderbook.delete_order(
-                    price=best_price, size=best_size, side="ask"
-                )  # delete best order
-                history.log(
-                    side="buy", price=best_price, size=best_size, client=client
-                )  # logging the trade
-                self.size -= best_size  # updating the size
-                orderbook = self.post_market_order(
-                    orderbook, best_price
-                )  # calling the function recursively
-
-        elif self.side == "ask":  # same thing but with bid
-            best_price, best_size, _, client = (
-                orderbook.get_best_bid()
-            )  # you buy at the ask and sell at the bid
-
-            if (best_price is None) and (best_size is None):
-                if price is None:
-                    raise Exception(
-                        "price argument cannot be None if there are no matching orders in the order book. Please provide a price."
-                    )
-                print(
-                    f"We have reached the end of the order book. Posting order of size {self.size}"
-                )
-                orderbook.update_order(
-                    price=price, size=self.size, side="ask", client=True
-                )  # we post a new ask
-                # no trade to log here until that order is lifted
-
-            if self.size <= best_size:
-                orderbook.update_order(
-                    price=best_price,
-                    size=best_size - self.size,
-                    side="bid",
-                    client=client,
-                )
-                # logging the trade
-                history.log(
-                    side="sell", price=best_price, size=best_size, client=client
-                )
-            elif self.size > best_size:
-                orderbook.delete_order(
-                    price=best_price, size=best_size, side="bid"
-                )  # delete best order
-                history.log(
-                    side="sell", price=best_price, size=best_size, client=client
-                )  # logging the trade
-                self.size -= best_size  # updating the size
-                orderbook = self.post_market_order(
-                    orderbook, best_price
-                )  # calling the function recursively
+    def post_market_order(self, orderbook: OrderBook | ArrayOrderBook, price: float = None, trade_date: datetime = None):
+        """Matches this order against the opposite side of the book, without requoting the consumed levels
+
+        A bid order buys at the ask and an ask order sells at the bid. The matching runs in _match_orders, like
+        Trade.update_orderbook_with_trade, and each fill is logged in the trade history. When the opposite side
+        runs out, the rest of the order is posted on its own side as a client order, at the price of the last
+        level it traded, or at price if there was nothing to trade.
+
+        Args:
+            orderbook (OrderBook | ArrayOrderBook): The order book to trade against
+            price (float, optional): Price of the posted rest when the opposite side is empty. Defaults to None.
+            trade_date (datetime, optional): Time of the trade. Defaults to now.
+
+        Raises:
+            Exception: if the opposite side is empty and price is None
+
+        Returns:
+            OrderBook | ArrayOrderBook: The updated order book
+        """
+        if trade_date is None:
+            trade_date = datetime.now()
+        if isinstance(orderbook, ArrayOrderBook):
+            array_book = orderbook
+        else:
+            array_book = ArrayOrderBook.from_order_book(orderbook)
+        is_buy = self.side == "bid"  # you buy at the ask and sell at the bid
+        if not array_book.get_side("ask" if is_buy else "bid").count and price is None:
+            raise Exception(
+                "price argument cannot be None if there are no matching orders in the order book. Please provide a price."
+            )
+        fill_order, fill_price, fill_size, fill_client = [], [], [], []
+        _match_orders(
+            array_book, range(1), [trade_date], [is_buy], [self.size], [0.0], False,
+            fill_order, fill_price, fill_size, fill_client,
+        )
+
+        history = get_history()
+        for traded_price, traded, client in zip(fill_price, fill_size, fill_client):
+            history.log(side="buy" if is_buy else "sell", price=traded_price, size=traded, client=client, timestamp=trade_date)
 
+        if not isinstance(orderbook, ArrayOrderBook):
+            orderbook.bids = array_book.bids
+            orderbook.asks = array_book.asks
+        remaining = self.size - sum(fill_size)
+        if remaining > 0:
+            post_price = fill_price[-1] if fill_price else price
+            logger.info("Reached the end of the order book, posting a %s order of size %s at %s", self.side, remaining, post_price)
+            orderbook.update_order(price=post_price, size=remaining, side=self.side, client=True)
+            # no trade to log here until that order is lifted
         return orderbook
 
 
@@ -243,3 +260,125 @@ class LimitOrder(MarketOrder):
     def __init__(self, size, side):
         super().__init__(size, side)
         #TODO
+
+
+def _match_orders(
+    array_book: ArrayOrderBook,
+    orders: range,
+    timestamps: np.ndarray,
+    is_buy: list[bool],
+    sizes: list[float],
+    fair_prices: list[float],
+    requote: bool,
+    fill_order: list,
+    fill_price: list,
+    fill_size: list,
+    fill_client: list,
+    *,
+    requote_volume: float = None,
+):
+    """Matching loop of match_market_orders over the orders with these indexes, the fills are appended to the fill_* lists.
+
+    Each order sweeps the opposite side in one call of _BookSide.sweep (a compiled kernel when numba is
+    installed), the fills are written into a preallocated buffer and copied to the lists after the sweep.
+    requote_volume is the volume normaliser of the requotes (config.MarketConfig.volume_normaliser), sum(vl.VOLUME_LIST) by default.
+    """
+    asks = array_book.get_side("ask")
+    bids = array_book.get_side("bid")
+    if requote_volume is None:
+        requote_volume = sum(vl.VOLUME_LIST)
+    fills = FillBuffer()
+    for k in orders:
+        book_side = asks if is_buy[k] else bids  # you buy at the ask and sell at the bid
+        remaining = sizes[k]
+        timestamp = np.datetime64(timestamps[k], "us")
+        fair_price = fair_prices[k] if requote else 0.0
+        while remaining > 0 and book_side.count:
+            remaining = book_side.sweep(remaining, timestamp, fair_price, requote, requote_volume, fills)
+            n = fills.n
+            fill_order.extend([k] * n)
+            fill_price.extend(fills.prices[:n].tolist())
+            fill_size.extend(fills.sizes[:n].tolist())
+            fill_client.extend(fills.clients[:n].tolist())
+            fills.n = 0
+
+
+def _fills_frame(
+    market_orders: pl.DataFrame,
+    fill_order: list,
+    fill_price: list,
+    fill_size: list,
+    fill_client: list,
+) -> pl.DataFrame:
+    """Builds the fills frame of match_market_orders, the timestamp and side come from the matched order."""
+    return pl.DataFrame(
+        {
+            "order_id": pl.Series(fill_order, dtype=pl.UInt32),
+            "price": pl.Series(fill_price, dtype=pl.Float64),
+            "size": pl.Series(fill_size, dtype=pl.Float64),
+            "client": pl.Series(fill_client, dtype=pl.Boolean),
+        }
+    ).join(
+        market_orders.select("timestamp", pl.col("side").cast(SIDE_DTYPE)).with_row_index("order_id"),
+        on="order_id",
+        how="left",
+        maintain_order="left",  # the fills stay in matching order
+    ).select("order_id", "timestamp", "side", "price", "size", "client")
+
+
+def match_market_orders(
+    orderbook: OrderBook | ArrayOrderBook,
+    market_orders: pl.DataFrame,
+    fair_price: float = None,
+    requote: bool = True,
+    trade_history: TradeHistory = None,
+    requote_volume: float = None,
+) -> tuple[pl.DataFrame, OrderBook | ArrayOrderBook]:
+    """Matches a whole stream of market orders against the order book in one iterative loop
+
+    Each order consumes the best levels of the opposite side until it is filled or the side is empty, and,
+    like Trade.update_orderbook_with_trade, each consumed non client level is requoted further away with
+    utils.compute_one_new_bid/ask. The matching runs on the arrays of an ArrayOrderBook: a Polars OrderBook
+    is copied into one and its bids/asks are updated at the end. The orders queued at a level of an
+    ArrayOrderBook (ArrayOrderBook.add_order) are filled in time priority, with one fill per order.
+
+    Args:
+        orderbook (OrderBook | ArrayOrderBook): The order book to trade against
+        market_orders (pl.DataFrame): The orders with timestamp, side ('buy' or 'sell') and size columns, and optionally fair_price (e.g. utils.sample_market_orders)
+        fair_price (float, optional): Fair price used for the requotes when market_orders has no fair_price column. Defaults to None.
+        requote (bool, optional): Requote the consumed non client levels. Defaults to True.
+        trade_history (TradeHistory, optional): History where the fills are logged. Defaults to None.
+        requote_volume (float, optional): Volume normaliser of the requotes, e.g. MarketConfig.volume_normaliser. Defaults to sum(vl.VOLUME_LIST).
+
+    Returns:
+        tuple[pl.DataFrame, OrderBook | ArrayOrderBook]: The fills (order_id, timestamp, side, price, size, client) and the updated order book
+    """
+    if isinstance(orderbook, ArrayOrderBook):
+        array_book = orderbook
+    else:
+        array_book = ArrayOrderBook.from_order_book(orderbook)
+    n_orders = market_orders.height
+    timestamps = market_orders["timestamp"].cast(pl.Datetime("us")).to_numpy()
+    is_buy = (market_orders["side"].cast(pl.String) == "buy").to_list()
+    sizes = market_orders["size"].cast(pl.Float64).to_list()
+    if "fair_price" in market_orders.columns:
+        fair_prices = market_orders["fair_price"].to_list()
+    else:
+        if requote and fair_price is None:
+            raise Exception("fair_price argument cannot be None if market_orders has no fair_price column.")
+        fair_prices = [fair_price] * n_orders
+
+    fill_order, fill_price, fill_size, fill_client = [], [], [], []
+    _match_orders(
+        array_book, range(n_orders), timestamps, is_buy, sizes, fair_prices, requote,
+        fill_order, fill_price, fill_size, fill_client, requote_volume=requote_volume,
+    )
+
+    fills = _fills_frame(market_orders, fill_order, fill_price, fill_size, fill_client)
+
+    if trade_history is not None:
+        trade_history.extend(fills)
+    if not isinstance(orderbook, ArrayOrderBook):
+        orderbook.bids = array_book.bids
+        orderbook.asks = array_book.asks
+    return fills, orderbook
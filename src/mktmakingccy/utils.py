@@ -1,11 +1,145 @@
 from datetime import datetime, date
-import values as vl
+from . import values as vl
 import numpy as np
 import polars as pl
 import random
 import math
-from trade import TradeHistory
-from typing import Literal
+import inspect
+import functools
+from typing import Literal, TYPE_CHECKING
+from collections import deque
+from dataclasses import dataclass, field, asdict
+
+
+if TYPE_CHECKING:  # trade imports utils, TradeHistory is only imported where it is used
+    from .trade import TradeHistory
+    from .config import MarketConfig
+
+try:  # optional compiled kernels
+    from numba import njit
+except ImportError:
+    njit = None
+
+# number of time steps drawn and solved at once, bounds the memory of long simulations
+SIMULATION_CHUNK_SIZE = 1_000_000
+# length of the closed-form blocks used by the NumPy fallback of the affine recursion
+_RECURSION_BLOCK_SIZE = 1024
+# parameters of the fair price model, their defaults are the ones of simulate_fair_price
+_MODEL_PARAMS = vl.FAIR_PRICE_MODEL_PARAMS
+
+
+def _affine_recursion_loop(a: np.ndarray, b: np.ndarray, y0: float, min_value: float) -> np.ndarray:
+    """Reference loop for y[t] = max(a[t] * y[t-1] + b[t], min_value), with y[-1] = y0."""
+    y = np.empty(len(a))
+    prev = y0
+    for t in range(len(a)):
+        prev = max(a[t] * prev + b[t], min_value)
+        y[t] = prev
+    return y
+
+
+if njit is not None:
+    _affine_recursion_loop = njit(cache=True)(_affine_recursion_loop)
+
+
+def _affine_recursion_numpy(a: np.ndarray, b: np.ndarray, y0: float, min_value: float) -> np.ndarray:
+    """Solves y[t] = max(a[t] * y[t-1] + b[t], min_value) by blocks with cumprod/cumsum.
+
+    In a block without flooring, y[t] = A[t] * (y0 + sum(b[s] / A[s], s <= t)) with A the cumulative
+    product of a. Blocks are kept short so that A stays well conditioned; when the floor is hit the
+    rest of the block is solved with the loop, as are badly conditioned blocks.
+    """
+    n = len(a)
+    y = np.empty(n)
+    prev = y0
+    i = 0
+    while i < n:
+        j = min(i + _RECURSION_BLOCK_SIZE, n)
+        A = np.cumprod(a[i:j])
+        if not np.all(np.isfinite(A)) or np.min(np.abs(A)) < 1e-100:
+            y[i:j] = _affine_recursion_loop(a[i:j], b[i:j], prev, min_value)
+        else:
+            block = A * (prev + np.cumsum(b[i:j] / A))
+            below = np.flatnonzero(block < min_value)
+            if len(below):
+                # the price sits on the floor for a while in general, finish the block with the loop
+                k = i + below[0]
+                y[i:k] = block[: below[0]]
+                y[k] = min_value
+                y[k + 1 : j] = _affine_recursion_loop(a[k + 1 : j], b[k + 1 : j], min_value, min_value)
+            else:
+                y[i:j] = block
+        prev = y[j - 1]
+        i = j
+    return y
+
+
+def _affine_recursion(a: np.ndarray, b: np.ndarray, y0: float, min_value: float = -np.inf) -> np.ndarray:
+    """Solves y[t] = max(a[t] * y[t-1] + b[t], min_value), compiled with numba when it is installed."""
+    if njit is not None:
+        return _affine_recursion_loop(a, b, float(y0), float(min_value))
+    return _affine_recursion_numpy(a, b, float(y0), float(min_value))
+
+
+def _simulate_fair_price_chunk(
+    rng: np.random.Generator,
+    size: int,
+    dt: float,
+    price: float,
+    X_t: float,
+    *,
+    mu: float,
+    sigma: float,
+    mu_jump: float,
+    sigma_jump: float,
+    jump_lambda: float,
+    theta: float,
+    mu_X: float,
+    sigma_X: float,
+    min_value: float,
+    dW: np.ndarray = None,
+) -> tuple[np.ndarray, float]:
+    """Simulates the next size fair prices after price, drawing the random numbers in bulk.
+
+    The Brownian increments dW can be given (e.g. correlated across pairs), otherwise they are drawn from rng.
+
+    Returns:
+        tuple[np.ndarray, float]: The prices and the last value of the mean-reverting component
+    """
+    if size == 0:  # e.g. the first chunk of a backtest is only its initial price
+        return np.empty(0), X_t
+    if dW is None:
+        dW = rng.normal(0, np.sqrt(dt), size)
+    # Jump component
+    jumps = rng.random(size) < jump_lambda * dt
+    J = np.zeros(size)
+    J[jumps] = rng.normal(mu_jump, sigma_jump, np.count_nonzero(jumps))
+    # Mean-reverting process: X_t = (1 - theta * dt) * X_t-1 + theta * mu_X * dt + sigma_X * dW
+    X = _affine_recursion(
+        np.full(size, 1 - theta * dt), theta * mu_X * dt + sigma_X * dW, X_t
+    )
+    # Price evolution (GBM + Jump + Mean Reversion)
+    prices = _affine_recursion(1 + mu * dt + sigma * dW, J + X, price, min_value)
+    return prices, X[-1]
+
+
+def _simulate_fair_price_path(
+    rng: np.random.Generator,
+    n_steps: int,
+    dt: float,
+    initial_price: float,
+    **model,
+) -> np.ndarray:
+    """Simulates one fair price path chunk by chunk, see _simulate_fair_price_chunk for the model arguments."""
+    prices = np.empty(n_steps)
+    prices[0] = initial_price
+    X_t = 0.0  # Initial mean-reverting component
+    for start in range(1, n_steps, SIMULATION_CHUNK_SIZE):
+        stop = min(start + SIMULATION_CHUNK_SIZE, n_steps)
+        prices[start:stop], X_t = _simulate_fair_price_chunk(
+            rng, stop - start, dt, prices[start - 1], X_t, **model
+        )
+    return prices
 
 
 #TODO Changer la dynamic pour faire apparaitre les taux d'interets ????
@@ -23,9 +157,16 @@ def simulate_fair_price(
     sigma_X: float = 0.01,
     initial_price: float = 100.0,
     min_value: float = 0.001,
+    n_paths: int = 1,
+    layout: Literal["long", "wide"] = "long",
+    seed: int = None,
+    rng: np.random.Generator = None,
 ) -> pl.DataFrame:
     """Function to simulate and generate time series of the evolution of the price of an emerging currency against USD.
 
+    All the Brownian increments, jump indicators and jump sizes are drawn in bulk from a np.random.Generator,
+    and the recursion is solved by chunks (or compiled with numba when it is installed).
+
     Args:
         start_timestamp (datetime): The first date of the time series
         end_timestamp (datetime): The last date of the time series
@@ -39,10 +180,16 @@ def simulate_fair_price(
         mu_X (float, optional): Long term mean of the mean-reverting component. Defaults to 0.
         sigma_X (float, optional): Volatility of the mean-reverting component. Defaults to 0.01.
         initial_price (float, optional): Initial FX rate value. Defaults to 1.0.
+        n_paths (int, optional): Number of independent paths to simulate. Defaults to 1.
+        layout (str, optional): With several paths, "long" returns a "path" column and "wide" one "Fair Price_k" column per path. Defaults to "long".
+        seed (int, optional): Seed of the random generator, to reproduce a run. Defaults to None.
+        rng (np.random.Generator, optional): Random generator to use instead of seed. Defaults to None.
 
     Returns:
-        pd.DataFrame: The generated time series
+        pl.DataFrame: The generated time series, with "timestamp" and "Fair Price" columns
     """
+    if rng is None:
+        rng = np.random.default_rng(seed)
 
     timestamps = pl.datetime_range(
         start=start_timestamp,
@@ -53,51 +200,254 @@ def simulate_fair_price(
     N = len(timestamps)
     dt = step_size_in_seconds / (24 * 3600)  # Convert to fraction of a day
 
-    prices = np.zeros(N)
-    prices[0] = initial_price
-    X_t = 0  # Initial mean-reverting component
+    # a single path draws from rng itself. Several paths draw from one spawned child generator each,
+    # so path k is the same whatever n_paths > 1 (but not the same as the single path of n_paths=1)
+    path_rngs = [rng] if n_paths == 1 else rng.spawn(n_paths)
+    paths = [
+        _simulate_fair_price_path(
+            path_rng, N, dt, initial_price,
+            mu=mu, sigma=sigma, mu_jump=mu_jump, sigma_jump=sigma_jump, jump_lambda=jump_lambda,
+            theta=theta, mu_X=mu_X, sigma_X=sigma_X, min_value=min_value,
+        )
+        for path_rng in path_rngs
+    ]
 
-    for t in range(1, N):
-        dW = np.random.normal(0, np.sqrt(dt))
-        dX = theta * (mu_X - X_t) * dt + sigma_X * dW  # Mean-reverting process
-        X_t += dX
+    if n_paths == 1:
+        return pl.DataFrame({"timestamp": timestamps, "Fair Price": paths[0]})
+    if layout == "wide":
+        return pl.DataFrame(
+            {"timestamp": timestamps}
+            | {f"Fair Price_{k}": path for k, path in enumerate(paths)}
+        )
+    if layout == "long":
+        return pl.DataFrame(
+            {
+                "timestamp": pl.concat([timestamps] * n_paths),
+                "path": np.repeat(np.arange(n_paths, dtype=np.uint32), N),
+                "Fair Price": np.concatenate(paths),
+            }
+        )
+    raise ValueError(f"unknown layout {layout!r}")
 
-        # Jump component
-        if np.random.rand() < jump_lambda * dt:
-            J_t = np.random.normal(mu_jump, sigma_jump)
-        else:
-            J_t = 0
 
-        # Price evolution (GBM + Jump + Mean Reversion)
-        prices[t] = max(
-            prices[t - 1] * (1 + mu * dt + sigma * dW) + J_t + X_t, min_value
-        )
+def simulate_correlated_fair_prices(
+    initial_prices: dict[str, float],
+    correlation: np.ndarray = None,
+    start_timestamp: datetime = datetime(2025, 1, 1),
+    end_timestamp: datetime = datetime(2026, 1, 1),
+    step_size_in_seconds: int = 3600,
+    pair_params: dict[str, dict] = None,
+    layout: Literal["long", "wide"] = "long",
+    seed: int = None,
+    rng: np.random.Generator = None,
+    **model,
+) -> pl.DataFrame:
+    """Multi currency version of simulate_fair_price: one fair price path per pair, with correlated Brownian increments
 
-    return pl.DataFrame({"timestamp": timestamps, "Fair Price": prices})
+    The increments of all the pairs are drawn together and correlated with the Cholesky factor of the
+    correlation matrix, the jumps stay independent. Each pair uses the model of simulate_fair_price, with
+    the shared model arguments overridden by its pair_params.
 
+    Args:
+        initial_prices (dict[str, float]): Initial fair price of each pair, e.g. {"USDBRL": 5.0, "USDMXN": 17.0}
+        correlation (np.ndarray, optional): Correlation matrix of the pairs, in the order of initial_prices. Defaults to None (independent pairs).
+        start_timestamp, end_timestamp, step_size_in_seconds: see simulate_fair_price.
+        pair_params (dict[str, dict], optional): Model arguments of each pair (sigma, mu_jump, ...). Defaults to None.
+        layout (str, optional): "long" returns a "pair" column and "wide" one "Fair Price_<pair>" column per pair. Defaults to "long".
+        seed (int, optional): Seed of the random generator, to reproduce a run. Defaults to None.
+        rng (np.random.Generator, optional): Random generator to use instead of seed. Defaults to None.
+        model: Model arguments shared by the pairs (mu, sigma, ...), see simulate_fair_price.
 
-def compute_volume_history(trade_history: TradeHistory, date: date) -> float:
-    return (
-        pl.DataFrame(trade_history.trades)
-        .filter(pl.col('timestamp').dt.date().eq(date))
-        .select('size').sum().item()
+    Returns:
+        pl.DataFrame: The generated time series of all the pairs
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    pairs = list(initial_prices)
+    n_pairs = len(pairs)
+    correlation = np.eye(n_pairs) if correlation is None else np.asarray(correlation, dtype=np.float64)
+    if correlation.shape != (n_pairs, n_pairs):
+        raise Exception(f"The correlation matrix should be {n_pairs}x{n_pairs}, one row and column per pair.")
+    cholesky = np.linalg.cholesky(correlation)
+
+    unknown = set(model) - set(_MODEL_PARAMS)
+    if unknown:
+        raise TypeError(f"unknown model arguments {sorted(unknown)}")
+    defaults = inspect.signature(simulate_fair_price).parameters
+    shared = {name: model.get(name, defaults[name].default) for name in _MODEL_PARAMS}
+    params = [shared | (pair_params or {}).get(pair, {}) for pair in pairs]
+
+    timestamps = pl.datetime_range(
+        start=start_timestamp,
+        end=end_timestamp,
+        interval=f"{step_size_in_seconds}s",
+        eager=True,
     )
+    N = len(timestamps)
+    dt = step_size_in_seconds / (24 * 3600)  # Convert to fraction of a day
+
+    # the jumps of each pair come from its own child generator, the correlated increments from rng
+    pair_rngs = rng.spawn(n_pairs)
+    paths = np.empty((n_pairs, N))
+    paths[:, 0] = [initial_prices[pair] for pair in pairs]
+    X_t = np.zeros(n_pairs)
+    for start in range(1, N, SIMULATION_CHUNK_SIZE):
+        stop = min(start + SIMULATION_CHUNK_SIZE, N)
+        dW = np.sqrt(dt) * rng.standard_normal((stop - start, n_pairs)) @ cholesky.T
+        for k in range(n_pairs):
+            paths[k, start:stop], X_t[k] = _simulate_fair_price_chunk(
+                pair_rngs[k], stop - start, dt, paths[k, start - 1], X_t[k], dW=dW[:, k], **params[k]
+            )
+
+    if layout == "wide":
+        return pl.DataFrame(
+            {"timestamp": timestamps}
+            | {f"Fair Price_{pair}": path for pair, path in zip(pairs, paths)}
+        )
+    if layout == "long":
+        return pl.DataFrame(
+            {
+                "timestamp": pl.concat([timestamps] * n_pairs),
+                "pair": pl.Series(np.repeat(pairs, N), dtype=pl.Enum(pairs)),
+                "Fair Price": paths.ravel(),
+            }
+        )
+    raise ValueError(f"unknown layout {layout!r}")
+
+
+def compute_volume_history(trade_history: "TradeHistory | pl.DataFrame | pl.LazyFrame", date: date) -> float:
+    """Traded volume of a day, from a TradeHistory or from a trade log (e.g. storage.scan_partitioned, then only this day is read)."""
+    if not isinstance(trade_history, (pl.DataFrame, pl.LazyFrame)):  # TradeHistory
+        return trade_history.daily_volume.get(date, 0.0)
+    columns = trade_history.collect_schema().names()
+    day = pl.col("date") if "date" in columns else pl.col("timestamp").dt.date()
+    volume = trade_history.lazy().filter(day == date).select(pl.col("size").sum()).collect().item()
+    return float(volume)
 
 
 def expanding_std(series: np.ndarray) -> list:
     """Function to compute the stdv each row of the DF from the beginning of the DF
 
+    The first value is skipped (it is the null log return of the first row). Runs in O(n) with
+    cumulative sums of the values shifted by the first one, which keeps the variance well conditioned.
+
     Args:
         series (np.ndarray): The col to use for the stdv
 
     Returns:
         list: The col of the stdv
     """
-    result = [None]
-    for i in range(2, len(series) + 1):
-        std = np.std(series[1:i])
-        result.append(std)
-    return result
+    x = np.asarray(series, dtype=np.float64)[1:]
+    if len(x) == 0:
+        return [None]
+    x = x - x[0]
+    n = np.arange(1, len(x) + 1)
+    mean = np.cumsum(x) / n
+    var = np.maximum(np.cumsum(x**2) / n - mean**2, 0)
+    return [None] + np.sqrt(var).tolist()
+
+
+def expanding_std_expr(expr: pl.Expr, ddof: int = 0) -> pl.Expr:
+    """Native Polars expression of the expanding standard deviation of expr, nulls are skipped.
+
+    Args:
+        expr (pl.Expr): The column to use for the stdv
+        ddof (int, optional): Delta degrees of freedom. Defaults to 0, like np.std.
+
+    Returns:
+        pl.Expr: The expanding stdv, null where expr is null or there are not enough values
+    """
+    shifted = expr - expr.drop_nulls().first()  # shifted data, to avoid cancellations
+    n = shifted.is_not_null().cum_sum()
+    sum_x = shifted.fill_null(0).cum_sum()
+    sum_x2 = (shifted**2).fill_null(0).cum_sum()
+    var = (sum_x2 - sum_x**2 / n) / (n - ddof)
+    return (
+        pl.when(expr.is_not_null() & (n > ddof))
+        .then(var.clip(lower_bound=0).sqrt())
+        .otherwise(None)
+    )
+
+
+@dataclass
+class RunningVolatility:
+    """Incremental (Welford) volatility estimator, updated tick by tick during a live simulation.
+
+    With a window, the oldest value is removed once the window is full (rolling volatility),
+    otherwise the volatility is expanding. The state can be saved with to_dict() and resumed with from_dict().
+    """
+    window: int = None
+    ddof: int = 0
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    values: deque = field(default_factory=deque, repr=False)
+
+    def update(self, value: float) -> float:
+        """Adds a new value and returns the updated volatility."""
+        if value is None or math.isnan(value):
+            return self.std
+        if self.window is not None:
+            if len(self.values) == self.window:
+                self._remove(self.values.popleft())
+            self.values.append(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        return self.std
+
+    def update_many(self, values: np.ndarray) -> np.ndarray:
+        """Adds a whole array of values and returns the volatility after each of them, like update() on each value.
+
+        A missing (NaN) value is skipped and gets the current volatility, NaN while there are not enough values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if self.window is not None:
+            return np.array([np.nan if (std := self.update(x)) is None else std for x in values])
+        valid = ~np.isnan(values)
+        # sums of the deviations to the previous mean, merged with the previous state
+        deviations = np.where(valid, values - self.mean, 0.0)
+        count = self.count + np.cumsum(valid)
+        sum_x = np.cumsum(deviations)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            m2 = self.m2 + np.cumsum(deviations**2) - sum_x**2 / count
+            std = np.sqrt(np.maximum(m2, 0) / (count - self.ddof))
+        std[count <= self.ddof] = np.nan
+        if valid.any():
+            self.mean += sum_x[-1] / count[-1]
+            self.m2 = float(max(m2[-1], 0.0))
+            self.count = int(count[-1])
+        return std
+
+    def _remove(self, value: float):
+        self.count -= 1
+        if self.count == 0:
+            self.mean, self.m2 = 0.0, 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    @property
+    def std(self) -> float:
+        """The current volatility, None if there are not enough values."""
+        if self.count <= self.ddof:
+            return None
+        return math.sqrt(max(self.m2, 0.0) / (self.count - self.ddof))
+
+    def to_dict(self) -> dict:
+        """Checkpoint of the estimator state."""
+        state = asdict(self)
+        state["values"] = list(self.values)
+        return state
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "RunningVolatility":
+        """Resumes an estimator from a checkpoint made with to_dict()."""
+        state = dict(state)
+        state["values"] = deque(state.get("values", []))
+        return cls(**state)
 
 
 def compute_all_bid_ask(
@@ -105,12 +455,16 @@ def compute_all_bid_ask(
     volume=0, #TODO Change l'argument pour que ça marche avec la fonction history volume
     lambda_val: float = 2,
     bid_asymetry: float = 0.5,
+    window: int = None,
+    normaliser: float = None,
 ) -> pl.DataFrame:
     """Compute teh bid and ask for all the time steps. For each fair price we will haev a bid ask based on the traded volume
 
     Args:
         historical_fair_price (_type_, optional): The traded volume during the day. We need it to adapt our spread depending the trades of the day. Defaults to 0, #TODO Change l'argumentpourqueçamarcheaveclafonctionhistoryvolumelambda_val:float=2.
         bid_asymetry (float, optional): In case we want to have a bid (or ask) more wide than ask (or bid). Defaults to 0.5.
+        window (int, optional): Number of log returns used for a rolling volatility. Defaults to None (expanding volatility).
+        normaliser (float, optional): Volume normaliser of the spread widening, e.g. MarketConfig.volume_normaliser. Defaults to sum(vl.VOLUME_LIST).
 
     Returns:
         pl.DataFrame: The DF with all the bid ask
@@ -124,8 +478,35 @@ def compute_all_bid_ask(
             )
         ]
     )
-    vol = expanding_std(df["log_return"].to_numpy())
-    df = df.with_columns([pl.Series("volatility", vol)])
+    if window is None:
+        vol = expanding_std_expr(pl.col("log_return"))
+    else:
+        vol = pl.col("log_return").rolling_std(window, min_samples=1, ddof=0)
+    df = df.with_columns([vol.alias("volatility")])
+    return compute_bid_ask(df, volume, lambda_val, bid_asymetry, normaliser=normaliser)
+
+
+def compute_bid_ask(
+    df: pl.DataFrame,
+    volume: float | pl.Expr = 0,
+    lambda_val: float = 2,
+    bid_asymetry: float = 0.5,
+    inventory: float | pl.Expr = 0,
+    inventory_skew: float = 0.0,
+    normaliser: float = None,
+) -> pl.DataFrame:
+    """Adds the spread, bid and ask columns to a DF that already has the fair_price and volatility columns, see compute_all_bid_ask
+
+    The quotes are widened by (1 + volume / normaliser) and, with an inventory_skew, both are shifted by
+    spread * inventory_skew * inventory / normaliser against the inventory (a long inventory lowers them).
+    volume and inventory are numbers or expressions (e.g. the columns of QuotingState.quote_batch).
+
+    Returns:
+        pl.DataFrame: The DF with all the bid ask
+    """
+    if normaliser is None:
+        normaliser = sum(vl.VOLUME_LIST)
+    shift = inventory_skew * inventory / normaliser
     df = df.with_columns([(lambda_val * pl.col("volatility")).alias("spread")])
     df = df.with_columns(
         [
@@ -133,13 +514,15 @@ def compute_all_bid_ask(
                 pl.col("fair_price")
                 - pl.col("spread") 
                 * bid_asymetry
-                * (1 + volume/sum(vl.VOLUME_LIST))
+                * (1 + volume/normaliser)
+                - pl.col("spread") * shift
             ).alias("bid"),
             (
                 pl.col("fair_price")
                 + pl.col("spread")
                 * (1 - bid_asymetry)
-                * (1 + volume/sum(vl.VOLUME_LIST))
+                * (1 + volume/normaliser)
+                - pl.col("spread") * shift
             ).alias("ask"),
         ]
     )
@@ -149,66 +532,408 @@ def compute_all_bid_ask(
 def compute_one_new_bid(
     fair_price: float,
     old_bid: float,
-    size #TODO faire en sorte de recuperer la taille du trade pour calculer le nouveau spread
+    size, #TODO faire en sorte de recuperer la taille du trade pour calculer le nouveau spread
+    normaliser: float = None,
 ):
+    if normaliser is None:
+        normaliser = sum(vl.VOLUME_LIST)
     spread = fair_price - old_bid
-    new_bid = fair_price - spread * (1 + size/sum(vl.VOLUME_LIST)) #TODO eventuellement changer pour que ce soit en accord avec history volume
+    new_bid = fair_price - spread * (1 + size/normaliser) #TODO eventuellement changer pour que ce soit en accord avec history volume
     return new_bid
 
 def compute_one_new_ask(
     fair_price: float,
     old_ask: float,
-    size #TODO faire en sorte de recuperer la taille du trade pour calculer le nouveau spread
+    size, #TODO faire en sorte de recuperer la taille du trade pour calculer le nouveau spread
+    normaliser: float = None,
 ):
+    if normaliser is None:
+        normaliser = sum(vl.VOLUME_LIST)
     spread = old_ask - fair_price
-    new_ask = fair_price + spread * (1 + size/sum(vl.VOLUME_LIST)) #TODO eventuellement changer pour que ce soit en accord avec history volume
+    new_ask = fair_price + spread * (1 + size/normaliser) #TODO eventuellement changer pour que ce soit en accord avec history volume
     return new_ask
 
 
+@dataclass
+class QuotingState:
+    """Running traded volume of the day and inventory of the market maker, updated in O(1) per fill, and the quotes they give.
+
+    The quotes do not go back to the trade history (compute_volume_history) at each tick: the state is updated
+    by on_fill, and quote() prices a tick with the formulas of compute_bid_ask, with the volume of the day and
+    the inventory as of that tick. quote_batch() gives the same quotes for a whole history of ticks and fills
+    in one vectorized pass. The normaliser (sum(vl.VOLUME_LIST) by default) is computed once.
+    The inventory follows utils.PnlTracker: a 'buy' market order lifts our ask and lowers it.
+    """
+    lambda_val: float = 2
+    bid_asymetry: float = 0.5
+    inventory_skew: float = 0.0
+    normaliser: float = field(default_factory=lambda: float(sum(vl.VOLUME_LIST)))
+    inventory: float = 0.0
+    daily_volume: float = 0.0
+    day: date = None
+
+    @classmethod
+    def from_config(cls, config: "MarketConfig", **state) -> "QuotingState":
+        """State with the lambda_val, bid_asymetry and volume normaliser of a config.MarketConfig."""
+        return cls(config.lambda_val, config.bid_asymetry, normaliser=config.volume_normaliser, **state)
+
+    def _roll(self, timestamp: datetime):
+        day = timestamp.date() if isinstance(timestamp, datetime) else timestamp.astype("datetime64[D]").item()
+        if self.day is None:  # the starting volume counts for the first day seen
+            self.day = day
+        elif day != self.day:  # new day, the traded volume starts again from 0
+            self.day = day
+            self.daily_volume = 0.0
+
+    def on_fill(self, timestamp: datetime, side: Literal["buy", "sell"], size: float):
+        """Adds a fill to the volume of the day and to the inventory."""
+        self._roll(timestamp)
+        self.daily_volume += size
+        self.inventory += -size if side == "buy" else size
+
+    def widening(self) -> float:
+        """Factor applied to the half spreads, 1 + volume of the day / normaliser."""
+        return 1 + self.daily_volume / self.normaliser
+
+    def shift(self) -> float:
+        """Skew of both quotes against the inventory, in spreads."""
+        return self.inventory_skew * self.inventory / self.normaliser
+
+    def quote(self, timestamp: datetime, fair_price: float, volatility: float) -> tuple[float, float, float]:
+        """Spread, bid and ask of a tick, see compute_bid_ask.
+
+        Returns:
+            tuple[float, float, float]: The spread, bid and ask (None if the volatility is not known yet)
+        """
+        self._roll(timestamp)
+        if volatility is None or math.isnan(volatility):
+            return None, None, None
+        spread = self.lambda_val * volatility
+        shift = self.shift()
+        widening = self.widening()
+        bid = fair_price - spread * self.bid_asymetry * widening - spread * shift
+        ask = fair_price + spread * (1 - self.bid_asymetry) * widening - spread * shift
+        return spread, bid, ask
+
+    def quote_batch(self, quotes: pl.DataFrame, fills: pl.DataFrame = None) -> pl.DataFrame:
+        """Quotes of a whole history, the same as quote() tick by tick with on_fill() of the fills in between
+
+        The volume of the day and the inventory of each tick only count the fills strictly before it (the fills
+        of a tick come after its quote). The state is moved to the end of the history.
+
+        Args:
+            quotes (pl.DataFrame): The ticks, with timestamp, fair_price and volatility columns
+            fills (pl.DataFrame, optional): The fills, with timestamp, side ('buy' or 'sell') and size columns. Defaults to None.
+
+        Returns:
+            pl.DataFrame: The ticks with daily_volume, inventory, spread, bid and ask columns
+        """
+        day = pl.col("timestamp").dt.date()
+        if fills is not None and fills.height:
+            self._roll(min(quotes["timestamp"].min(), fills["timestamp"].min()) if quotes.height else fills["timestamp"].min())
+        elif quotes.height:
+            self._roll(quotes["timestamp"].min())
+        ticks = quotes.lazy().with_columns(day.alias("_day")).sort("timestamp")
+        if fills is None:
+            fills = pl.DataFrame(schema={"timestamp": pl.Datetime("us"), "side": pl.String, "size": pl.Float64})
+        # the current state is the first row of the running sums, so they are the same as the updates of on_fill
+        running = (
+            pl.concat(
+                [
+                    pl.DataFrame(
+                        {"timestamp": [None], "_day": [self.day], "size": [self.daily_volume], "_change": [self.inventory]},
+                        schema={"timestamp": pl.Datetime("us"), "_day": pl.Date, "size": pl.Float64, "_change": pl.Float64},
+                    ).lazy(),
+                    fills.lazy()
+                    .select(pl.col("timestamp").cast(pl.Datetime("us")), "side", pl.col("size").cast(pl.Float64))
+                    .sort("timestamp")
+                    .select(
+                        "timestamp",
+                        day.alias("_day"),
+                        "size",
+                        pl.when(pl.col("side").cast(pl.String) == "buy").then(-pl.col("size")).otherwise(pl.col("size")).alias("_change"),
+                    ),
+                ]
+            )
+            .with_columns(
+                pl.col("size").cum_sum().over("_day").alias("_daily_volume"),
+                pl.col("_change").cum_sum().alias("_inventory"),
+            )
+            .collect()
+        )
+        after_fills = running.slice(1)
+        last = running.row(-1, named=True)
+        start_volume = pl.when(pl.col("_day") == self.day).then(pl.lit(self.daily_volume)).otherwise(0.0)
+
+        ticks = (
+            ticks.with_columns(pl.col("timestamp").cast(pl.Datetime("us")).alias("_timestamp"))
+            .join_asof(
+                after_fills.lazy().select(pl.col("timestamp").alias("_timestamp"), "_day", "_daily_volume"),
+                on="_timestamp", by="_day", strategy="backward", allow_exact_matches=False,
+                check_sortedness=False,  # both sides are sorted by timestamp
+            )
+            .join_asof(
+                after_fills.lazy().select(pl.col("timestamp").alias("_timestamp"), "_inventory"),
+                on="_timestamp", strategy="backward", allow_exact_matches=False,
+            )
+            .with_columns(
+                pl.col("_daily_volume").fill_null(start_volume).alias("daily_volume"),
+                pl.col("_inventory").fill_null(self.inventory).alias("inventory"),
+            )
+            .drop("_day", "_timestamp", "_daily_volume", "_inventory")
+            .collect()
+        )
+        quoted = compute_bid_ask(
+            ticks, pl.col("daily_volume"), self.lambda_val, self.bid_asymetry,
+            pl.col("inventory"), self.inventory_skew, self.normaliser,
+        )
+
+        if after_fills.height:
+            self.inventory = last["_inventory"]
+            self.day, self.daily_volume = last["_day"], last["_daily_volume"]
+        if quoted.height:
+            self._roll(quoted["timestamp"][-1])
+        return quoted
+
+    def to_dict(self) -> dict:
+        """Checkpoint of the state."""
+        state = asdict(self)
+        state["day"] = None if self.day is None else self.day.isoformat()
+        return state
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "QuotingState":
+        """Resumes a state from a checkpoint made with to_dict()."""
+        state = dict(state)
+        if state.get("day") is not None:
+            state["day"] = date.fromisoformat(state["day"])
+        return cls(**state)
+
+
 def generate_market_order(
-    historical_bid_ask: pl.DataFrame,
+    historical_bid_ask: pl.DataFrame | pl.LazyFrame,
     spread_sensibility: float=5,
     base_intensity: float=1,
-) -> pl.DataFrame:
+    sample: bool = False,
+    seed: int = None,
+    rng: np.random.Generator = None,
+    **size_kwargs,
+) -> pl.DataFrame | pl.LazyFrame:
     """Generate randomly the market order that will occur at each time step based on the spread (so the volatility indirectly)
 
+    The intensities and probabilities are native Polars expressions, so a LazyFrame can be passed
+    and a LazyFrame is returned.
+
     Args:
-        historical_bid_ask (pl.DataFrame): The DF containing all the bid ask
+        historical_bid_ask (pl.DataFrame | pl.LazyFrame): The DF containing all the bid ask
         spread_sensibility (float, optional): The impact of the spread to the probabilities. Defaults to 5.
         base_intensity (float, optional): Case of a 0 spread. Defaults to 1.
+        sample (bool, optional): Return the sampled market orders (see sample_market_orders) instead of the probabilities. Defaults to False.
+        seed (int, optional): Seed of the random generator used when sample is True. Defaults to None.
+        rng (np.random.Generator, optional): Random generator to use instead of seed. Defaults to None.
+        **size_kwargs: Passed to sample_market_orders (size_ladder, method, scale, ...).
 
     Returns:
-        pl.DataFrame: The DF with all the probabilities
+        pl.DataFrame | pl.LazyFrame: The DF with all the probabilities, or the sampled market orders
     """
-    df = historical_bid_ask.clone()
+    is_lazy = isinstance(historical_bid_ask, pl.LazyFrame)
+    columns = historical_bid_ask.collect_schema().names()
 
-    df = df.with_columns([
-        ((pl.col("fair_price") - pl.col("bid"))).alias("delta_bid"),
-        ((pl.col("ask") - pl.col("fair_price"))).alias("delta_ask"),
-    ])
+    lambda_bid = base_intensity * (-spread_sensibility * (pl.col("fair_price") - pl.col("bid"))).exp()
+    lambda_ask = base_intensity * (-spread_sensibility * (pl.col("ask") - pl.col("fair_price"))).exp()
+    df = historical_bid_ask.lazy().select(
+        pl.col(columns),
+        (1 - (-lambda_bid).exp()).alias("prob_trade_bid"),
+        (1 - (-lambda_ask).exp()).alias("prob_trade_ask"),
+    )
 
-    df = df.with_columns([
-        (base_intensity * pl.col("delta_bid").map_elements(lambda x: np.exp(-spread_sensibility * x), return_dtype=pl.Float64)).alias("lambda_bid"),
-        (base_intensity * pl.col("delta_ask").map_elements(lambda x: np.exp(-spread_sensibility * x), return_dtype=pl.Float64)).alias("lambda_ask"),
-    ])
+    if sample:
+        return sample_market_orders(df.collect(), seed=seed, rng=rng, **size_kwargs)
+    return df if is_lazy else df.collect()
 
-    df = df.with_columns([
-        (1 - pl.col("lambda_bid").map_elements(lambda x: np.exp(-x), return_dtype=pl.Float64)).alias("prob_trade_bid"),
-        (1 - pl.col("lambda_ask").map_elements(lambda x: np.exp(-x), return_dtype=pl.Float64)).alias("prob_trade_ask"),
-    ])
 
-    return df.select(historical_bid_ask.columns + ["prob_trade_bid", "prob_trade_ask"])
+def sample_market_orders(
+    historical_probabilities: pl.DataFrame,
+    size_ladder: list[float] = None,
+    *,
+    seed: int = None,
+    rng: np.random.Generator = None,
+    method: Literal['exp', 'hill', 'logistic'] = 'hill',
+    scale: float = 1e6,
+    exponent: float = 1.0,
+    mid: float = 1e6,
+    slope: float = 1.0,
+    sampler: Literal["thinning", "inverse_cdf"] = "thinning",
+) -> pl.DataFrame:
+    """Samples in bulk the market orders hitting our bid and lifting our ask at each time step
 
+    For each time step and side a candidate size is drawn uniformly from the size ladder, and the order
+    happens with probability adjust_probability(prob_trade, size), so big sizes are less likely than small ones.
+    The weights come from the SizeWeightTable of the parameters. With sampler="inverse_cdf" the order happens
+    with probability prob_trade * mean weight and only the sizes of the orders are drawn, from the inverse CDF
+    of the weights: same distribution, but not the same draws as "thinning" for a given seed.
+
+    Args:
+        historical_probabilities (pl.DataFrame): Output of generate_market_order, with timestamp, fair_price and prob_trade_bid/ask
+        size_ladder (list[float], optional): The possible trade sizes. Defaults to vl.TRADE_SIZE_LADDER.
+        seed (int, optional): Seed of the random generator. Defaults to None.
+        rng (np.random.Generator, optional): Random generator to use instead of seed. Defaults to None.
+        method, scale, exponent, mid, slope: see adjust_probability.
+        sampler (str, optional): "thinning" or "inverse_cdf". Defaults to "thinning".
+
+    Returns:
+        pl.DataFrame: One row per market order with timestamp, fair_price, side ('sell' hits the bid, 'buy' lifts the ask) and size
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    if sampler not in ("thinning", "inverse_cdf"):
+        raise ValueError(f"unknown sampler {sampler!r}")
+    table = size_weight_table(size_ladder, method=method, scale=scale, exponent=exponent, mid=mid, slope=slope)
+
+    orders = []
+    for side, prob_col in (("sell", "prob_trade_bid"), ("buy", "prob_trade_ask")):
+        prob = historical_probabilities[prob_col].fill_null(0).to_numpy()
+        if sampler == "thinning":
+            # same draws as rng.choice(size_ladder), the weights are looked up in the table
+            candidates = rng.integers(0, len(table.sizes), len(prob))
+            happened = rng.random(len(prob)) < prob * table.weights[candidates]
+            sizes = table.sizes[candidates[happened]]
+        else:
+            happened = rng.random(len(prob)) < prob * table.mean_weight
+            sizes = table.sample(int(happened.sum()), rng)
+        orders.append(
+            historical_probabilities.select("timestamp", "fair_price")
+            .filter(pl.Series(happened))
+            .with_columns(
+                pl.lit(side).alias("side"),
+                pl.Series("size", sizes),
+            )
+        )
+    return pl.concat(orders).sort("timestamp", maintain_order=True)
+
+
+@dataclass
+class PnlTracker:
+    """Running inventory and PnL, updated batch by batch from the trade log for intraday marking.
+
+    The fair price of each trade is found with a single backward join_asof on the fair price history,
+    and the inventory and PnL are cumulative sums. With fx_revaluation, the inventory carried between two
+    trades is also revalued in $ with the fair price move (fx_pnl), and total_pnl = pnl + fx_pnl.
+    """
+    inventory: float = 0
+    pnl: float = 0.0
+    fx_pnl: float = 0.0
+    last_fair_price: float = None
+    fx_revaluation: bool = False
+
+    def update(self, historical_fair_price: pl.DataFrame, historical_trade: pl.DataFrame) -> pl.DataFrame:
+        """Consumes a batch of trades (newer than the previous ones) and returns their PnL records.
+
+        Args:
+            historical_fair_price (pl.DataFrame): The fair prices, with "timestamp" and "Fair Price" columns
+            historical_trade (pl.DataFrame): The trades, with timestamp, side, price and size columns
+
+        Returns:
+            pl.DataFrame: timestamp, pnl and inventory after each trade (and fx_pnl, total_pnl with fx_revaluation)
+        """
+        df = self._records(historical_fair_price, historical_trade)
+        if df.height:
+            last = df.row(-1, named=True)
+            self.inventory = last["inventory"]
+            self.pnl = last["pnl"]
+            self.last_fair_price = last["fair_price"]
+            if self.fx_revaluation:
+                self.fx_pnl = last["fx_pnl"]
+        return df.select(self._columns)
+
+    @property
+    def _columns(self) -> list[str]:
+        if self.fx_revaluation:
+            return ["timestamp", "pnl", "inventory", "fx_pnl", "total_pnl"]
+        return ["timestamp", "pnl", "inventory"]
+
+    def _records(
+        self,
+        historical_fair_price: pl.DataFrame | pl.LazyFrame,
+        historical_trade: pl.DataFrame | pl.LazyFrame,
+    ) -> pl.DataFrame | pl.LazyFrame:
+        """PnL records of a batch of trades from the current state, without updating it (lazy if the trades are lazy)."""
+        sign = pl.when(pl.col("side") == "buy").then(1).otherwise(-1)
+        df = (
+            historical_trade.lazy()
+            .select("timestamp", "side", "price", "size")
+            .sort("timestamp")
+            .join_asof(
+                historical_fair_price.lazy().select(
+                    "timestamp", pl.col("Fair Price").alias("fair_price")
+                ).sort("timestamp"),
+                on="timestamp",
+                strategy="backward",
+            )
+            .with_columns(
+                (self.inventory - (sign * pl.col("size")).cum_sum()).alias("inventory"),
+                (
+                    self.pnl
+                    + (
+                        sign
+                        * (pl.col("size") / pl.col("fair_price"))
+                        * (pl.col("price") - pl.col("fair_price"))
+                    ).cum_sum()
+                ).alias("pnl"),
+            )
+        )
+        if self.fx_revaluation:
+            carried = pl.col("inventory").shift(1, fill_value=self.inventory)
+            previous_price = pl.col("fair_price").shift(1, fill_value=self.last_fair_price)
+            df = df.with_columns(
+                (
+                    self.fx_pnl
+                    + (carried * (1 / pl.col("fair_price") - 1 / previous_price))
+                    .fill_null(0)
+                    .cum_sum()
+                ).alias("fx_pnl")
+            ).with_columns((pl.col("pnl") + pl.col("fx_pnl")).alias("total_pnl"))
+        return df if isinstance(historical_trade, pl.LazyFrame) else df.collect()
+
+    def mark(self, fair_price: float) -> float:
+        """Returns the total PnL in $ if the inventory is marked at this fair price."""
+        if not self.fx_revaluation or self.last_fair_price is None:
+            return self.pnl
+        return self.pnl + self.fx_pnl + self.inventory * (1 / fair_price - 1 / self.last_fair_price)
 
 
 def track_pnl(
-    historical_fair_price: pl.DataFrame,
-    historical_trade: pl.DataFrame,
+    historical_fair_price: pl.DataFrame | pl.LazyFrame,
+    historical_trade: pl.DataFrame | pl.LazyFrame,
     inventory: int,
     start_record_time: datetime = None,
     end_record_time: datetime = None,
+    fx_revaluation: bool = False,
 ) -> pl.DataFrame:
-    #TODO add the impact of the FX to the PNL with the inventory
+    """Computes the PnL and inventory after each trade, see PnlTracker
+
+    With lazy inputs (e.g. storage.scan_partitioned) the result is a LazyFrame, and the record time
+    filter is pushed down to the scan of the trades.
+
+    Args:
+        historical_fair_price (pl.DataFrame | pl.LazyFrame): The fair prices, with "timestamp" and "Fair Price" columns
+        historical_trade (pl.DataFrame | pl.LazyFrame): The trades, with timestamp, side, price and size columns
+        inventory (int): The inventory before the first trade
+        start_record_time (datetime, optional): First trade date to record. Defaults to the first trade.
+        end_record_time (datetime, optional): Last trade date to record. Defaults to the last trade.
+        fx_revaluation (bool, optional): Add the revaluation in $ of the carried inventory. Defaults to False.
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: The DF with the PnL and the inventory
+    """
+    tracker = PnlTracker(inventory=inventory, fx_revaluation=fx_revaluation)
+    if isinstance(historical_trade, pl.LazyFrame):
+        if start_record_time is not None:
+            historical_trade = historical_trade.filter(pl.col("timestamp") >= start_record_time)
+        if end_record_time is not None:
+            historical_trade = historical_trade.filter(pl.col("timestamp") <= end_record_time)
+        return tracker._records(historical_fair_price, historical_trade).select(tracker._columns)
+
     if start_record_time is None:
         start_record_time = historical_trade[0, "timestamp"]
     if end_record_time is None:
@@ -216,44 +941,41 @@ def track_pnl(
     masked_historical_trade = historical_trade.filter(
         pl.col("timestamp").is_between(start_record_time, end_record_time)
     )
-    total_pnl = 0
-    records = []
-
-    for trade_row in masked_historical_trade.iter_rows(named=True):
-        action = trade_row["side"]
-        trade_price = trade_row["price"]
-        quantity = trade_row["size"]
-        trade_date = trade_row["timestamp"]
-        closest_price_row = (
-            historical_fair_price.filter(pl.col("timestamp") <= trade_date)
-            .sort("timestamp", descending=True)
-            .head(1)
-        )
-        price = closest_price_row[0, "Fair Price"]
-
-        sign = 1 if action == "buy" else -1
-        inventory -= sign * quantity
-        pnl = sign * (quantity / price) * (trade_price - price) #juste diviser par price pour PNL en $ ??
-        total_pnl += pnl
-
-        records.append(
-            {"timestamp": trade_date, "pnl": total_pnl, "inventory": inventory}
-        )
-    result_df = pl.DataFrame(records)
-    return result_df
-
+    return tracker.update(historical_fair_price, masked_historical_trade)
 
 
 def adjust_probability(
-    base_p: float,
-    volume: float,
+    base_p: float | np.ndarray | pl.Expr,
+    volume: float | np.ndarray | pl.Expr,
     *,
     method: Literal['exp', 'hill', 'logistic'] = 'hill',
     scale: float = 1e6,
     exponent: float = 1.0,
     mid: float = 1e6,
     slope: float = 1.0,
-) -> float:
+) -> float | np.ndarray | pl.Expr:
+    """Scales a trade probability down with the trade size, so that big sizes are less likely than small ones
+
+    Scalars give a float. Arrays are broadcast with the NumPy rules, e.g. base_p[:, None] and
+    size_ladder[None, :] give the (time steps, sizes) grid of probabilities, and if base_p or volume
+    is a Polars expression the result is an expression. For a fixed size ladder, see SizeWeightTable.
+
+    Args:
+        base_p (float | np.ndarray | pl.Expr): The probability of a trade
+        volume (float | np.ndarray | pl.Expr): The size of the trade
+        method (str, optional): Weighting of the sizes, 'exp' (exp(-volume / scale)), 'hill' (1 / (1 + (volume / scale) ** exponent)) or 'logistic' (1 / (1 + exp(slope * (volume - mid)))). Defaults to 'hill'.
+        scale, exponent, mid, slope (float, optional): Parameters of the weighting.
+
+    Returns:
+        float | np.ndarray | pl.Expr: The adjusted probability
+    """
+    if isinstance(base_p, pl.Expr) or isinstance(volume, pl.Expr) or np.ndim(base_p) or np.ndim(volume):
+        weight = _size_weight(volume, method=method, scale=scale, exponent=exponent, mid=mid, slope=slope)
+        if isinstance(weight, pl.Expr):
+            return weight * base_p
+        if isinstance(base_p, pl.Expr):
+            return base_p * (weight.item() if weight.ndim == 0 else pl.lit(pl.Series(weight)))
+        return np.asarray(base_p, dtype=np.float64) * weight
     if method == "exp":
         # exponential decay
         weight = math.exp(-volume/scale)
@@ -267,3 +989,120 @@ def adjust_probability(
         raise ValueError(f"unknown method {method!r}")
     return base_p * weight
 
+
+def _size_weight(
+    volume: np.ndarray | pl.Expr,
+    *,
+    method: Literal['exp', 'hill', 'logistic'] = 'hill',
+    scale: float = 1e6,
+    exponent: float = 1.0,
+    mid: float = 1e6,
+    slope: float = 1.0,
+) -> np.ndarray | pl.Expr:
+    """Weights of adjust_probability computed on a whole array of volumes, or as a Polars expression."""
+    if not isinstance(volume, pl.Expr):
+        volume = np.asarray(volume, dtype=np.float64)
+    if method == "exp":
+        return (-volume / scale).exp() if isinstance(volume, pl.Expr) else np.exp(-volume / scale)
+    elif method == "hill":
+        return 1 / (1 + (volume/scale)**exponent)
+    elif method == "logistic":
+        # 1 / (1 + exp(z)) written with tanh so that it does not overflow
+        z = slope * (volume - mid) / 2
+        return 0.5 * (1 - (z.tanh() if isinstance(volume, pl.Expr) else np.tanh(z)))
+    raise ValueError(f"unknown method {method!r}")
+
+
+@dataclass(frozen=True, eq=False)
+class SizeWeightTable:
+    """Weights of adjust_probability precomputed on a fixed size ladder, with an inverse-CDF sampler of the trade sizes.
+
+    The table is built once for a set of parameters (see size_weight_table), so the weights of sizes drawn by
+    position on the ladder are a gather, weights[positions], instead of a pow/exp per (probability, size) pair,
+    and grid gives the probabilities of every size at once. A size drawn uniformly from the ladder and kept with
+    probability base_p * weight is the same as an order with probability base_p * mean_weight and a size drawn
+    with probabilities proportional to the weights, which sample draws with one searchsorted on the CDF.
+    """
+    sizes: np.ndarray
+    weights: np.ndarray
+    cdf: np.ndarray = field(repr=False)
+    _order: np.ndarray = field(repr=False)
+    _step: float = field(default=None, repr=False)  # spacing of an evenly spaced ladder, the lookup is then arithmetic
+
+    @classmethod
+    def build(cls, size_ladder: list[float] = None, **weight_params) -> "SizeWeightTable":
+        """Builds the table of a size ladder (defaults to vl.TRADE_SIZE_LADDER), weight_params are the method, scale, ... of adjust_probability."""
+        sizes = np.asarray(vl.TRADE_SIZE_LADDER if size_ladder is None else size_ladder, dtype=np.float64)
+        weights = _size_weight(sizes, **weight_params)
+        cdf = np.cumsum(weights) / weights.sum()
+        cdf[-1] = 1.0
+        order = np.argsort(sizes, kind="stable")
+        steps = np.diff(sizes[order])
+        step = float(steps[0]) if len(steps) and steps[0] > 0 and np.all(steps == steps[0]) else None
+        for array in (sizes, weights, cdf, order):
+            array.flags.writeable = False
+        return cls(sizes, weights, cdf, order, step)
+
+    @property
+    def mean_weight(self) -> float:
+        """Probability that a size drawn uniformly from the ladder is kept."""
+        return float(self.weights.mean())
+
+    def index(self, volume: np.ndarray) -> np.ndarray:
+        """Position of each volume in the ladder.
+
+        Raises:
+            Exception: if a volume is not on the ladder
+        """
+        volume = np.asarray(volume, dtype=np.float64)
+        if self._step is not None:
+            sorted_pos = np.rint((volume - self.sizes[self._order[0]]) / self._step)
+        else:
+            sorted_pos = np.searchsorted(self.sizes, volume, sorter=self._order)
+        pos = self._order[sorted_pos.clip(0, len(self.sizes) - 1).astype(np.intp)]
+        if not np.array_equal(self.sizes[pos], volume):
+            raise Exception("Some volumes are not on the size ladder, use adjust_probability for arbitrary sizes.")
+        return pos
+
+    def weight(self, volume: np.ndarray) -> np.ndarray:
+        """Weights of volumes on the ladder, looked up in the table (an arithmetic lookup for an evenly spaced ladder)."""
+        return self.weights[self.index(volume)]
+
+    def adjust(self, base_p: np.ndarray, volume: np.ndarray) -> np.ndarray:
+        """adjust_probability of volumes on the ladder, broadcast like adjust_probability."""
+        return np.asarray(base_p, dtype=np.float64) * self.weight(volume)
+
+    def grid(self, base_p: np.ndarray) -> np.ndarray:
+        """adjust_probability of every size of the ladder, of shape base_p.shape + (number of sizes,)."""
+        return np.asarray(base_p, dtype=np.float64)[..., None] * self.weights
+
+    def expr(self, volume: pl.Expr) -> pl.Expr:
+        """Weight of a column of sizes on the ladder, as a Polars expression (null for the other sizes)."""
+        return volume.replace_strict(pl.Series(self.sizes), pl.Series(self.weights), default=None, return_dtype=pl.Float64)
+
+    def sample(self, n: int, rng: np.random.Generator = None) -> np.ndarray:
+        """Draws n trade sizes with probabilities proportional to their weights (inverse CDF)."""
+        if rng is None:
+            rng = np.random.default_rng()
+        return self.sizes[self.cdf.searchsorted(rng.random(n), side="right").clip(max=len(self.sizes) - 1)]
+
+
+@functools.lru_cache(maxsize=32)
+def _cached_size_weight_table(size_ladder: tuple, method: str, scale: float, exponent: float, mid: float, slope: float) -> SizeWeightTable:
+    return SizeWeightTable.build(size_ladder, method=method, scale=scale, exponent=exponent, mid=mid, slope=slope)
+
+
+def size_weight_table(
+    size_ladder: list[float] = None,
+    *,
+    method: Literal['exp', 'hill', 'logistic'] = 'hill',
+    scale: float = 1e6,
+    exponent: float = 1.0,
+    mid: float = 1e6,
+    slope: float = 1.0,
+) -> SizeWeightTable:
+    """The SizeWeightTable of these parameters, built once and reused by the next calls with the same parameters."""
+    if method not in ("exp", "hill", "logistic"):
+        raise ValueError(f"unknown method {method!r}")
+    size_ladder = tuple(np.asarray(vl.TRADE_SIZE_LADDER if size_ladder is None else size_ladder, dtype=np.float64).tolist())
+    return _cached_size_weight_table(size_ladder, method, float(scale), float(exponent), float(mid), float(slope))
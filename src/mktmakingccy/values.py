@@ -1 +1,8 @@
-VOLUME_LIST = [100_000] * 5 + [500_000] + [1_000_000] * 9
\ No newline at end of file
+VOLUME_LIST = [100_000] * 5 + [500_000] + [1_000_000] * 9
+# possible sizes of a market order, up to 10M
+TRADE_SIZE_LADDER = [100_000 * i for i in range(1, 101)]
+# parameters of the fair price model, their defaults are the ones of utils.simulate_fair_price
+FAIR_PRICE_MODEL_PARAMS = (
+    "mu", "sigma", "mu_jump", "sigma_jump", "jump_lambda",
+    "theta", "mu_X", "sigma_X", "min_value",
+)
@@ -1 +1,899 @@
 from mktmakingccy import mktmakingccy
+from mktmakingccy import cache as cache_module
+from mktmakingccy import service as service_module
+from mktmakingccy import config, metrics, order_book, storage, trade, utils, values
+from mktmakingccy.backtest import Backtest
+from mktmakingccy.books import BookManager
+from mktmakingccy.cache import DiskCache, _SENTINEL
+from mktmakingccy.config import MarketConfig
+from mktmakingccy.order_book import OrderBook, ArrayOrderBook, compute_quote_ladders
+from mktmakingccy.scheduler import SessionScheduler
+from mktmakingccy.service import QuotingService, order_flow
+from mktmakingccy.sweep import _process_pool, run_sweep
+from mktmakingccy.ticks import (
+    FileTickSource, QueueTickSource, SyntheticTickSource, TickSource, TICK_SCHEMA, stream_quotes
+)
+from mktmakingccy.trade import MarketOrder, TradeHistory, get_history, match_market_orders
+
+import asyncio
+import copy
+import dataclasses
+import importlib
+import os
+import pickle
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import polars as pl
+import pytest
+from datetime import date, datetime
+
+
+def test_array_order_book_matches_order_book():
+    random.seed(0)
+    polars_book = OrderBook(n_levels=5)
+    array_book = ArrayOrderBook(n_levels=5)
+    for _ in range(300):
+        price = round(100 + random.uniform(-1, 1), 2)
+        size = random.choice([0, 100_000, 500_000])
+        side = random.choice(["bid", "ask"])
+        polars_book.update_order(price=price, size=size, side=side)
+        array_book.update_order(price=price, size=size, side=side)
+
+    timestamps = ["timestamp_bid", "timestamp_ask"]
+    assert array_book.get_order_book().drop(timestamps).equals(
+        polars_book.get_order_book().drop(timestamps)
+    )
+    assert array_book.get_best_bid()[:2] == polars_book.get_best_bid()[:2]
+    assert array_book.get_best_ask()[:2] == polars_book.get_best_ask()[:2]
+
+
+def test_array_order_book_base_pricing():
+    base_date = datetime(2025, 1, 1)
+    array_book = ArrayOrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+    polars_book = OrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+    assert array_book.get_order_book().equals(polars_book.get_order_book())
+
+
+def test_quote_ladders_seed_books():
+    base_date = datetime(2025, 1, 1)
+    fair_prices, spreads = np.array([100.0, 101.0, 99.5]), np.array([0.001, 0.002, 0.0015])
+    ladders = compute_quote_ladders(fair_prices, spreads, 15)
+    for t in range(len(fair_prices)):
+        seeded = ArrayOrderBook(15).load_ladder(base_date, *(ladder[t] for ladder in ladders))
+        priced = OrderBook(15).get_base_pricing(base_date, fair_prices[t], spreads[t])
+        assert seeded.get_order_book().equals(priced.get_order_book())
+
+
+def test_disk_cache(tmp_path):
+
+    calls = []
+
+    def simulate(n: int, seed: int = None) -> pl.DataFrame:
+        calls.append(n)
+        return pl.DataFrame({"x": np.random.default_rng(seed).normal(size=n)})
+
+    old_version = tmp_path / "0.0.0-old"  # a version folder of the cache, marked by its sentinel
+    old_version.mkdir()
+    (old_version / _SENTINEL).touch()
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "prices.parquet").touch()
+    cache = DiskCache(tmp_path, max_bytes=10**9)
+    assert not old_version.exists()  # entries of another package version are dropped
+    assert (tmp_path / "data" / "prices.parquet").exists()  # the other folders of root are not touched
+
+    cached_simulate = cache.wrap(simulate)
+    first = cached_simulate(1000, seed=1)
+    assert isinstance(first, pl.LazyFrame)
+    assert cached_simulate(n=1000, seed=1).collect().equals(first.collect())
+    cached_simulate(1000)  # no seed, not cached
+    cached_simulate(1000)
+    assert calls == [1000, 1000, 1000]
+    assert cache.stats()["hits"] == 1
+
+    # least recently used entries are evicted past max_bytes
+    cache.max_bytes = cache.size() + 100
+    cached_simulate(1000, seed=2)
+    assert cache.stats()["entries"] == 1
+    cached_simulate(1000, seed=2)
+    assert cache.stats()["hits"] == 2
+
+
+def test_disk_cache_key_follows_the_helpers(tmp_path, monkeypatch):
+
+    def edit(path, source):
+        path.write_text(source)
+        modified = path.stat().st_mtime_ns + 10**9
+        os.utime(path, ns=(modified, modified))
+
+    # a function calling a helper of its own module
+    module = tmp_path / "user_flows.py"
+    edit(module, "def scale():\n    return 1.0\n\ndef simulate(n):\n    return [scale()] * n\n")
+    monkeypatch.syspath_prepend(tmp_path)
+    user_flows = importlib.import_module("user_flows")
+    cache = DiskCache(tmp_path / "cache")
+    key = cache.key(user_flows.simulate, {"n": 10})
+    assert cache.key(user_flows.simulate, {"n": 10}) == key
+    edit(module, "def scale():\n    return 2.0\n\ndef simulate(n):\n    return [scale()] * n\n")
+    assert cache.key(user_flows.simulate, {"n": 10}) != key
+
+    # a helper of the package, e.g. utils._simulate_fair_price_chunk
+    package = tmp_path / "package"
+    package.mkdir()
+    edit(package / "utils.py", "SIGMA = 0.01\n")
+    monkeypatch.setattr(cache_module, "_PACKAGE_FOLDER", package)
+    key = cache.key(user_flows.simulate, {"n": 10})
+    edit(package / "utils.py", "SIGMA = 0.02\n")
+    assert cache.key(user_flows.simulate, {"n": 10}) != key
+
+
+def test_session_scheduler_resets_and_refills():
+
+    quotes = pl.DataFrame(
+        {
+            "timestamp": [datetime(2025, 1, 1, 0, 30), datetime(2025, 1, 1, 5), datetime(2025, 1, 2, 0, 30)],
+            "fair_price": [100.0, 120.0, 110.0],
+            "spread": [0.001, 0.002, 0.001],
+        }
+    )
+    scheduler = SessionScheduler(quotes, n_levels=6)
+    # the second time step is outside the first hour, it is not used for the grid
+    assert scheduler.grids["fair_price"].to_list() == [100.0, 110.0]
+
+    orders = pl.DataFrame(
+        {
+            "timestamp": [datetime(2025, 1, 1, 2), datetime(2025, 1, 1, 3), datetime(2025, 1, 2, 2)],
+            "side": ["buy", "buy", "buy"],
+            "size": [150_000.0, 150_000.0, 100_000.0],
+        }
+    )
+    fills = scheduler.match(orders)
+    first_day = OrderBook(6).get_base_pricing(datetime(2025, 1, 1), 100.0, 0.001).asks
+    second_day = OrderBook(6).get_base_pricing(datetime(2025, 1, 2), 110.0, 0.001).asks
+    # the consumed levels are refilled, so the second order trades at the same prices as the first one
+    assert fills["price"].to_list() == first_day["ask"].head(2).to_list() * 2 + [second_day["ask"][0]]
+    assert scheduler.book.asks.drop("timestamp_ask").equals(second_day.drop("timestamp_ask"))
+
+    # no look-ahead: a grid is only active once its quoting window is over
+    assert scheduler.grids["active_from"].to_list() == [datetime(2025, 1, 1, 1), datetime(2025, 1, 2, 1)]
+    in_window = pl.DataFrame(
+        {
+            "timestamp": [datetime(2025, 1, 1, 0, 45), datetime(2025, 1, 2, 0, 45)],
+            "side": ["buy", "buy"],
+            "size": [100_000.0, 100_000.0],
+        }
+    )
+    scheduler = SessionScheduler(quotes, n_levels=6)
+    fills = scheduler.match(in_window)
+    assert fills["order_id"].to_list() == [1] and fills["price"].to_list() == [first_day["ask"][0]]
+
+    # a level added off the grid is traded but not refilled
+    book = scheduler.book
+    book.update_order(price=first_day["ask"][0] - 0.01, size=50_000, side="ask")
+    fills = scheduler.match(in_window.tail(1).with_columns(size=pl.lit(150_000.0)))
+    assert fills["size"].to_list() == [50_000.0, 100_000.0]
+    assert book.get_best_ask()[:2] == (first_day["ask"][0], 100_000.0)
+
+
+def test_quoting_service_in_process():
+
+    history = TradeHistory()
+    service = QuotingService(n_levels=6, trade_history=history, max_pending_orders=8)
+    ticks = SyntheticTickSource(end_timestamp=datetime(2025, 1, 3), seed=1, batch_size=10)
+    stats = asyncio.run(service.run(ticks, order_flow(200, rate=10_000, burst_size=10, seed=1)))
+
+    assert stats["ticks"] == 49
+    assert stats["quotes"] + stats["coalesced_ticks"] == 48  # the first tick has no volatility yet
+    assert stats["orders"] == 200
+    assert stats["fills"] == len(history)
+    latencies = service.latency_stats()
+    assert latencies["count"].to_list() == [stats["quotes"], 200]
+    assert (latencies["p50_us"] <= latencies["p99_us"]).all()
+    assert (latencies["p99_us"] <= latencies["max_us"]).all()
+
+
+def test_quoting_service_coalesces_ticks_and_bounds_orders():
+
+    async def scenario():
+        service = QuotingService(n_levels=6, max_pending_orders=2)
+        service._bind_loop()
+        quoter = asyncio.create_task(service._quote_loop())
+        service.push_tick(datetime(2025, 1, 1, 0, 0), 100.0)
+        await asyncio.sleep(0)
+        # the ticks pushed while the quote task is busy are coalesced, only the latest one is quoted
+        for minute, price in enumerate([100.1, 100.2, 100.3], 1):
+            service.push_tick(datetime(2025, 1, 1, 0, minute), price)
+        await asyncio.sleep(0)
+        assert (service.n_ticks, service.n_coalesced, service.n_quotes) == (4, 2, 1)
+        assert service.fair_price == 100.3 and service.book.get_best_bid()[0] <= 100.3 <= service.book.get_best_ask()[0]
+
+        # the order queue is bounded: submit waits until the order task catches up
+        await service.submit(("buy", 100_000))
+        await service.submit(("sell", 100_000))
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(service.submit(("buy", 100_000)), 0.05)
+        matcher = asyncio.create_task(service._order_loop())
+        await service.submit(("buy", 100_000))
+        await service.orders.join()
+        assert service.n_orders == 3 and service.n_fills >= 3
+        for task in (quoter, matcher):
+            task.cancel()
+        await asyncio.gather(quoter, matcher, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_quoting_service_raises_the_errors_of_its_tasks(monkeypatch):
+
+    class ZeroPriceTicks(TickSource):
+        def batches(self):
+            timestamps = [datetime(2025, 1, 1, hour) for hour in range(5)]
+            yield pl.DataFrame({"timestamp": timestamps, "fair_price": [100.0, 100.1, 0.0, 100.2, 100.3]}, schema=TICK_SCHEMA)
+
+    # a failed quote stops the run instead of leaving the book on the last good quote
+    with pytest.raises(ValueError):
+        asyncio.run(asyncio.wait_for(QuotingService(n_levels=6).run(ZeroPriceTicks(), tick_interval=0.001), 5))
+
+    def failing_match(*args, **kwargs):
+        raise RuntimeError("match failed")
+
+    # a failed match does not leave orders.join() waiting forever
+    monkeypatch.setattr(service_module, "_match_orders", failing_match)
+    ticks = SyntheticTickSource(end_timestamp=datetime(2025, 1, 2), seed=1)
+    with pytest.raises(RuntimeError, match="match failed"):
+        asyncio.run(asyncio.wait_for(QuotingService(n_levels=6).run(ticks, order_flow(10, seed=1)), 5))
+
+
+def test_order_queues_fill_in_time_priority():
+
+    base_date = datetime(2025, 1, 1)
+    book = ArrayOrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+    best_ask, house_size, _, _ = book.get_best_ask()
+    first = book.add_order(best_ask, 50_000, "ask", client=True, timestamp=base_date)
+    second = book.add_order(best_ask, 70_000, "ask", client=True, timestamp=base_date)
+    assert book.get_best_ask()[1] == house_size + 120_000
+
+    book.amend_order(first, 40_000)  # a decrease keeps the queue position
+    assert [order.order_id for order in book.get_queue(best_ask, "ask")][1:] == [first, second]
+    orders = pl.DataFrame({"timestamp": [base_date], "side": ["buy"], "size": [house_size + 60_000.0]})
+    fills, _ = match_market_orders(book, orders, requote=False)
+    assert fills["size"].to_list() == [house_size, 40_000, 20_000]
+    assert fills["client"].to_list() == [False, True, True]
+    assert book.get_order(first) is None and book.get_order(second).size == 50_000
+    assert book.get_best_ask()[:2] == (best_ask, 50_000)
+
+    book.cancel_order(second)
+    assert book.get_best_ask()[0] > best_ask and not book.orders
+
+    # delete_order only removes the level with this price and size, not every level of the same size
+    polars_book = OrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+    price, size, _, _ = polars_book.get_best_bid()
+    polars_book.delete_order(price, size, "bid")
+    assert polars_book.bids.height == 14
+
+
+def test_post_market_order_logs_the_traded_sizes(capsys):
+
+    history = get_history()
+    for engine in (OrderBook, ArrayOrderBook):
+        book = engine(10)
+        for i in range(3):
+            book.update_order(price=100 + i * 0.01, size=1.0, side="ask")
+        n_trades = len(history)
+        MarketOrder(1.5, "bid").post_market_order(book)
+        logged = history.to_polars().slice(n_trades)
+        assert logged["size"].to_list() == [1.0, 0.5] and logged["price"].to_list() == [100.0, 100.01]
+        assert book.get_best_ask()[:2] == (100.01, 0.5)
+
+        # the rest of the order is posted on its own side once the opposite side is empty
+        MarketOrder(3.0, "bid").post_market_order(book)
+        assert book.get_best_ask()[0] is None and book.get_best_bid()[:2] == (100.02, 1.5)
+        assert book.get_best_bid()[3]  # a client order
+        with pytest.raises(Exception):
+            MarketOrder(1.0, "bid").post_market_order(engine(10))
+        MarketOrder(1.0, "ask").post_market_order(book)  # sells against the posted bid
+        assert book.get_best_bid()[:2] == (100.02, 0.5)
+    assert capsys.readouterr().out == ""
+
+
+def _check_sweep_kernel(kernel, timestamp: np.datetime64):
+    """The kernel sweeps like _sweep_numpy on random orders, with requotes interleaved and sweeps resumed."""
+
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        side, requote = str(rng.choice(["bid", "ask"])), bool(rng.integers(2))
+        books = [ArrayOrderBook(15).get_base_pricing(datetime(2025, 1, 1), 100, 0.001) for _ in range(2)]
+        for book in books:
+            book.update_order(100.03 if side == "ask" else 99.97, 250_000, side, client=True)
+        for _ in range(5):
+            size, fair_price = float(rng.integers(1, 60) * 50_000), 100 + rng.normal(0, 0.02)
+            # a small requote volume and fill buffer, so that requotes interleave and sweeps resume
+            fills = [order_book.FillBuffer(8), order_book.FillBuffer(8)]
+            loop = order_book._sweep_compiled(
+                books[0].get_side(side), size, timestamp, fair_price, requote, 1_350_000, fills[0], kernel=kernel
+            )
+            vectorized = order_book._sweep_numpy(
+                books[1].get_side(side), size, timestamp, fair_price, requote, 1_350_000, fills[1]
+            )
+            assert loop == vectorized and fills[0].n == fills[1].n
+            assert np.array_equal(fills[0].prices[: fills[0].n], fills[1].prices[: fills[1].n])
+            assert np.array_equal(fills[0].sizes[: fills[0].n], fills[1].sizes[: fills[1].n])
+            assert books[0].get_order_book().equals(books[1].get_order_book())
+
+
+def test_sweep_kernels_agree():
+
+    # the timestamps of any unit are stored in microseconds
+    for unit in ("us", "ns", "s"):
+        _check_sweep_kernel(order_book._sweep_loop, np.datetime64("2025-01-01T10:00:01", unit))
+
+
+def test_compiled_sweep_kernel_agrees():
+
+    pytest.importorskip("numba")
+
+    for unit in ("us", "ns"):
+        _check_sweep_kernel(order_book._sweep_kernel, np.datetime64("2025-01-01T10:00:01", unit))
+
+
+def test_vectorized_adjust_probability():
+
+    probabilities = np.array([0.1, 0.5, 0.9])
+    sizes = np.array([100_000.0, 1_000_000.0, 5_000_000.0, 10_000_000.0])
+    for params in ({"method": "exp"}, {"method": "hill", "exponent": 2.0}, {"method": "logistic", "slope": 2e-6}):
+        expected = np.array([[utils.adjust_probability(p, size, **params) for size in sizes] for p in probabilities])
+        assert np.allclose(utils.adjust_probability(probabilities[:, None], sizes[None, :], **params), expected)
+        pairs = pl.DataFrame({"p": probabilities.repeat(len(sizes)), "size": np.tile(sizes, len(probabilities))})
+        adjusted = pairs.select(utils.adjust_probability(pl.col("p"), pl.col("size"), **params)).to_series()
+        assert np.allclose(adjusted.to_numpy().reshape(expected.shape), expected)
+
+        table = utils.size_weight_table(sizes, **params)
+        assert utils.size_weight_table(sizes.tolist(), **params) is table
+        assert np.allclose(table.grid(probabilities), expected)
+        assert np.allclose(table.adjust(probabilities[:, None], sizes[::-1][None, :]), expected[:, ::-1])
+        # inverse CDF sampling draws the sizes in proportion to their weights
+        drawn = table.sample(200_000, np.random.default_rng(0))
+        frequencies = np.bincount(table.index(drawn), minlength=len(sizes)) / len(drawn)
+        assert np.allclose(frequencies, table.weights / table.weights.sum(), atol=5e-3)
+
+
+def test_quoting_state_incremental_matches_batch():
+
+    rng = np.random.default_rng(0)
+    start = np.datetime64("2025-01-01T20:00", "us")
+    ticks = pl.DataFrame(
+        {
+            "timestamp": start + np.arange(40) * np.timedelta64(10, "m"),  # crosses midnight
+            "fair_price": 100 + rng.normal(0, 0.1, 40).cumsum(),
+            "volatility": rng.uniform(0.001, 0.01, 40),
+        }
+    )
+    fills = pl.DataFrame(
+        {  # some fills at the same time as a tick, they come after its quote
+            "timestamp": np.sort(start + rng.integers(0, 400, 60) * np.timedelta64(1, "m")),
+            "side": rng.choice(["buy", "sell"], 60),
+            "size": rng.integers(1, 50, 60) * 100_000.0,
+        }
+    )
+    params = {"lambda_val": 2, "bid_asymetry": 0.4, "inventory_skew": 0.5, "daily_volume": 1_000_000.0}
+
+    state = utils.QuotingState(**params)
+    quotes, events = [], fills.iter_rows()
+    fill = next(events, None)
+    for timestamp, fair_price, volatility in ticks.iter_rows():
+        while fill is not None and fill[0] < timestamp:
+            state.on_fill(*fill)
+            fill = next(events, None)
+        quotes.append(state.quote(timestamp, fair_price, volatility))
+    while fill is not None:
+        state.on_fill(*fill)
+        fill = next(events, None)
+
+    batch_state = utils.QuotingState(**params)
+    batch = batch_state.quote_batch(ticks, fills)
+    assert batch.select("spread", "bid", "ask").rows() == quotes
+    assert batch_state == state and batch_state.inventory != 0
+    assert utils.QuotingState.from_dict(state.to_dict()) == state
+    # without skew nor volume, the quotes are the ones of compute_bid_ask
+    assert utils.QuotingState().quote_batch(ticks).drop("daily_volume", "inventory").equals(utils.compute_bid_ask(ticks))
+
+
+def test_market_config_runs_side_by_side(tmp_path, monkeypatch):
+
+    path = tmp_path / "thin.toml"
+    path.write_text(
+        'volume_list = [100_000, 400_000]\nsize_ladder = [100_000, 200_000, 500_000]\nn_levels = 6\n'
+        'level_sizes = [50_000, 50_000, 100_000, 100_000, 200_000, 200_000]\n\n[fair_price_params]\nsigma = 0.01\n'
+    )
+    thin = MarketConfig.load(path)
+    assert thin.volume_normaliser == 500_000 and thin.fair_price_params == {"sigma": 0.01}
+    yaml_path = tmp_path / "thin.yaml"
+    yaml_path.write_text(
+        "volume_list: [100000, 400000]\nsize_ladder: [100000, 200000, 500000]\nn_levels: 6\n"
+        "level_sizes: [50000, 50000, 100000, 100000, 200000, 200000]\nfair_price_params: {sigma: 0.01}\n"
+    )
+    if config.yaml is not None:
+        assert MarketConfig.load(yaml_path) == thin
+    assert MarketConfig.from_dict(thin.to_dict()) == thin
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        thin.n_levels = 15
+    with pytest.raises(TypeError):
+        thin.fair_price_params["sigma"] = 0.5
+    assert pickle.loads(pickle.dumps(thin)) == thin and copy.deepcopy(thin) == thin
+    assert thin.to_dict()["fair_price_params"] == {"sigma": 0.01}
+    # the books of a manager take the depth of its config
+    manager = BookManager({"USDBRL": 5.0}, config=thin)
+    assert manager.n_levels == manager.get_book("USDBRL").n_levels == 6
+    with pytest.raises(Exception):
+        MarketConfig(n_levels=4, level_sizes=[100_000] * 5)
+
+    params = {"end_timestamp": datetime(2025, 1, 15), "seed": 2}
+    default, thin_run = Backtest(**params).run(), Backtest(**params, config=thin).run()
+    assert not thin_run.equals(default)
+    # the globals of values.py are only read once, for the default config
+    monkeypatch.setattr(values, "VOLUME_LIST", [1.0])
+    assert Backtest(**params).run().equals(default)
+    assert Backtest(**params, config=thin).run().equals(thin_run)
+
+
+def test_simulate_fair_price_seeds_and_layouts():
+
+    end = datetime(2025, 1, 10)
+    single = utils.simulate_fair_price(end_timestamp=end, seed=7)
+    assert single.equals(utils.simulate_fair_price(end_timestamp=end, rng=np.random.default_rng(7)))
+    assert not single.equals(utils.simulate_fair_price(end_timestamp=end, seed=8))
+
+    long = utils.simulate_fair_price(end_timestamp=end, n_paths=3, seed=7)
+    wide = utils.simulate_fair_price(end_timestamp=end, n_paths=3, layout="wide", seed=7)
+    assert long.height == 3 * wide.height
+    for k in range(3):
+        path = long.filter(path=k)
+        assert path["timestamp"].equals(wide["timestamp"])
+        assert path["Fair Price"].to_list() == wide[f"Fair Price_{k}"].to_list()
+    # the path k does not depend on the number of paths
+    more = utils.simulate_fair_price(end_timestamp=end, n_paths=4, layout="wide", seed=7)
+    assert more.drop("Fair Price_3").equals(wide)
+
+
+def test_running_volatility_matches_expanding_std():
+
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0, 0.01, 200)
+    returns[[0, 50, 51, 120]] = np.nan  # a missing first return, and gaps
+    one_by_one = utils.RunningVolatility()
+    expected = [np.nan if (std := one_by_one.update(x)) is None else std for x in returns]
+    for chunks in ([returns], np.array_split(returns, 7)):
+        batch = utils.RunningVolatility()
+        stds = np.concatenate([batch.update_many(chunk) for chunk in chunks])
+        assert np.allclose(stds, expected, equal_nan=True, rtol=1e-9)
+        assert batch.count == one_by_one.count and np.isclose(batch.std, one_by_one.std)
+
+    # expanding_std skips the first (null) log return
+    clean = returns[~np.isnan(returns)]
+    assert np.allclose(utils.RunningVolatility().update_many(clean), utils.expanding_std(np.r_[np.nan, clean])[1:])
+
+
+def test_generate_market_order_lazy_and_sampled():
+
+    prices = utils.simulate_fair_price(end_timestamp=datetime(2025, 2, 1), seed=3)
+    quotes = utils.compute_all_bid_ask(prices)
+    probabilities = utils.generate_market_order(quotes)
+    lazy = utils.generate_market_order(quotes.lazy())
+    assert isinstance(lazy, pl.LazyFrame) and lazy.collect().equals(probabilities)
+    spread_bid = (quotes["fair_price"] - quotes["bid"]).to_numpy()
+    assert np.allclose(probabilities["prob_trade_bid"].to_numpy(), 1 - np.exp(-np.exp(-5 * spread_bid)), equal_nan=True)
+
+    orders = utils.generate_market_order(quotes, sample=True, seed=1)
+    assert orders.equals(utils.sample_market_orders(probabilities, seed=1))
+    assert not orders.equals(utils.generate_market_order(quotes, sample=True, seed=2))
+    assert orders.columns == ["timestamp", "fair_price", "side", "size"]
+    assert set(orders["side"]) == {"buy", "sell"}
+    assert orders["size"].is_in(utils.vl.TRADE_SIZE_LADDER).all()
+    assert orders["timestamp"].is_sorted()
+
+
+def test_track_pnl_matches_trade_by_trade_loop():
+
+    rng = np.random.default_rng(4)
+    prices = utils.simulate_fair_price(end_timestamp=datetime(2025, 1, 5), seed=4)
+    n = 40
+    trades = pl.DataFrame(
+        {
+            "timestamp": np.sort(rng.choice(prices["timestamp"].to_numpy(), n)),
+            "side": rng.choice(["buy", "sell"], n),
+            "price": 100 + rng.normal(0, 0.5, n),
+            "size": rng.integers(1, 10, n) * 100_000.0,
+        }
+    )
+    # reference: the last fair price at each trade, one trade at a time
+    fair = dict(prices.iter_rows())
+    inventory, pnl, expected = 1_000_000.0, 0.0, []
+    for timestamp, side, price, size in trades.iter_rows():
+        sign = 1 if side == "buy" else -1
+        inventory -= sign * size
+        pnl += sign * size / fair[timestamp] * (price - fair[timestamp])
+        expected.append((timestamp, pnl, inventory))
+
+    records = utils.track_pnl(prices, trades, 1_000_000.0)
+    assert records.columns == ["timestamp", "pnl", "inventory"]
+    assert np.allclose(records["pnl"].to_numpy(), [row[1] for row in expected])
+    assert records["inventory"].to_list() == [row[2] for row in expected]
+    assert utils.track_pnl(prices.lazy(), trades.lazy(), 1_000_000.0).collect().equals(records)
+
+    # consuming the trade log batch by batch gives the same records
+    tracker = utils.PnlTracker(inventory=1_000_000.0, fx_revaluation=True)
+    batches = pl.concat([tracker.update(prices, trades.slice(start, 15)) for start in range(0, n, 15)])
+    assert np.allclose(batches["pnl"].to_numpy(), records["pnl"].to_numpy())
+    assert tracker.mark(fair[trades["timestamp"][-1]]) == tracker.pnl + tracker.fx_pnl
+
+
+def test_columnar_trade_history():
+
+    history = TradeHistory(capacity=2)
+    history.log("buy", 100.0, 100_000.0, False, datetime(2025, 1, 1, 10))
+    history.log("sell", 99.0, 200_000.0, True, np.datetime64("2025-01-01T11:00"))
+    history.log("sell", 98.0, 300_000.0, False, np.datetime64("2025-01-02T09:00", "us"))
+    with pytest.raises(Exception):
+        history.log("bid", 100.0, 100_000.0, False, datetime(2025, 1, 2))
+    assert len(history) == 3 and history.capacity == 4
+
+    batch = pl.DataFrame(
+        {
+            "timestamp": [datetime(2025, 1, 2, 12), datetime(2025, 1, 3)],
+            "side": ["buy", "sell"],
+            "price": [101.0, 102.0],
+            "size": [400_000.0, 500_000.0],
+            "client": [False, False],
+        }
+    )
+    history.extend(batch)
+    with pytest.raises(Exception):
+        history.extend(batch.with_columns(side=pl.lit("ask")))
+    assert len(history) == 5
+
+    frame = history.to_polars()
+    assert frame.schema == pl.Schema(
+        {"timestamp": pl.Datetime("us"), "side": trade.SIDE_DTYPE, "price": pl.Float64, "size": pl.Float64, "client": pl.Boolean}
+    )
+    assert frame["side"].cast(pl.String).to_list() == ["buy", "sell", "sell", "buy", "sell"]
+    assert frame["size"].to_list() == [100_000.0, 200_000.0, 300_000.0, 400_000.0, 500_000.0]
+    assert history.trades[1] == {
+        "timestamp": datetime(2025, 1, 1, 11), "side": "sell", "price": 99.0, "size": 200_000.0, "client": True
+    }
+    # the per-day volumes are keyed by date, whatever the type of the timestamps
+    assert history.daily_volume == {date(2025, 1, 1): 300_000.0, date(2025, 1, 2): 700_000.0, date(2025, 1, 3): 500_000.0}
+    for day in history.daily_volume:
+        assert utils.compute_volume_history(history, day) == utils.compute_volume_history(frame, day)
+
+    # the shared history is created on first use, trade.history goes through the module __getattr__
+    assert trade.history is trade.get_history()
+
+
+def test_match_market_orders_stream():
+
+    base_date = datetime(2025, 1, 1)
+    orders = pl.DataFrame(
+        {
+            "timestamp": [base_date, base_date, base_date],
+            "side": ["buy", "sell", "buy"],
+            "size": [250_000.0, 100_000.0, 300_000.0],
+        }
+    )
+    book = OrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+    asks = book.asks["ask"].to_list()
+    fills, _ = match_market_orders(ArrayOrderBook.from_order_book(book), orders, requote=False)
+    # without requotes the orders walk the ladder: 100k levels at the top of the book
+    assert fills["order_id"].to_list() == [0, 0, 0, 1, 2, 2, 2, 2]
+    assert fills["price"].to_list()[:3] == asks[:3] and fills["size"].to_list()[:3] == [100_000.0, 100_000.0, 50_000.0]
+    assert fills["price"].to_list()[4:] == asks[2:6] and fills["size"].to_list()[4:] == [50_000.0, 100_000.0, 100_000.0, 50_000.0]
+    assert fills.group_by("order_id").agg(pl.col("size").sum()).sort("order_id")["size"].to_list() == orders["size"].to_list()
+
+    # a Polars book and an ArrayOrderBook give the same fills and book, with requotes and a trade history
+    array_book = ArrayOrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+    history = TradeHistory()
+    array_fills, _ = match_market_orders(array_book, orders, fair_price=100, trade_history=history)
+    polars_fills, book = match_market_orders(book, orders, fair_price=100)
+    assert array_fills.equals(polars_fills) and len(history) == array_fills.height
+    assert array_book.get_order_book().equals(book.get_order_book())
+    with pytest.raises(Exception):
+        match_market_orders(array_book, orders)  # no fair price for the requotes
+
+    # a consumed level is requoted further away from the fair price, as with compute_one_new_ask
+    array_book = ArrayOrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+    match_market_orders(array_book, orders.head(1).with_columns(size=pl.lit(100_000.0)), fair_price=100)
+    requoted = utils.compute_one_new_ask(100, asks[0], 100_000)
+    assert asks[0] < requoted < asks[1]
+    assert array_book.get_best_ask()[:2] == (requoted, 100_000.0)
+
+
+def test_backtest_resumes_from_checkpoint(tmp_path, monkeypatch):
+
+    params = {"end_timestamp": datetime(2025, 1, 21), "seed": 5, "chunk_size": 96, "checkpoint_every": 1}
+    uninterrupted = Backtest(**params, output_dir=tmp_path / "full").run()
+
+    # the run crashes in its fourth chunk, after three checkpoints
+    simulate_chunk, calls = Backtest._simulate_chunk, []
+
+    def crash(self, *args):
+        calls.append(1)
+        if len(calls) == 4:
+            raise RuntimeError("crash")
+        return simulate_chunk(self, *args)
+
+    monkeypatch.setattr(Backtest, "_simulate_chunk", crash)
+    with pytest.raises(RuntimeError):
+        Backtest(**params, output_dir=tmp_path / "resumed").run()
+    monkeypatch.setattr(Backtest, "_simulate_chunk", simulate_chunk)
+    resumed = Backtest(**params, output_dir=tmp_path / "resumed")
+    assert resumed._load_checkpoint().step == 3 * 96
+    assert resumed.run().equals(uninterrupted)
+
+    full_fills = Backtest(**params, output_dir=tmp_path / "full").scan("fills").sort("timestamp", "order_id").collect()
+    assert resumed.scan("fills").sort("timestamp", "order_id").collect().equals(full_fills)
+    assert full_fills.height == uninterrupted["fills"][0]
+
+
+def test_backtest_single_tick_and_one_tick_chunks():
+
+    # the first chunk simulates size - 1 prices after the initial one, none for a single tick
+    single = Backtest(seed=1, end_timestamp=datetime(2025, 1, 1)).run()
+    assert single.select("ticks", "orders", "fills").row(0) == (1, 0, 0)
+    one_tick_chunks = Backtest(seed=1, end_timestamp=datetime(2025, 1, 3), chunk_size=1).run()
+    assert one_tick_chunks["ticks"][0] == Backtest(seed=1, end_timestamp=datetime(2025, 1, 3)).run()["ticks"][0] == 49
+
+
+def test_run_sweep_is_deterministic_across_workers(monkeypatch):
+
+    grid = {"lambda_val": [1, 3], "alpha": [0.0]}
+    backtest_params = {"end_timestamp": datetime(2025, 1, 8), "n_levels": 6}
+    serial = run_sweep(grid, n_seeds=2, backtest_params=backtest_params, seed=11, n_workers=1)
+    assert serial.height == 4 and serial["seed"].to_list() == [0, 1, 0, 1]
+    assert serial.equals(run_sweep(grid, n_seeds=2, backtest_params=backtest_params, seed=11, n_workers=2))
+    # the two seeds give different order flows
+    assert serial["orders"][0] != serial["orders"][1]
+    with pytest.raises(ValueError):
+        run_sweep({"lambda": [1]}, backtest_params=backtest_params, n_workers=1)
+    # the seeds come from the seed argument, not from the grid
+    for reserved in ("seed", "fair_prices", "config"):
+        with pytest.raises(ValueError, match=reserved):
+            run_sweep({reserved: [None]}, backtest_params=backtest_params, n_workers=1)
+    with pytest.raises(ValueError):
+        run_sweep(grid, backtest_params=backtest_params | {"seed": 3}, n_workers=1)
+
+    # the workers get one Polars thread, and the setting of the parent is restored after the pool
+    monkeypatch.setenv("POLARS_MAX_THREADS", "4")
+    with _process_pool(1):
+        assert os.environ["POLARS_MAX_THREADS"] == "1"
+    assert os.environ["POLARS_MAX_THREADS"] == "4"
+
+
+def test_cached_snapshots_and_depth():
+
+    base_date = datetime(2025, 1, 1)
+    for book in (
+        OrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001),
+        ArrayOrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001),
+    ):
+        snapshot = book.get_order_book()
+        assert book.get_order_book() is snapshot  # no mutation, no rebuild
+        bid_prices, bid_sizes, ask_prices, ask_sizes = book.get_depth(3)
+        assert bid_prices.tolist() == book.bids["bid"].head(3).to_list()
+        assert ask_sizes.tolist() == book.asks["size_ask"].head(3).to_list()
+        with pytest.raises(ValueError):
+            bid_sizes[0] = 0  # read-only
+
+        price, size, _, _ = book.get_best_ask()
+        book.update_order(price=price, size=size / 2, side="ask")
+        assert book.get_order_book() is not snapshot
+        assert book.get_order_book()["size_ask"][0] == size / 2
+        assert book.get_depth()[3][0] == size / 2 and len(book.get_depth()[0]) == 15
+
+
+def test_partitioned_scans_match_in_memory(tmp_path):
+
+    rng = np.random.default_rng(6)
+    prices = utils.simulate_fair_price(end_timestamp=datetime(2025, 1, 4), seed=6)
+    history = TradeHistory()
+    for timestamp in np.sort(rng.choice(prices["timestamp"].to_numpy(), 30, replace=False)):
+        history.log(str(rng.choice(["buy", "sell"])), 100 + rng.normal(), float(rng.integers(1, 10)) * 1e5, False, timestamp)
+    trades = history.to_polars()
+
+    for file_format in ("parquet", "ipc"):
+        paths = history.write(tmp_path / file_format, file_format)
+        assert sorted(path.parent.name for path in paths) == [f"date={day}" for day in sorted(history.daily_volume)]
+        scanned = storage.scan_partitioned(tmp_path / file_format, file_format)
+        assert scanned.sort("timestamp").drop("date").collect().with_columns(pl.col("side").cast(trades["side"].dtype)).equals(trades)
+        for day in [*history.daily_volume, date(2024, 12, 31)]:
+            assert utils.compute_volume_history(scanned, day) == utils.compute_volume_history(history, day)
+        assert np.allclose(
+            utils.track_pnl(prices.lazy(), scanned, 0).collect()["pnl"].to_numpy(),
+            utils.track_pnl(prices, trades, 0)["pnl"].to_numpy(),
+        )
+
+
+def test_backtest_scans_a_run_without_fills(tmp_path):
+
+    params = {"end_timestamp": datetime(2025, 1, 3), "seed": 1, "fx_revaluation": True}
+    traded = Backtest(**params, output_dir=tmp_path / "traded")
+    traded.run()
+    for sink in ("parquet", "ipc"):
+        quiet = Backtest(**params, base_intensity=0, sink=sink, output_dir=tmp_path / f"quiet-{sink}")
+        assert quiet.run()["fills"][0] == 0
+        for name in ("fills", "pnl"):
+            # nothing was written, the scans are empty with the schema of the written records
+            empty = quiet.scan(name).collect()
+            assert empty.height == 0 and empty.schema == traded.scan(name).collect_schema()
+
+
+def test_file_tick_source_round_trip(tmp_path):
+
+    with pytest.raises(TypeError):
+        TickSource()  # batches() is abstract
+
+    prices = utils.simulate_fair_price(end_timestamp=datetime(2025, 1, 20), seed=8).rename({"Fair Price": "fair_price"})
+    prices.write_csv(tmp_path / "ticks.csv")
+    prices.write_parquet(tmp_path / "ticks.parquet")
+    for name in ("ticks.csv", "ticks.parquet"):
+        batches = list(FileTickSource(tmp_path / name, batch_size=100).batches())
+        assert all(batch.height <= 100 for batch in batches)
+        assert pl.concat(batches).equals(prices)
+
+    # (bid, ask) columns give their mid
+    quotes = prices.with_columns(bid=pl.col("fair_price") - 0.01, ask=pl.col("fair_price") + 0.01)
+    quotes.write_parquet(tmp_path / "quotes.parquet")
+    mids = pl.concat(FileTickSource(tmp_path / "quotes.parquet", price_column=("bid", "ask")).batches())
+    assert np.allclose(mids["fair_price"].to_numpy(), prices["fair_price"].to_numpy())
+
+    # streaming quotes over the file gives the quotes of the whole history
+    streamed = pl.concat(stream_quotes(FileTickSource(tmp_path / "ticks.parquet", batch_size=50)))
+    expected = utils.compute_all_bid_ask(prices.rename({"fair_price": "Fair Price"}))
+    assert np.allclose(streamed["ask"].to_numpy(), expected["ask"].to_numpy(), equal_nan=True)
+
+
+def test_synthetic_tick_source_single_tick_and_one_row_batches():
+
+    start = datetime(2025, 1, 1)
+    (single,) = SyntheticTickSource(start_timestamp=start, end_timestamp=start, initial_price=5.0, seed=3).batches()
+    assert single.rows() == [(start, 5.0)]
+
+    one_row = list(SyntheticTickSource(end_timestamp=datetime(2025, 1, 2), seed=3, batch_size=1).batches())
+    assert len(one_row) == 25 and all(batch.height == 1 for batch in one_row)
+    ticks = pl.concat(one_row)
+    assert ticks["fair_price"][0] == 100.0 and ticks["timestamp"].is_sorted() and ticks["fair_price"].is_not_nan().all()
+
+
+def test_queue_tick_source_backpressure():
+
+    ticks = queue.Queue(maxsize=4)
+    produced = []
+
+    def produce():
+        for k in range(50):
+            ticks.put((datetime(2025, 1, 1, 0, k), 100.0 + k))
+            produced.append(k)
+        ticks.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    batches = QueueTickSource(ticks, batch_size=5, timeout=0.05).batches()
+    first = next(batches)
+    time.sleep(0.2)
+    # the bounded queue blocks the producer while the consumer does not ask for more ticks
+    assert first.height == 5 and len(produced) <= 5 + 4 + 1
+    rest = list(batches)
+    producer.join(timeout=5)
+    assert [price for batch in [first, *rest] for price in batch["fair_price"]] == [100.0 + k for k in range(50)]
+
+
+def test_book_manager_executors_are_deterministic():
+
+    manager = BookManager(
+        {"USDBRL": 5.0, "USDMXN": 18.0, "USDCLP": 950.0},
+        n_levels=10,
+        correlation=np.array([[1, 0.6, 0.3], [0.6, 1, 0.4], [0.3, 0.4, 1]]),
+        backtest_params={"end_timestamp": datetime(2025, 1, 4)},
+    )
+    serial = manager.run(seed=11, n_workers=1)
+    assert serial["pair"].to_list() == ["USDBRL", "USDMXN", "USDCLP", "TOTAL"]
+    assert serial["ticks"][-1] == 3 * serial["ticks"][0]
+    # the books of the pairs hold the last levels of their backtests
+    books = {pair: manager.get_book(pair).get_order_book() for pair in manager.pairs}
+    for pair, last_fair_price in zip(manager.pairs, serial["last_fair_price"]):
+        best_bid, best_ask = manager.get_book(pair).get_best_bid()[0], manager.get_book(pair).get_best_ask()[0]
+        assert manager.get_book(pair).n_levels == 10 and best_bid < best_ask
+        assert abs(best_ask / last_fair_price - 1) < 0.1
+    # each pair has its own random stream, so the sharding and the executor do not change the results
+    assert manager.run(seed=11, n_workers=2, executor="thread").equals(serial)
+    assert manager.run(seed=11, n_workers=2, executor="process").equals(serial)
+    assert all(manager.get_book(pair).get_order_book().equals(book) for pair, book in books.items())
+    assert not manager.run(seed=12, n_workers=1).equals(serial)
+
+
+def test_metrics_nest_and_count_a_known_sweep():
+
+    original = trade._match_orders
+    base_date = datetime(2025, 1, 1)
+    with metrics.instrument() as outer:
+        book = ArrayOrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+        _, level_size, _, _ = book.get_best_ask()
+        with metrics.instrument() as inner:
+            orders = pl.DataFrame({"timestamp": [base_date] * 2, "side": ["buy", "sell"], "size": [2.5 * level_size, level_size]})
+            fills, _ = trade.match_market_orders(book, orders, requote=False)
+        # leaving the inner registry restores the hooks of the outer one
+        assert metrics.is_enabled()
+        book.get_base_pricing(base_date, fair_price=100, spread=0.001)
+
+    assert not metrics.is_enabled() and trade._match_orders is original
+    assert fills["size"].to_list() == [level_size, level_size, level_size / 2, level_size]
+    assert inner.counters == {"match.orders": 2, "match.fills": 4}
+    assert inner.distributions["match.levels_swept_per_order"].total == 2
+    assert inner.timers["trade.match_market_orders"].count == 1
+    assert "match.orders" not in outer.counters and "trade.match_market_orders" not in outer.timers
+    assert outer.timers["ArrayOrderBook.get_base_pricing"].count == 2
+    assert "ArrayOrderBook.get_base_pricing" not in inner.timers
+    metrics.disable()  # nothing left to disable
+
+
+def test_package_imports_lazily_without_side_effects():
+
+    # a fresh interpreter: importing utils first used to go through the utils <-> trade cycle
+    statement = """
+import sys, mktmakingccy
+assert not {"polars", "numpy"} & set(sys.modules)
+# a config does not need the simulation modules either
+assert mktmakingccy.MarketConfig(fair_price_params={"sigma": 0.02}).volume_normaliser > 0
+assert not {"polars", "numpy"} & set(sys.modules)
+from mktmakingccy import utils, trade
+assert trade._history is None
+assert trade.history is trade.get_history() and trade._history is not None
+assert mktmakingccy.ArrayOrderBook is mktmakingccy.order_book.ArrayOrderBook
+assert "BookManager" in dir(mktmakingccy)
+try:
+    mktmakingccy.missing
+except AttributeError:
+    pass
+else:
+    raise AssertionError
+"""
+    result = subprocess.run([sys.executable, "-c", statement], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_metrics_exports_profiles_and_failed_calls():
+
+    base_date = datetime(2025, 1, 1)
+    with metrics.instrument() as registry:
+        # two full levels and a partial one, each counts as a level swept
+        book = ArrayOrderBook(15).get_base_pricing(base_date, fair_price=100, spread=0.001)
+        _, level_size, _, _ = book.get_best_ask()
+        MarketOrder(2.5 * level_size, "bid").post_market_order(book, trade_date=base_date)
+
+        # a failed match is still timed and counted
+        with pytest.raises(TypeError):
+            trade._match_orders(book, range(1), [base_date], [True], ["large"], [100.0], False, [], [], [], [])
+
+        with metrics.SamplingProfiler(interval=0.001, registry=registry) as profiler:
+            Backtest(end_timestamp=datetime(2025, 1, 21), seed=3).run()
+
+    swept = registry.distributions["post_market_order.levels_swept"]
+    assert (swept.count, swept.total) == (1, 3)
+    assert registry.counters["trade_history.fills_logged"] >= 3
+    assert registry.timers["trade._match_orders"].count >= 2 and registry.counters["match.orders"] >= 2
+
+    exposition = registry.to_prometheus()
+    assert "# TYPE mktmakingccy_match_orders_total counter" in exposition
+    assert f"mktmakingccy_match_orders_total {registry.counters['match.orders']}" in exposition
+    assert "# TYPE mktmakingccy_post_market_order_levels_swept summary\nmktmakingccy_post_market_order_levels_swept_sum 3\n" in exposition
+    assert f"mktmakingccy_trade__match_orders_seconds_count {registry.timers['trade._match_orders'].count}" in exposition
+    assert exposition.endswith("\n")
+
+    samples = profiler.to_polars()
+    assert samples.height > 0 and samples.columns == ["wall_time", "simulation_time", "function", "stack"]
+    # the samples taken during the backtest carry the timestamp of the tick being processed
+    ticks = samples["simulation_time"].drop_nulls()
+    assert ticks.len() > 0 and ticks.min() >= base_date and ticks.max() <= datetime(2025, 1, 21)
+    assert samples["stack"].str.contains("backtest.run").any()